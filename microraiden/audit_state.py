@@ -0,0 +1,220 @@
+"""
+Utility module used to audit the balance proofs stored in a channel manager state file.
+
+Every stored balance proof is checked to be signed by the channel's sender for the stored
+balance, and the balance is checked not to exceed the deposit. Signatures are verified in
+parallel worker processes. The state file is opened read-only and read in short batches,
+so a running proxy is not blocked while the audit runs.
+
+A JSON report is written to stdout (or to --output). The exit code is 1 if any channel
+failed the audit.
+
+Example::
+
+    $ python -m microraiden.audit_state --state-file ~/.config/microraiden/0x1234_0x5678.db
+"""
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+import urllib.parse
+from collections import deque
+from typing import List, Tuple
+
+if __package__ is None:
+    # add /microraiden/ to path
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+    sys.path.insert(0, path)
+    # remove /microraiden/microraiden/ from path
+    path = os.path.abspath(os.path.dirname(__file__))
+    if path in sys.path:
+        sys.path.remove(path)
+
+import click
+from eth_utils import decode_hex
+
+from microraiden.channel_manager.state import dict_factory
+from microraiden.utils import verify_balance_proof, is_same_address
+
+log = logging.getLogger(__name__)
+
+SELECT_CHANNELS_SQL = """
+SELECT `rowid`, `sender`, `open_block_number`, `deposit`, `balance`, `last_signature`, `state`
+FROM `channels`
+WHERE `rowid` > ?
+ORDER BY `rowid`
+LIMIT ?
+"""
+
+
+def open_read_only(state_file: str) -> sqlite3.Connection:
+    """Open a state file without write access, so that no write lock can be taken."""
+    # the path is quoted, `?`, `#` and `%` are part of the URI syntax
+    uri = 'file:%s?mode=ro' % urllib.parse.quote(os.path.abspath(state_file))
+    conn = sqlite3.connect(uri, uri=True)
+    conn.row_factory = dict_factory
+    return conn
+
+
+def iter_channel_batches(conn: sqlite3.Connection, batch_size: int):
+    """Read all channels, `batch_size` rows at a time.
+
+    Each batch is a separate, short query, so the shared lock of the database
+    is released between batches and the proxy can keep writing.
+    """
+    last_rowid = 0
+    while True:
+        rows = conn.execute(SELECT_CHANNELS_SQL, [last_rowid, batch_size]).fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1]['rowid']
+        yield rows
+
+
+def audit_channel(row: dict, receiver: str, contract_address: str) -> List[str]:
+    """
+    Returns:
+        list: names of the checks the channel failed
+    """
+    errors = []
+    balance = int(row['balance'])
+    deposit = int(row['deposit'])
+    if balance < 0:
+        errors.append('negative_balance')
+    if balance > deposit:
+        errors.append('balance_exceeds_deposit')
+    if row['last_signature'] is None:
+        if balance != 0:
+            errors.append('missing_signature')
+        return errors
+    try:
+        signer = verify_balance_proof(
+            receiver,
+            row['open_block_number'],
+            balance,
+            decode_hex(row['last_signature']),
+            contract_address
+        )
+    except Exception:
+        errors.append('malformed_signature')
+        return errors
+    if not is_same_address(signer, row['sender']):
+        errors.append('invalid_signature')
+    return errors
+
+
+def audit_batch(args: Tuple[List[dict], str, str]) -> Tuple[int, List[dict]]:
+    """Audit a batch of channels in a worker process.
+
+    Returns:
+        tuple: number of audited channels, list of failed channels
+    """
+    rows, receiver, contract_address = args
+    failed = []
+    for row in rows:
+        errors = audit_channel(row, receiver, contract_address)
+        if errors:
+            failed.append({
+                'sender': row['sender'],
+                'open_block_number': row['open_block_number'],
+                'deposit': str(row['deposit']),
+                'balance': str(row['balance']),
+                'state': row['state'],
+                'errors': errors
+            })
+    return len(rows), failed
+
+
+def audit_state(state_file: str, processes: int = None, batch_size: int = 1000) -> dict:
+    """Audit all balance proofs of a state file.
+
+    Args:
+        state_file (str): path to the state database
+        processes (int, optional): number of worker processes. Defaults to the cpu count.
+        batch_size (int, optional): number of channels read and verified at once
+    Returns:
+        dict: audit report
+    """
+    conn = open_read_only(state_file)
+    try:
+        metadata = conn.execute('SELECT * FROM `metadata`').fetchone()
+        receiver = metadata['receiver']
+        contract_address = metadata['contract_address']
+        n_audited = 0
+        failed = []
+        processes = processes or os.cpu_count() or 1
+        with multiprocessing.Pool(processes) as pool:
+            # keep a bounded number of batches in flight, so that the state
+            # is streamed rather than loaded into memory at once
+            max_pending = 2 * processes
+            pending = deque()
+            for rows in iter_channel_batches(conn, batch_size):
+                pending.append(
+                    pool.apply_async(audit_batch, [(rows, receiver, contract_address)])
+                )
+                while len(pending) >= max_pending or (pending and pending[0].ready()):
+                    n, batch_failed = pending.popleft().get()
+                    n_audited += n
+                    failed.extend(batch_failed)
+            for result in pending:
+                n, batch_failed = result.get()
+                n_audited += n
+                failed.extend(batch_failed)
+    finally:
+        conn.close()
+
+    failed.sort(key=lambda channel: (channel['sender'], channel['open_block_number']))
+    return {
+        'state_file': os.path.abspath(state_file),
+        'network_id': metadata['network_id'],
+        'receiver': receiver,
+        'contract_address': contract_address,
+        'n_channels': n_audited,
+        'n_failed': len(failed),
+        'failed': failed
+    }
+
+
+@click.command()
+@click.option(
+    '--state-file',
+    required=True,
+    help='State file of the proxy',
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True)
+)
+@click.option(
+    '--processes',
+    default=None,
+    type=int,
+    help='Number of worker processes verifying the signatures. Defaults to the cpu count.'
+)
+@click.option(
+    '--batch-size',
+    default=1000,
+    type=int,
+    help='Number of channels read from the state file at once'
+)
+@click.option(
+    '--output',
+    default='-',
+    type=click.File('w'),
+    help='File the JSON report is written to'
+)
+def main(
+        state_file: str,
+        processes: int,
+        batch_size: int,
+        output
+):
+    report = audit_state(state_file, processes=processes, batch_size=batch_size)
+    json.dump(report, output, indent=2)
+    output.write('\n')
+    log.info('Audited %d channels, %d failed', report['n_channels'], report['n_failed'])
+    sys.exit(1 if report['n_failed'] else 0)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,12 +1,26 @@
 from .manager import ChannelManager
 from .blockchain import Blockchain
+from .watcher import SharedBlockchain
 from .state import ChannelManagerState
 from .channel import Channel, ChannelState
+from .verifier import BalanceProofVerifier
+from .deferred import DeferredVerifier
+from .pending import PendingChannelWatcher
+from .disputes import DisputeScheduler
+from .transactions import TransactionWorker
+from .risk import RiskBudget
 
 __all__ = [
     ChannelManager,
     Blockchain,
+    SharedBlockchain,
     ChannelManagerState,
     Channel,
-    ChannelState
+    ChannelState,
+    BalanceProofVerifier,
+    DeferredVerifier,
+    PendingChannelWatcher,
+    DisputeScheduler,
+    TransactionWorker,
+    RiskBudget
 ]
@@ -0,0 +1,54 @@
+"""Hashes of recently processed blocks, used to locate the fork point of a reorg."""
+from collections import deque
+from typing import Callable, Optional, Tuple
+
+
+class BlockHashes(object):
+    """Ring buffer of (block number, block hash) of the most recent processed heads."""
+
+    def __init__(self, size: int = 256):
+        """
+        Args:
+            size (int, optional): number of blocks to remember. A reorg deeper than that
+                can't be located.
+        """
+        assert size > 0
+        self.hashes = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @property
+    def head_number(self) -> Optional[int]:
+        return self.hashes[-1][0] if self.hashes else None
+
+    def add(self, block_number: int, block_hash: bytes):
+        """Record a processed head. Heads at or above `block_number` are replaced."""
+        self.rollback(block_number - 1)
+        self.hashes.append((block_number, block_hash))
+
+    def rollback(self, block_number: int):
+        """Forget all blocks above `block_number`."""
+        while self.hashes and self.hashes[-1][0] > block_number:
+            self.hashes.pop()
+
+    def clear(self):
+        self.hashes.clear()
+
+    def find_fork_point(
+            self,
+            get_block_hash: Callable[[int], Optional[bytes]]
+    ) -> Optional[Tuple[int, bytes]]:
+        """Find the most recent remembered block that is still part of the canonical chain.
+
+        Args:
+            get_block_hash (callable): returns the hash of the canonical block with the
+                given number, or None if there's no such block
+        Returns:
+            tuple: (block number, block hash) of the fork point, None if all remembered
+                blocks have been replaced
+        """
+        for block_number, block_hash in reversed(self.hashes):
+            if get_block_hash(block_number) == block_hash:
+                return block_number, block_hash
+        return None
@@ -1,22 +1,34 @@
 import requests
 import sys
+import time
 import gevent
+import gevent.threadpool
 import logging
+from collections import deque
 
-from ethereum.exceptions import InsufficientBalance
 from web3 import Web3
 from web3.contract import Contract
-from web3.exceptions import BadFunctionCallOutput
-from eth_utils import is_same_address, to_checksum_address
 
 from microraiden.config import NETWORK_CFG
 from microraiden.constants import PROXY_BALANCE_LIMIT
-from microraiden.utils import get_logs
+from microraiden.utils import (
+    LogQuery,
+    RPCBatch,
+    get_channel_infos,
+    is_same_address,
+    to_checksum_address
+)
+from .block_hashes import BlockHashes
+from .chunk_size import AdaptiveChunkSize, is_range_error
+from .health import HealthSnapshot, read_health
+from .new_heads import AdaptivePolling, NewHeadsSubscription
 
 
 class Blockchain(gevent.Greenlet):
     """Class that watches the blockchain and relays events to the channel manager."""
     poll_interval = 2
+    # seconds to wait for a new block notification before the node is polled anyway
+    max_head_wait = 60
 
     def __init__(
             self,
@@ -24,8 +36,34 @@ class Blockchain(gevent.Greenlet):
             channel_manager_contract: Contract,
             channel_manager,
             n_confirmations,
-            sync_chunk_size=100 * 1000
+            sync_chunk_size=100 * 1000,
+            sync_target_latency=2.0,
+            sync_concurrency=4,
+            new_heads_endpoint=None,
+            event_cache=None,
+            health_interval=0
     ):
+        """
+        Args:
+            web3 (Web3): web3 provider
+            channel_manager_contract (Contract): channel manager contract
+            channel_manager (ChannelManager): channel manager the events are relayed to
+            n_confirmations (int): number of confirmations an event needs
+            sync_chunk_size (int, optional): initial number of blocks queried at once.
+                The number adapts to the density of logs and the response time of the node.
+            sync_target_latency (float, optional): seconds a log query should take
+            sync_concurrency (int, optional): number of block ranges fetched concurrently
+                while catching up with the confirmed history. If 1, ranges are fetched
+                one after another.
+            new_heads_endpoint (str, optional): websocket URL or IPC path of the node.
+                If set, the blockchain is updated when the node announces a new block
+                instead of being polled.
+            event_cache (EventCache, optional): local event cache. If set, the confirmed
+                history is read from the cache, which is extended with the missing blocks.
+            health_interval (float, optional): seconds between refreshes of the health
+                snapshot (balances of the receiver, node liveness). If 0, it's refreshed
+                on every update.
+        """
         gevent.Greenlet.__init__(self)
         self.web3 = web3
         self.channel_manager_contract = channel_manager_contract
@@ -34,7 +72,24 @@ class Blockchain(gevent.Greenlet):
         self.log = logging.getLogger('blockchain')
         self.wait_sync_event = gevent.event.Event()
         self.is_connected = gevent.event.Event()
-        self.sync_chunk_size = sync_chunk_size
+        self.chunk_size = AdaptiveChunkSize(
+            sync_chunk_size,
+            max_size=max(sync_chunk_size, 1000 * 1000),
+            target_latency=sync_target_latency
+        )
+        assert sync_concurrency > 0
+        self.sync_concurrency = sync_concurrency
+        self.event_cache = event_cache
+        self.new_heads = None
+        if new_heads_endpoint is not None:
+            self.new_heads = NewHeadsSubscription(new_heads_endpoint)
+            # used while the subscription is down
+            self.polling = AdaptivePolling(self.poll_interval)
+        # read by the request handlers instead of querying the node
+        self.health = HealthSnapshot()
+        self.health_interval = health_interval
+        # latest block number of the node
+        self.current_block = None
         self.running = False
         #  insufficient_balance
         #  - set to true if for some reason tx can't be send
@@ -43,65 +98,144 @@ class Blockchain(gevent.Greenlet):
         #     has ether to spend again
         self.insufficient_balance = False
         self.sync_start_block = NETWORK_CFG.start_sync_block
+        # event name => handler, events are fetched with one request per block range
+        self.unconfirmed_event_handlers = {
+            'ChannelCreated': self.unconfirmed_event_channel_created,
+            'ChannelToppedUp': self.unconfirmed_event_channel_topup
+        }
+        self.event_handlers = {
+            'ChannelCreated': self.event_channel_created,
+            'ChannelToppedUp': self.event_channel_topup,
+            'ChannelSettled': self.event_channel_settled,
+            'ChannelCloseRequested': self.event_channel_close_requested
+        }
+        self.events_query = None
+        # hashes of processed heads and unconfirmed events in block order, to roll back
+        # only the events above the fork point of a reorg
+        self.block_hashes = BlockHashes(max(2 * n_confirmations, 128))
+        self.unconfirmed_logs = deque()
+        # all events from this block up to the unconfirmed head are in `unconfirmed_logs`,
+        # so they're promoted once confirmed instead of being fetched again
+        self.buffered_from_block = None
 
     def _run(self):
         self.running = True
+        if self.new_heads is not None:
+            self.new_heads.start()
         self.log.info('starting blockchain polling (interval %ss)', self.poll_interval)
         while self.running:
             if self.insufficient_balance:
                 self.insufficient_balance_recover()
             try:
+                # before the update, so the snapshot is ready once the sync is done
+                if self.health_due():
+                    self.try_refresh_health()
                 self._update()
                 self.is_connected.set()
                 if self.wait_sync_event.is_set():
-                    gevent.sleep(self.poll_interval)
+                    self.wait_new_block()
             except requests.exceptions.ConnectionError as e:
-                endpoint = self.web3.currentProvider.endpoint_uri
                 self.log.warning(
                     'Ethereum node (%s) refused connection. Retrying in %d seconds.' %
-                    (endpoint, self.poll_interval)
+                    (self.web3.providers[0], self.poll_interval)
                 )
+                self.health = self.health._replace(online=False)
                 gevent.sleep(self.poll_interval)
                 self.is_connected.clear()
         self.log.info('stopped blockchain polling')
 
     def stop(self):
         self.running = False
+        if self.new_heads is not None:
+            self.new_heads.stop()
+
+    def wait_new_block(self):
+        """Wait until the node announces a new block. If the subscription is down,
+        wait until the next block is due."""
+        if self.new_heads is None:
+            gevent.sleep(self.poll_interval)
+        elif self.new_heads.connected.is_set():
+            self.new_heads.wait(self.max_head_wait)
+        else:
+            # wake up early if the subscription is back
+            self.new_heads.connected.wait(self.polling.next_interval())
+
+    def health_due(self) -> bool:
+        if not self.health.online:
+            return True
+        return time.time() - self.health.timestamp >= self.health_interval
+
+    def refresh_health(self):
+        """Read the balances of the receiver and the liveness of the node."""
+        self.health = read_health(self.web3, self.cm.token_contract, self.cm.receiver)
+
+    def try_refresh_health(self):
+        """Refresh the health snapshot. If it can't be read, the node is marked offline
+        and the sync goes on."""
+        try:
+            self.refresh_health()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self.log.warning('Failed to read the health of the node (%s): %s',
+                             self.web3.providers[0], e)
+            self.health = self.health._replace(online=False)
+
+    def get_health(self, receiver):
+        """Health snapshot of a watched receiver."""
+        return self.health
+
+    @property
+    def sync_chunk_size(self) -> int:
+        """Current number of blocks queried at once."""
+        return self.chunk_size.size
 
     def wait_sync(self):
         """Block until event polling is up-to-date with a most recent block of the blockchain"""
         self.wait_sync_event.wait()
 
-    def _update(self):
-        current_block = self.web3.eth.blockNumber
-        # reset unconfirmed channels in case of reorg
-        if self.wait_sync_event.is_set():  # but not on first sync
-            if current_block < self.cm.state.unconfirmed_head_number:
-                self.log.info('chain reorganization detected. '
-                              'Resyncing unconfirmed events (unconfirmed_head=%d) [@%d]' %
-                              (self.cm.state.unconfirmed_head_number, self.web3.eth.blockNumber))
-                self.cm.reset_unconfirmed()
-            try:
-                # raises if hash doesn't exist (i.e. block has been replaced)
-                self.web3.eth.getBlock(self.cm.state.unconfirmed_head_hash)
-            except ValueError:
-                self.log.info('chain reorganization detected. '
-                              'Resyncing unconfirmed events (unconfirmed_head=%d) [@%d]. '
-                              '(getBlock() raised ValueError)' %
-                              (self.cm.state.unconfirmed_head_number, current_block))
-                self.cm.reset_unconfirmed()
+    @property
+    def sync_lag(self):
+        """Number of blocks of the node whose events haven't been processed yet, or None
+        if the node hasn't been queried yet."""
+        if self.current_block is None or self.cm.state.unconfirmed_head_number is None:
+            return None
+        return max(self.current_block - self.cm.state.unconfirmed_head_number, 0)
 
-            # in case of reorg longer than confirmation number fail
-            try:
-                self.web3.eth.getBlock(self.cm.state.confirmed_head_hash)
-            except ValueError:
-                self.log.critical('events considered confirmed have been reorganized')
-                assert False  # unreachable as long as confirmation level is set high enough
+    def _update(self):
+        # independent reads are sent to the node together
+        batch = RPCBatch(self.web3)
+        batch.block_number()
+        # roll back unconfirmed events in case of reorg
+        check_reorg = self.wait_sync_event.is_set()  # but not on first sync
+        if check_reorg:
+            batch.get_block(self.cm.state.unconfirmed_head_number)
+        results = batch.send()
+        current_block = results[0]
+        self.current_block = current_block
+        if self.new_heads is not None:
+            self.polling.update(current_block)
+        if check_reorg:
+            head_hash = results[1].hash if results[1] is not None else None
+            if head_hash != self.cm.state.unconfirmed_head_hash:
+                self._handle_reorg(current_block)
 
         if self.cm.state.confirmed_head_number is None:
             self.cm.state.update_sync_state(confirmed_head_number=self.sync_start_block)
         if self.cm.state.unconfirmed_head_number is None:
             self.cm.state.update_sync_state(unconfirmed_head_number=self.sync_start_block)
+        if self.events_query is None:
+            self._make_queries()
+
+        backfill_head_number = current_block - self.n_confirmations
+        if (not self.wait_sync_event.is_set() and self.event_cache is not None and
+                backfill_head_number > self.cm.state.confirmed_head_number):
+            self._sync_from_cache(backfill_head_number)
+            return
+        if (not self.wait_sync_event.is_set() and self.sync_concurrency > 1 and
+                backfill_head_number - self.cm.state.confirmed_head_number >
+                self.sync_chunk_size):
+            self._backfill(backfill_head_number)
+            return
+
         new_unconfirmed_head_number = self.cm.state.unconfirmed_head_number + self.sync_chunk_size
         new_unconfirmed_head_number = min(new_unconfirmed_head_number, current_block)
         new_confirmed_head_number = max(new_unconfirmed_head_number - self.n_confirmations, 0)
@@ -109,22 +243,19 @@ class Blockchain(gevent.Greenlet):
         # return if blocks have already been processed
         if (self.cm.state.confirmed_head_number >= new_confirmed_head_number and
                 self.cm.state.unconfirmed_head_number >= new_unconfirmed_head_number):
+            # a catch-up sync may have moved the unconfirmed head to the current block
+            if not self.wait_sync_event.is_set() and new_unconfirmed_head_number == current_block:
+                self.wait_sync_event.set()
             return
 
         # filter for events after block_number
         filters_confirmed = {
             'from_block': self.cm.state.confirmed_head_number + 1,
-            'to_block': new_confirmed_head_number,
-            'argument_filters': {
-                '_receiver_address': self.cm.state.receiver
-            }
+            'to_block': new_confirmed_head_number
         }
         filters_unconfirmed = {
             'from_block': self.cm.state.unconfirmed_head_number + 1,
-            'to_block': new_unconfirmed_head_number,
-            'argument_filters': {
-                '_receiver_address': self.cm.state.receiver
-            }
+            'to_block': new_unconfirmed_head_number
         }
         self.log.debug(
             'filtering for events u:%s-%s c:%s-%s @%d',
@@ -135,171 +266,437 @@ class Blockchain(gevent.Greenlet):
             current_block
         )
 
-        # unconfirmed channel created
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelCreated',
-            **filters_unconfirmed
+        # events of the confirmed range are only fetched if they haven't been buffered
+        promote = (
+            self.buffered_from_block is not None and
+            self.buffered_from_block <= filters_confirmed['from_block']
         )
-        for log in logs:
-            assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
-            sender = log['args']['_sender_address']
-            sender = to_checksum_address(sender)
-            deposit = log['args']['_deposit']
-            open_block_number = log['blockNumber']
-            self.log.debug(
-                'received unconfirmed ChannelCreated event (sender %s, block number %s)',
-                sender,
-                open_block_number
-            )
-            self.cm.unconfirmed_event_channel_opened(sender, open_block_number, deposit)
-
-        # channel created
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelCreated',
-            **filters_confirmed
+        if self.buffered_from_block is None:
+            self.buffered_from_block = filters_unconfirmed['from_block']
+
+        # the blocks of buffered events about to be confirmed and the new heads
+        # are fetched together with the logs
+        batch.get_logs(self.events_query, **filters_unconfirmed)
+        if not promote:
+            batch.get_logs(self.events_query, **filters_confirmed)
+        buffered_hashes = {
+            log['blockNumber']: log['blockHash'] for log in self.unconfirmed_logs
+            if promote and log['blockNumber'] <= new_confirmed_head_number
+        }
+        for block_number in buffered_hashes:
+            batch.get_block(block_number)
+        batch.get_block(new_unconfirmed_head_number)
+        batch.get_block(new_confirmed_head_number)
+        t_start = time.time()
+        try:
+            results = batch.send()
+        except (requests.exceptions.Timeout, ValueError) as e:
+            if not is_range_error(e) or self.chunk_size.size == self.chunk_size.min_size:
+                raise
+            self.chunk_size.shrink()
+            self.log.info('log query failed (%s), retrying with %d blocks',
+                          e, self.sync_chunk_size)
+            return
+        unconfirmed_logs = results.pop(0)
+        logs = [] if promote else results.pop(0)
+        buffered_blocks, head_blocks = results[:-2], results[-2:]
+        self.chunk_size.update(
+            new_unconfirmed_head_number - self.cm.state.unconfirmed_head_number,
+            len(unconfirmed_logs) + len(logs),
+            time.time() - t_start
         )
-        for log in logs:
-            assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
-            sender = log['args']['_sender_address']
-            sender = to_checksum_address(sender)
-            deposit = log['args']['_deposit']
-            open_block_number = log['blockNumber']
-            self.log.debug('received ChannelOpened event (sender %s, block number %s)',
-                           sender, open_block_number)
-            self.cm.event_channel_opened(sender, open_block_number, deposit)
-
-        # unconfirmed channel top ups
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelToppedUp',
-            **filters_unconfirmed
+
+        # events buffered by earlier updates have to be checked against the current chain
+        buffered_logs = self._pop_buffered_logs(new_confirmed_head_number)
+        if promote and not self._is_canonical(buffered_hashes, buffered_blocks):
+            self.log.info('buffered events have been reorganized. '
+                          'Resyncing unconfirmed events (unconfirmed_head=%d) [@%d]' %
+                          (self.cm.state.unconfirmed_head_number, current_block))
+            self._reset_unconfirmed()
+            return
+
+        # unconfirmed events
+        for log in unconfirmed_logs:
+            self.unconfirmed_logs.append(log)
+            if (log['event'] in self.unconfirmed_event_handlers and
+                    self._channel_manager(log) is not None):
+                self.unconfirmed_event_handlers[log['event']](log)
+
+        # confirmed events
+        buffered_logs += self._pop_buffered_logs(new_confirmed_head_number)
+        if promote:
+            logs = buffered_logs
+        self._handle_events(logs)
+
+        self._set_head(new_unconfirmed_head_number, new_confirmed_head_number, head_blocks)
+        if not self.wait_sync_event.is_set() and new_unconfirmed_head_number == current_block:
+            self.wait_sync_event.set()
+
+    def _get_block_hash(self, block_number):
+        try:
+            block = self.web3.eth.getBlock(block_number)
+        except ValueError:
+            # some providers raise if the block doesn't exist
+            return None
+        return block.hash if block is not None else None
+
+    def _handle_reorg(self, current_block):
+        """Roll back the unconfirmed events above the fork point of a reorg.
+
+        The cost depends on the depth of the reorg. If the fork point is older than the
+        remembered blocks (e.g. after a restart), all unconfirmed events are reset.
+        """
+        fork_point = self.block_hashes.find_fork_point(self._get_block_hash)
+        if fork_point is None or fork_point[0] < self.cm.state.confirmed_head_number:
+            self.log.info('chain reorganization detected. '
+                          'Resyncing unconfirmed events (unconfirmed_head=%d) [@%d]' %
+                          (self.cm.state.unconfirmed_head_number, current_block))
+            # in case of reorg longer than confirmation number fail
+            confirmed_head_hash = self._get_block_hash(self.cm.state.confirmed_head_number)
+            if confirmed_head_hash != self.cm.state.confirmed_head_hash:
+                self.log.critical('events considered confirmed have been reorganized')
+                assert False  # unreachable as long as confirmation level is set high enough
+            self._reset_unconfirmed()
+            return
+
+        fork_number, fork_hash = fork_point
+        self.log.info('chain reorganization detected. '
+                      'Rolling back unconfirmed events after block %d '
+                      '(unconfirmed_head=%d) [@%d]' %
+                      (fork_number, self.cm.state.unconfirmed_head_number, current_block))
+        while self.unconfirmed_logs and self.unconfirmed_logs[-1]['blockNumber'] > fork_number:
+            log = self.unconfirmed_logs.pop()
+            sender = to_checksum_address(log['args']['_sender_address'])
+            cm = self._channel_manager(log)
+            if cm is None:
+                continue
+            if log['event'] == 'ChannelCreated':
+                cm.revert_unconfirmed_channel_opened(sender, log['blockNumber'])
+            elif log['event'] == 'ChannelToppedUp':
+                cm.revert_unconfirmed_channel_topup(
+                    sender,
+                    log['args']['_open_block_number'],
+                    log['transactionHash']
+                )
+        self.block_hashes.rollback(fork_number)
+        self.cm.rollback_unconfirmed(fork_number, fork_hash)
+
+    def detach(self, channel_manager) -> bool:
+        """Stop watching the channels of a stopped channel manager.
+
+        Returns:
+            bool: True if the watcher can be stopped
+        """
+        return True
+
+    def _reset_unconfirmed(self):
+        self.cm.reset_unconfirmed()
+        self.block_hashes.clear()
+        self.unconfirmed_logs.clear()
+        self.buffered_from_block = None
+
+    def _pop_buffered_logs(self, to_block):
+        logs = []
+        while self.unconfirmed_logs and self.unconfirmed_logs[0]['blockNumber'] <= to_block:
+            logs.append(self.unconfirmed_logs.popleft())
+        return logs
+
+    @staticmethod
+    def _is_canonical(block_hashes, blocks):
+        """
+        Args:
+            block_hashes (dict): block number => hash the events were seen in
+            blocks (list): current blocks with these numbers, in the same order
+        Returns:
+            bool: True if the blocks are still part of the canonical chain
+        """
+        return all(
+            block is not None and block.hash == block_hash
+            for block, block_hash in zip(blocks, block_hashes.values())
         )
-        for log in logs:
-            assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
-            txhash = log['transactionHash']
-            sender = log['args']['_sender_address']
-            sender = to_checksum_address(sender)
-            open_block_number = log['args']['_open_block_number']
-            added_deposit = log['args']['_added_deposit']
-            self.log.debug(
-                'received top up event (sender %s, block number %s, deposit %s)',
-                sender,
-                open_block_number,
-                added_deposit
-            )
-            self.cm.unconfirmed_event_channel_topup(
-                sender,
-                open_block_number,
-                txhash,
-                added_deposit
-            )
-
-        # confirmed channel top ups
-        logs = get_logs(
+
+    def _receivers(self):
+        """Receivers whose channels are watched."""
+        return [self.cm.state.receiver]
+
+    def _channel_manager(self, log):
+        """The channel manager the event of a log is relayed to, or None if the event
+        has been relayed before."""
+        assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
+        return self.cm
+
+    def _make_queries(self):
+        # topics only depend on the receivers, so they're computed once.
+        # Unconfirmed events are fetched with all other events and buffered until
+        # they're confirmed.
+        argument_filters = {'_receiver_address': self._receivers()}
+        self.events_query = LogQuery(
             self.channel_manager_contract,
-            'ChannelToppedUp',
-            **filters_confirmed
+            list(self.event_handlers),
+            argument_filters
         )
+
+    def _handle_events(self, logs):
+        """Relay confirmed events of a block range to the channel manager."""
+        logs = [log for log in logs if self._channel_manager(log) is not None]
+        # channels settled in this range don't need to be handled on close request
+        settled = {
+            self._channel_id(log) for log in logs if log['event'] == 'ChannelSettled'
+        }
+        close_requests = [
+            log for log in logs
+            if log['event'] == 'ChannelCloseRequested' and self._channel_id(log) not in settled
+        ]
+        # the on-chain info of the closed channels is read in batches
+        channel_infos = self._get_channel_infos(close_requests) if close_requests else {}
         for log in logs:
-            assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
-            txhash = log['transactionHash']
-            sender = log['args']['_sender_address']
-            sender = to_checksum_address(sender)
-            open_block_number = log['args']['_open_block_number']
-            added_deposit = log['args']['_added_deposit']
-            self.log.debug(
-                'received top up event (sender %s, block number %s, added deposit %s)',
-                sender,
-                open_block_number,
-                added_deposit
-            )
-            self.cm.event_channel_topup(sender, open_block_number, txhash, added_deposit)
-
-        # channel settled event
-        logs = get_logs(
+            if log['event'] == 'ChannelCloseRequested':
+                if self._channel_id(log) not in settled:
+                    self.event_channel_close_requested(log, channel_infos)
+                continue
+            self.event_handlers[log['event']](log)
+
+    def _get_channel_infos(self, logs):
+        """
+        Returns:
+            dict: (sender, receiver, open block number) => on-chain info of the channel
+                of each log, None if the channel doesn't exist
+        """
+        return get_channel_infos(
             self.channel_manager_contract,
-            'ChannelSettled',
-            **filters_confirmed
+            [self._channel_id(log) for log in logs]
         )
-        for log in logs:
-            assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
-            sender = log['args']['_sender_address']
-            sender = to_checksum_address(sender)
-            open_block_number = log['args']['_open_block_number']
-            self.log.debug('received ChannelSettled event (sender %s, block number %s)',
-                           sender, open_block_number)
-            self.cm.event_channel_settled(sender, open_block_number)
-
-        # channel close requested
-        logs = get_logs(
-            self.channel_manager_contract,
-            'ChannelCloseRequested',
-            **filters_confirmed
+
+    @staticmethod
+    def _channel_id(log):
+        """(sender, receiver, open block number) of the channel of a log."""
+        return (
+            to_checksum_address(log['args']['_sender_address']),
+            to_checksum_address(log['args']['_receiver_address']),
+            log['args']['_open_block_number']
         )
-        for log in logs:
-            assert is_same_address(log['args']['_receiver_address'], self.cm.state.receiver)
-            sender = log['args']['_sender_address']
-            sender = to_checksum_address(sender)
-            open_block_number = log['args']['_open_block_number']
-            if (sender, open_block_number) not in self.cm.channels:
-                continue
-            balance = log['args']['_balance']
-            try:
-                timeout = self.channel_manager_contract.call().getChannelInfo(
-                    sender,
-                    self.cm.state.receiver,
-                    open_block_number
-                )[2]
-            except BadFunctionCallOutput:
-                self.log.warning(
-                    'received ChannelCloseRequested event for a channel that doesn\'t '
-                    'exist or has been closed already (sender=%s open_block_number=%d)'
-                    % (sender, open_block_number))
-                self.cm.force_close_channel(sender, open_block_number)
-                continue
-            self.log.debug('received ChannelCloseRequested event (sender %s, block number %s)',
-                           sender, open_block_number)
-            try:
-                self.cm.event_channel_close_requested(sender, open_block_number, balance, timeout)
-            except InsufficientBalance:
-                self.log.fatal('Insufficient ETH balance of the receiver. '
-                               "Can't close the channel. "
-                               'Will retry once the balance is sufficient')
-                self.insufficient_balance = True
-                # TODO: recover
-
-        # update head hash and number
+
+    def _set_head(self, unconfirmed_head_number, confirmed_head_number, head_blocks=None):
+        """Store the sync progress, together with the hashes of the head blocks.
+
+        The head blocks are fetched unless they're passed in `head_blocks`.
+        """
+        if head_blocks is None:
+            batch = RPCBatch(self.web3)
+            batch.get_block(unconfirmed_head_number)
+            batch.get_block(confirmed_head_number)
+            head_blocks = batch.send()
         try:
-            new_unconfirmed_head_hash = self.web3.eth.getBlock(new_unconfirmed_head_number).hash
-            new_confirmed_head_hash = self.web3.eth.getBlock(new_confirmed_head_number).hash
+            unconfirmed_head_hash = head_blocks[0].hash
+            confirmed_head_hash = head_blocks[1].hash
         except AttributeError:
             self.log.critical("RPC endpoint didn't return proper info for an existing block "
-                              "(%d,%d)" % (new_unconfirmed_head_number, new_confirmed_head_number))
+                              "(%d,%d)" % (unconfirmed_head_number, confirmed_head_number))
             self.log.critical("It is possible that the blockchain isn't fully synced. "
                               "This often happens when Parity is run with --fast or --warp sync.")
             self.log.critical("Can't continue - check status of the ethereum node.")
             sys.exit(1)
+        self.block_hashes.add(unconfirmed_head_number, unconfirmed_head_hash)
         self.cm.set_head(
-            new_unconfirmed_head_number,
-            new_unconfirmed_head_hash,
-            new_confirmed_head_number,
-            new_confirmed_head_hash
+            unconfirmed_head_number,
+            unconfirmed_head_hash,
+            confirmed_head_number,
+            confirmed_head_hash
         )
-        if not self.wait_sync_event.is_set() and new_unconfirmed_head_number == current_block:
-            self.wait_sync_event.set()
+
+    def _unconfirmed_head_number(self, confirmed_head_number):
+        """Unconfirmed head that stays ahead of a confirmed head set by a catch-up sync.
+
+        Unconfirmed events up to it are skipped, they are handled once confirmed.
+        """
+        return max(
+            self.cm.state.unconfirmed_head_number,
+            min(confirmed_head_number + self.n_confirmations, self.current_block)
+        )
+
+    def _fetch_range(self, from_block, to_block):
+        """Returns the confirmed events of a block range, or the error if the query failed
+        because of the size of the range, and the time the query took."""
+        t_start = time.time()
+        try:
+            logs = self.events_query.get_logs(from_block=from_block, to_block=to_block)
+        except (requests.exceptions.Timeout, ValueError) as e:
+            if not is_range_error(e):
+                raise
+            logs = e
+        return logs, time.time() - t_start
+
+    def _sync_from_cache(self, to_block):
+        """Relay the confirmed events up to `to_block` from the event cache.
+
+        The cache is extended first, so blocks that are cached already (e.g. by another
+        component sharing the cache file) aren't queried again.
+        """
+        # the unconfirmed head may move, so buffered events can't be promoted afterwards
+        self.unconfirmed_logs.clear()
+        self.buffered_from_block = None
+        cache_head_number = min(self.event_cache.update(to_block), to_block)
+        logs = self.event_cache.get_logs(
+            receiver=self._receivers(),
+            event_names=list(self.event_handlers),
+            from_block=self.cm.state.confirmed_head_number + 1,
+            to_block=cache_head_number
+        )
+        self.log.info('read %d events of blocks %d-%d from the event cache',
+                      len(logs), self.cm.state.confirmed_head_number + 1, cache_head_number)
+        self._handle_events(logs)
+        self._set_head(self._unconfirmed_head_number(cache_head_number), cache_head_number)
+
+    def _backfill(self, to_block):
+        """Fetch confirmed events up to `to_block` with several concurrent log queries.
+
+        The queries run in native threads, as requests of the web3 provider block the
+        event loop. Results are applied strictly in block order and the sync head only
+        advances over contiguous ranges whose events have been handled, so the state is
+        the same as after a sequential sync and a restart resumes from the last range.
+        """
+        # the unconfirmed head may move, so buffered events can't be promoted afterwards
+        self.unconfirmed_logs.clear()
+        self.buffered_from_block = None
+        pool = gevent.threadpool.ThreadPool(self.sync_concurrency)
+        # (from_block, to_block, async result) in block order
+        pending = deque()
+        next_block = self.cm.state.confirmed_head_number + 1
+        self.log.info('backfilling events of blocks %d-%d (%d concurrent queries)',
+                      next_block, to_block, self.sync_concurrency)
+        try:
+            while pending or next_block <= to_block:
+                while len(pending) < self.sync_concurrency and next_block <= to_block:
+                    range_end = min(next_block + self.sync_chunk_size - 1, to_block)
+                    result = pool.spawn(self._fetch_range, next_block, range_end)
+                    pending.append((next_block, range_end, result))
+                    next_block = range_end + 1
+
+                range_start, range_end, result = pending.popleft()
+                logs, latency = result.get()
+                if isinstance(logs, Exception):
+                    e = logs
+                    if self.chunk_size.size == self.chunk_size.min_size:
+                        raise e
+                    self.chunk_size.shrink()
+                    self.log.info('log query failed (%s), retrying with %d blocks',
+                                  e, self.sync_chunk_size)
+                    # refetch everything after the last applied range with smaller ranges
+                    pool.kill()
+                    pool = gevent.threadpool.ThreadPool(self.sync_concurrency)
+                    pending.clear()
+                    next_block = range_start
+                    continue
+
+                # the size adapts in block order, like in a sequential sync
+                self.chunk_size.update(range_end - range_start + 1, len(logs), latency)
+                self._handle_events(logs)
+                self._set_head(self._unconfirmed_head_number(range_end), range_end)
+                if not self.running and self.started:
+                    # stopped, the rest is fetched on restart
+                    break
+        finally:
+            pool.kill()
+
+    def unconfirmed_event_channel_created(self, log):
+        sender = to_checksum_address(log['args']['_sender_address'])
+        deposit = log['args']['_deposit']
+        open_block_number = log['blockNumber']
+        self.log.debug(
+            'received unconfirmed ChannelCreated event (sender %s, block number %s)',
+            sender,
+            open_block_number
+        )
+        self._channel_manager(log).unconfirmed_event_channel_opened(
+            sender,
+            open_block_number,
+            deposit
+        )
+
+    def event_channel_created(self, log):
+        sender = to_checksum_address(log['args']['_sender_address'])
+        deposit = log['args']['_deposit']
+        open_block_number = log['blockNumber']
+        self.log.debug('received ChannelOpened event (sender %s, block number %s)',
+                       sender, open_block_number)
+        self._channel_manager(log).event_channel_opened(sender, open_block_number, deposit)
+
+    def unconfirmed_event_channel_topup(self, log):
+        txhash = log['transactionHash']
+        sender = to_checksum_address(log['args']['_sender_address'])
+        open_block_number = log['args']['_open_block_number']
+        added_deposit = log['args']['_added_deposit']
+        self.log.debug(
+            'received top up event (sender %s, block number %s, deposit %s)',
+            sender,
+            open_block_number,
+            added_deposit
+        )
+        self._channel_manager(log).unconfirmed_event_channel_topup(
+            sender,
+            open_block_number,
+            txhash,
+            added_deposit
+        )
+
+    def event_channel_topup(self, log):
+        txhash = log['transactionHash']
+        sender = to_checksum_address(log['args']['_sender_address'])
+        open_block_number = log['args']['_open_block_number']
+        added_deposit = log['args']['_added_deposit']
+        self.log.debug(
+            'received top up event (sender %s, block number %s, added deposit %s)',
+            sender,
+            open_block_number,
+            added_deposit
+        )
+        self._channel_manager(log).event_channel_topup(
+            sender,
+            open_block_number,
+            txhash,
+            added_deposit
+        )
+
+    def event_channel_settled(self, log):
+        sender = to_checksum_address(log['args']['_sender_address'])
+        open_block_number = log['args']['_open_block_number']
+        self.log.debug('received ChannelSettled event (sender %s, block number %s)',
+                       sender, open_block_number)
+        self._channel_manager(log).event_channel_settled(sender, open_block_number)
+
+    def event_channel_close_requested(self, log, channel_infos=None):
+        """
+        Args:
+            channel_infos (dict, optional): on-chain channel info read in advance,
+                as returned by `get_channel_infos`
+        """
+        cm = self._channel_manager(log)
+        sender = to_checksum_address(log['args']['_sender_address'])
+        open_block_number = log['args']['_open_block_number']
+        if (sender, open_block_number) not in cm.channels:
+            return
+        balance = log['args']['_balance']
+        if channel_infos is None:
+            channel_infos = self._get_channel_infos([log])
+        channel_info = channel_infos[self._channel_id(log)]
+        if channel_info is None:
+            self.log.warning(
+                'received ChannelCloseRequested event for a channel that doesn\'t '
+                'exist or has been closed already (sender=%s open_block_number=%d)'
+                % (sender, open_block_number))
+            cm.force_close_channel(sender, open_block_number)
+            return
+        timeout = channel_info[2]
+        self.log.debug('received ChannelCloseRequested event (sender %s, block number %s)',
+                       sender, open_block_number)
+        cm.event_channel_close_requested(sender, open_block_number, balance, timeout)
 
     def insufficient_balance_recover(self):
         """Recover from an insufficient balance state by closing
-        all pending channels if possible."""
+        all pending channels if possible. If the balance turns out to be insufficient
+        again, the transaction worker sets the state again."""
         balance = self.web3.eth.getBalance(self.cm.receiver)
         if balance < PROXY_BALANCE_LIMIT:
             return
-        try:
-            self.cm.close_pending_channels()
-            self.insufficient_balance = False
-        except InsufficientBalance:
-            self.log.fatal('Insufficient balance when trying to'
-                           'close pending channels. (balance=%d)'
-                           % balance)
+        self.insufficient_balance = False
+        self.cm.close_pending_channels()
@@ -1,6 +1,7 @@
 import time
 from enum import IntEnum
-from eth_utils import is_address
+
+from microraiden.utils import is_address
 
 
 class ChannelState(IntEnum):
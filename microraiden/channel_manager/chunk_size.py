@@ -0,0 +1,95 @@
+"""Adaptive sizing of the block ranges queried for logs."""
+import logging
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# error messages of nodes (Geth, Parity, Infura) refusing a too expensive log query
+RANGE_ERROR_MESSAGES = (
+    'query returned more than',
+    'timeout',
+    'timed out',
+    'too many',
+    'limit exceeded',
+    'response size exceeded',
+)
+
+
+def is_range_error(error: Exception) -> bool:
+    """
+    Returns:
+        bool: True if a log query failed because its block range was too wide
+    """
+    if isinstance(error, requests.exceptions.Timeout):
+        return True
+    if not isinstance(error, ValueError):
+        return False
+    details = error.args[0] if error.args else None
+    if isinstance(details, dict):
+        details = details.get('message', '')
+    details = str(details).lower()
+    return any(message in details for message in RANGE_ERROR_MESSAGES)
+
+
+class AdaptiveChunkSize(object):
+    """Block range size that follows the log density and the node's response time.
+
+    The range shrinks if a query fails because of its size or takes longer than
+    `target_latency`, and grows if a range comes back empty or fast. After a failure
+    the range doesn't grow beyond the size that worked until an empty range is seen,
+    so that dense block ranges aren't retried over and over.
+    """
+
+    def __init__(
+            self,
+            size: int = 100 * 1000,
+            min_size: int = 1,
+            max_size: int = 1000 * 1000,
+            target_latency: float = 2.0
+    ):
+        """
+        Args:
+            size (int, optional): initial number of blocks per range
+            min_size (int, optional): smallest number of blocks per range
+            max_size (int, optional): largest number of blocks per range
+            target_latency (float, optional): seconds a log query should take
+        """
+        assert 0 < min_size <= size <= max_size
+        assert target_latency > 0
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.ceiling = max_size
+        self.n_errors = 0
+
+    def _set(self, size: float):
+        self.size = int(max(self.min_size, min(self.ceiling, size)))
+
+    def update(self, n_blocks: int, n_logs: int, latency: float):
+        """Adjust the size after a successful query.
+
+        Args:
+            n_blocks (int): number of blocks the query covered
+            n_logs (int): number of logs the query returned
+            latency (float): seconds the query took
+        """
+        if n_blocks < self.size:
+            # the range was cut short by the chain head, it doesn't say much
+            return
+        if latency > self.target_latency:
+            # shrink proportionally, but at most by half
+            self._set(self.size * max(0.5, self.target_latency / latency))
+        elif n_logs == 0:
+            self.ceiling = self.max_size
+            self._set(self.size * 2)
+        elif latency < self.target_latency / 2:
+            self._set(self.size * 2)
+
+    def shrink(self):
+        """Halve the size after a query failed because of the size of its range."""
+        self.n_errors += 1
+        self._set(self.size / 2)
+        self.ceiling = self.size
+        log.debug('shrinking log query range to %d blocks', self.size)
@@ -0,0 +1,207 @@
+"""Deferred (asynchronous) verification of balance proofs.
+
+A well-formed balance proof for a known open channel is accepted without verifying its
+signature, as long as the unverified amount of the sender stays within a credit limit.
+Signatures are then verified in batches by a background greenlet. As the sender of a
+proof is only claimed by the request, a proof that turns out to be invalid is dropped,
+and its channel served with the last verified balance proof again. Only the recovered
+signer of a proof is held responsible: if it's another sender paying through a channel
+it doesn't own with a proof of its own channel, it's blacklisted and its channels are
+closed with the last verified balance proof.
+"""
+import logging
+from collections import OrderedDict, deque, namedtuple
+
+import gevent
+import gevent.event
+import gevent.pool
+from eth_utils import decode_hex
+
+from microraiden.utils import is_same_address, to_checksum_address
+from .risk import RiskBudget
+
+log = logging.getLogger(__name__)
+
+PendingProof = namedtuple(
+    'PendingProof',
+    ['sender', 'open_block_number', 'balance', 'signature', 'received']
+)
+
+
+class DeferredVerifier(gevent.Greenlet):
+    """Verifies accepted balance proofs in batches, off the request path."""
+
+    def __init__(
+            self,
+            channel_manager,
+            credit_limit: int,
+            batch_size: int = 100,
+            batch_interval: float = 0.5
+    ):
+        """
+        Args:
+            channel_manager (ChannelManager): channel manager the proofs are committed to
+            credit_limit (int): maximum amount of unverified tokens per sender
+            batch_size (int, optional): maximum number of proofs verified in one batch
+            batch_interval (float, optional): seconds to wait for a batch to fill up
+        """
+        gevent.Greenlet.__init__(self)
+        assert batch_size > 0
+        self.cm = channel_manager
+        self.budget = RiskBudget(credit_limit)
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.queue = deque()
+        # (sender, open_block_number) => latest accepted PendingProof
+        self.latest = OrderedDict()
+        self.blacklist = set()
+        self.batch_ready = gevent.event.Event()
+        self.running = False
+        self.n_verified = 0
+        self.n_invalid = 0
+
+    def _run(self):
+        self.running = True
+        while self.running:
+            self.batch_ready.wait(self.batch_interval)
+            self.batch_ready.clear()
+            self.verify_pending()
+
+    def stop(self):
+        self.running = False
+        self.batch_ready.set()
+
+    def is_blacklisted(self, sender: str) -> bool:
+        return sender in self.blacklist
+
+    def apply_pending(self, channel):
+        """Update balance and signature of a channel object to the latest accepted proof.
+        The object is not stored to the state."""
+        pending = self.latest.get((channel.sender, channel.open_block_number))
+        if pending is not None and pending.balance > channel.balance:
+            channel.balance = pending.balance
+            channel.last_signature = pending.signature
+        return channel
+
+    def defer(self, channel, balance: int, signature: str) -> bool:
+        """Accept a balance proof without verifying it.
+
+        Args:
+            channel (Channel): channel with pending proofs applied
+            balance (int): new balance
+            signature (str): balance proof signature
+        Returns:
+            bool: False if the sender's credit limit doesn't allow to defer the verification
+        """
+        received = balance - channel.balance
+        if not self.budget.can_extend(channel.sender, received):
+            return False
+        proof = PendingProof(
+            channel.sender,
+            channel.open_block_number,
+            balance,
+            signature,
+            received
+        )
+        self.budget.extend(channel.sender, received)
+        self.queue.append(proof)
+        self.latest[channel.sender, channel.open_block_number] = proof
+        if len(self.queue) >= self.batch_size:
+            self.batch_ready.set()
+        return True
+
+    def flush(self):
+        """Verify all pending proofs now."""
+        while self.queue:
+            self.verify_pending()
+
+    def _recover(self, proof: PendingProof):
+        try:
+            signer = self.cm.verifier.recover_sender(
+                proof.open_block_number,
+                proof.balance,
+                decode_hex(proof.signature)
+            )
+        except Exception:
+            log.debug('failed to recover balance proof signer (sender %s, block number %s)',
+                      proof.sender, proof.open_block_number, exc_info=True)
+            return proof, None
+        return proof, signer
+
+    def verify_pending(self):
+        """Verify a batch of pending proofs."""
+        batch = [self.queue.popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+        if not batch:
+            return
+        pool = gevent.pool.Pool(max(1, self.cm.verifier.pool_size))
+        for proof, signer in pool.imap(self._recover, batch):
+            if proof.sender in self.blacklist:
+                continue
+            if signer is not None and is_same_address(signer, proof.sender):
+                self._commit(proof)
+            else:
+                self._reject(proof, signer)
+
+    def _commit(self, proof: PendingProof):
+        key = (proof.sender, proof.open_block_number)
+        self.n_verified += 1
+        self.budget.settle(proof.sender, proof.received)
+        if self.latest.get(key) is proof:
+            del self.latest[key]
+        self.cm.commit_payment(
+            proof.sender,
+            proof.open_block_number,
+            proof.balance,
+            proof.signature
+        )
+
+    def _reject(self, proof: PendingProof, signer: str = None):
+        key = (proof.sender, proof.open_block_number)
+        self.n_invalid += 1
+        lost = self.budget.write_off(proof.sender, proof.received)
+        log.warning('invalid deferred balance proof, dropping it '
+                    '(sender %s, block number %s, lost %d)',
+                    proof.sender, proof.open_block_number, lost)
+        if self.latest.get(key) is proof:
+            # serve the channel with the preceding proofs, if any, else the verified one
+            preceding = [p for p in self.queue if (p.sender, p.open_block_number) == key]
+            if preceding:
+                self.latest[key] = max(preceding, key=lambda p: p.balance)
+            else:
+                del self.latest[key]
+        # the sender of the request may not have sent the proof, but its signer did
+        if signer is None:
+            return
+        signer = to_checksum_address(signer)
+        channel = self.cm.channels.get((signer, proof.open_block_number))
+        if channel is not None and not channel.is_closed:
+            self._blacklist(signer)
+
+    def _blacklist(self, sender: str):
+        self.blacklist.add(sender)
+        lost = self.budget.write_off(sender)
+        self.queue = deque(p for p in self.queue if p.sender != sender)
+        for key in [key for key in self.latest if key[0] == sender]:
+            del self.latest[key]
+        log.warning('balance proof of a sender used for a channel of another one, '
+                    'blacklisting sender (sender %s, lost %d)', sender, lost)
+        for (channel_sender, open_block_number), c in self.cm.channels.items():
+            if channel_sender != sender or c.is_closed:
+                continue
+            log.info('disputing channel of a blacklisted sender (sender %s, block number %s)',
+                     sender, open_block_number)
+            self.cm.force_close_channel(sender, open_block_number)
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict: verification statistics and at-risk exposure
+        """
+        metrics = self.budget.metrics()
+        metrics.update({
+            'pending': len(self.queue),
+            'verified': self.n_verified,
+            'invalid': self.n_invalid,
+            'blacklisted': len(self.blacklist)
+        })
+        return metrics
@@ -0,0 +1,248 @@
+"""Challenges of close requests, ordered by their settlement deadline.
+
+A sender may request to close a channel with a lower balance than the latest balance
+proof of the receiver. The receiver then has to close the channel with its balance proof
+before the channel can be settled by the sender, i.e. before the settle block number.
+Disputes are queued by that deadline and challenged by a background greenlet, so that
+a flood of close requests doesn't hold up the sync and the most urgent ones are sent
+first. A challenge that can't be sent is retried, one that isn't mined in time is
+replaced with a higher gas price. Disputes are stored to the state until they're
+resolved, and queued again when the scheduler is restarted.
+"""
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+import gevent
+import gevent.event
+import requests
+from eth_utils import encode_hex
+from ethereum.exceptions import InsufficientBalance
+from web3 import Web3
+
+from microraiden.config import NETWORK_CFG
+
+log = logging.getLogger(__name__)
+
+
+class Dispute(object):
+    """A close request to be challenged before `settle_block_number`."""
+
+    def __init__(self, sender: str, open_block_number: int, settle_block_number: int):
+        self.sender = sender
+        self.open_block_number = open_block_number
+        self.settle_block_number = settle_block_number
+        # nonce and gas price of the latest challenge, replacements reuse the nonce
+        self.nonce = None
+        self.gas_price = None
+        self.txhashes = []
+        self.sent_block_number = None
+        self.attempts = 0
+        self.next_attempt = 0
+
+
+class DisputeScheduler(gevent.Greenlet):
+    """Sends challenges of close requests, earliest settlement deadline first."""
+
+    def __init__(
+            self,
+            channel_manager,
+            web3: Web3,
+            poll_interval: float = 2,
+            retry_interval: float = 5,
+            resubmit_blocks: int = 3,
+            gas_price_bump: float = 1.2,
+            max_gas_price: int = None
+    ):
+        """
+        Args:
+            channel_manager (ChannelManager): channel manager of the disputed channels
+            web3 (Web3): web3 provider
+            poll_interval (float, optional): seconds between checks of the pending
+                challenges
+            retry_interval (float, optional): seconds to wait after a challenge couldn't
+                be sent
+            resubmit_blocks (int, optional): number of blocks after which a challenge that
+                hasn't been mined is replaced with a higher gas price
+            gas_price_bump (float, optional): factor the gas price of a replacement is
+                increased by. Nodes require at least 10% to accept a replacement.
+            max_gas_price (int, optional): gas price that isn't exceeded by replacements.
+                Defaults to 10 times the configured gas price.
+        """
+        gevent.Greenlet.__init__(self)
+        assert gas_price_bump >= 1.1
+        self.cm = channel_manager
+        self.web3 = web3
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.resubmit_blocks = resubmit_blocks
+        self.gas_price_bump = gas_price_bump
+        self.max_gas_price = max_gas_price
+        # (settle block number, sequence number, Dispute)
+        self.queue = []
+        self.scheduled = set()
+        self.counter = itertools.count()
+        self.wakeup = gevent.event.Event()
+        self.running = False
+        self.block_number = None
+        self.n_challenged = 0
+        self.n_failed = 0
+        self.n_missed = 0
+        self.n_resubmitted = 0
+        # blocks left until the deadline when the latest challenges were mined
+        self.slack = deque(maxlen=100)
+
+    def _run(self):
+        self.running = True
+        self.restore()
+        while self.running:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            try:
+                self.process()
+            except requests.exceptions.ConnectionError:
+                log.warning('Ethereum node refused connection, retrying challenges in %d '
+                            'seconds', self.poll_interval)
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def restore(self):
+        """Queue the disputes stored to the state, i.e. those of a previous run."""
+        for sender, open_block_number, settle_block_number in self.cm.state.disputes:
+            self.schedule(sender, open_block_number, settle_block_number)
+
+    def schedule(self, sender: str, open_block_number: int, settle_block_number: int):
+        """Challenge a close request before the channel can be settled."""
+        if (sender, open_block_number) in self.scheduled:
+            return
+        self.cm.state.add_dispute(sender, open_block_number, settle_block_number)
+        dispute = Dispute(sender, open_block_number, settle_block_number)
+        self.scheduled.add((sender, open_block_number))
+        heapq.heappush(self.queue, (settle_block_number, next(self.counter), dispute))
+        self.wakeup.set()
+
+    def process(self):
+        """Check the sent challenges and send the due ones, earliest deadline first."""
+        if not self.queue:
+            return
+        self.block_number = self.web3.eth.blockNumber
+        disputes = [heapq.heappop(self.queue) for _ in range(len(self.queue))]
+        for i, entry in enumerate(disputes):
+            try:
+                pending = self._process(entry[2])
+            except Exception:
+                # an assigned nonce may not have been used
+                self.cm.transactions.reset_nonce()
+                # keep the remaining disputes, they're processed on the next round
+                for remaining in disputes[i:]:
+                    heapq.heappush(self.queue, remaining)
+                raise
+            if pending:
+                heapq.heappush(self.queue, entry)
+            else:
+                self.scheduled.discard((entry[2].sender, entry[2].open_block_number))
+                self.cm.state.del_dispute(entry[2].sender, entry[2].open_block_number)
+
+    def flush(self):
+        """Send the due challenges now. Disputes that are still pending are kept in the
+        state and challenged after a restart."""
+        self.process()
+
+    def _process(self, dispute: Dispute) -> bool:
+        """
+        Returns:
+            bool: True if the dispute isn't resolved yet
+        """
+        sender, open_block_number = dispute.sender, dispute.open_block_number
+        if not self.cm.state.channel_exists(sender, open_block_number):
+            # settled already
+            return False
+        for txhash in dispute.txhashes:
+            receipt = self.web3.eth.getTransactionReceipt(txhash)
+            if receipt is None:
+                continue
+            if receipt.get('status', 1) == 0:
+                self.n_failed += 1
+                log.warning('challenge failed (sender %s, block number %s, tx %s)',
+                            sender, open_block_number, txhash)
+                return False
+            slack = dispute.settle_block_number - receipt['blockNumber']
+            self.slack.append(slack)
+            self.n_challenged += 1
+            log.info('challenge mined (sender %s, block number %s, %d blocks before the '
+                     'deadline)', sender, open_block_number, slack)
+            return False
+        if self.block_number >= dispute.settle_block_number:
+            self.n_missed += 1
+            log.error('settlement deadline of a disputed channel missed '
+                      '(sender %s, block number %s, settle block %d)',
+                      sender, open_block_number, dispute.settle_block_number)
+            return False
+        if (dispute.sent_block_number is not None and
+                self.block_number - dispute.sent_block_number < self.resubmit_blocks):
+            return True
+        if time.time() < dispute.next_attempt:
+            return True
+        self._send(dispute)
+        return True
+
+    def _send(self, dispute: Dispute):
+        channel = self.cm.state.get_channel(dispute.sender, dispute.open_block_number)
+        max_gas_price = self.max_gas_price or 10 * NETWORK_CFG.GAS_PRICE
+        if dispute.gas_price is None:
+            gas_price = NETWORK_CFG.GAS_PRICE
+        else:
+            gas_price = min(int(dispute.gas_price * self.gas_price_bump), max_gas_price)
+        nonce = dispute.nonce
+        if nonce is None:
+            # shared with the channel closes of the transaction worker
+            nonce = self.cm.transactions.assign_nonce()
+        raw_tx = self.cm.create_close_transaction(channel, nonce=nonce, gas_price=gas_price)
+        dispute.attempts += 1
+        try:
+            txhash = self.web3.eth.sendRawTransaction(raw_tx)
+        except (InsufficientBalance, ValueError) as e:
+            if isinstance(e, InsufficientBalance):
+                log.fatal('Insufficient ETH balance of the receiver. '
+                          "Can't challenge a close request.")
+                # refuses payments until the balance is sufficient again
+                self.cm.blockchain.insufficient_balance = True
+            if dispute.nonce is None:
+                self.cm.transactions.reset_nonce()
+            dispute.next_attempt = time.time() + self.retry_interval
+            log.warning('failed to send challenge, retrying in %d seconds '
+                        '(sender %s, block number %s): %s', self.retry_interval,
+                        dispute.sender, dispute.open_block_number, e)
+            return
+        if dispute.txhashes:
+            self.n_resubmitted += 1
+        dispute.nonce = nonce
+        dispute.gas_price = gas_price
+        dispute.txhashes.append(encode_hex(txhash))
+        dispute.sent_block_number = self.block_number
+        log.info('sent challenge (sender %s, block number %s, gas price %d, '
+                 '%d blocks before the deadline)', dispute.sender, dispute.open_block_number,
+                 gas_price, dispute.settle_block_number - self.block_number)
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict: dispute statistics, slack is the number of blocks left until the deadline
+        """
+        next_slack = None
+        if self.queue and self.block_number is not None:
+            next_slack = self.queue[0][0] - self.block_number
+        return {
+            'queued': len(self.queue),
+            'next_deadline_slack': next_slack,
+            'challenged': self.n_challenged,
+            'failed': self.n_failed,
+            'missed': self.n_missed,
+            'resubmitted': self.n_resubmitted,
+            'min_slack': min(self.slack, default=None),
+            'mean_slack': sum(self.slack) / len(self.slack) if self.slack else None
+        }
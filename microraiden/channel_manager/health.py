@@ -0,0 +1,62 @@
+"""Receiver balances and node liveness, read in the background instead of per request."""
+import time
+from collections import namedtuple
+from typing import Dict, List
+
+from web3 import Web3
+from web3.contract import Contract
+
+from microraiden.utils import RPCBatch
+
+HealthSnapshot = namedtuple(
+    'HealthSnapshot',
+    ['online', 'eth_balance', 'token_balance', 'block_number', 'latency', 'timestamp']
+)
+# nothing has been read from the node yet, whether it's online is unknown
+HealthSnapshot.__new__.__defaults__ = (None, None, None, None, None, None)
+
+
+def read_health(web3: Web3, token_contract: Contract, receiver: str) -> HealthSnapshot:
+    """Read the balances of the receiver and the head of the node with one batch.
+
+    Raises:
+        requests.exceptions.ConnectionError: if the node is offline
+    """
+    return read_healths(web3, token_contract, [receiver])[receiver]
+
+
+def read_healths(
+        web3: Web3,
+        token_contract: Contract,
+        receivers: List[str]
+) -> Dict[str, HealthSnapshot]:
+    """Like `read_health`, for several receivers with one batch."""
+    batch = RPCBatch(web3)
+    for receiver in receivers:
+        batch.get_balance(receiver)
+        batch.call(token_contract, 'balanceOf', [receiver])
+    batch.block_number()
+    t_start = time.time()
+    results = batch.send()
+    now = time.time()
+    block_number = results.pop()
+    healths = {}
+    for i, receiver in enumerate(receivers):
+        eth_balance, token_balance = results[2 * i:2 * i + 2]
+        healths[receiver] = HealthSnapshot(
+            online=True,
+            eth_balance=eth_balance,
+            token_balance=token_balance[0] if token_balance is not None else None,
+            block_number=block_number,
+            latency=now - t_start,
+            timestamp=now
+        )
+    return healths
+
+
+def health_to_dict(health: HealthSnapshot) -> dict:
+    """Snapshot for the stats API, with its age instead of the timestamp."""
+    health_dict = health._asdict()
+    timestamp = health_dict.pop('timestamp')
+    health_dict['age'] = time.time() - timestamp if timestamp is not None else None
+    return health_dict
@@ -6,20 +6,18 @@ import gevent.event
 import filelock
 import logging
 import os
-from eth_utils import (
-    decode_hex,
-    is_same_address,
-    is_checksum_address
-)
-from ethereum.exceptions import InsufficientBalance
+from eth_utils import decode_hex
 from web3 import Web3
 from web3.contract import Contract
 
+from microraiden.config import NETWORK_CFG
 from microraiden.utils import (
-    verify_balance_proof,
+    EventCache,
     privkey_to_addr,
     sign_close,
-    create_signed_contract_transaction
+    create_signed_contract_transaction,
+    is_same_address,
+    is_checksum_address
 )
 from microraiden.exceptions import (
     NetworkIdMismatch,
@@ -32,11 +30,20 @@ from microraiden.exceptions import (
     InvalidBalanceAmount,
     InvalidContractVersion,
     NoBalanceProofReceived,
+    SenderBlacklisted,
+    SyncInProgress,
 )
 from microraiden.constants import CHANNEL_MANAGER_CONTRACT_VERSION
 from .state import ChannelManagerState
 from .blockchain import Blockchain
+from .watcher import SharedBlockchain
+from .snapshot import import_snapshot
 from .channel import Channel, ChannelState
+from .verifier import BalanceProofVerifier
+from .deferred import DeferredVerifier
+from .pending import PendingChannelWatcher
+from .disputes import DisputeScheduler
+from .transactions import TransactionWorker
 
 log = logging.getLogger(__name__)
 
@@ -51,20 +58,99 @@ class ChannelManager(gevent.Greenlet):
             token_contract: Contract,
             private_key: str,
             state_filename: str = None,
-            n_confirmations=1
+            n_confirmations=1,
+            verify_pool_size: int = 0,
+            deferred_credit_limit: int = 0,
+            sync_concurrency: int = 4,
+            new_heads_endpoint: str = None,
+            event_cache: str = None,
+            health_interval: float = 0,
+            blockchain: SharedBlockchain = None,
+            fast_start_max_lag: int = None,
+            state_snapshot: dict = None,
+            pending_credit_limit: int = 0
     ) -> None:
+        """
+        Args:
+            web3 (Web3): web3 provider
+            channel_manager_contract (Contract): channel manager contract
+            token_contract (Contract): token contract
+            private_key (str): receiver's private key
+            state_filename (str, optional): path to the state database
+            n_confirmations (int, optional): number of confirmations an event needs
+            verify_pool_size (int, optional): number of native threads used to recover
+                balance proof signatures. If 0 (default), signatures are recovered
+                on the gevent hub.
+            deferred_credit_limit (int, optional): if set, balance proofs are accepted
+                before their signature is verified, as long as the unverified amount
+                of a sender doesn't exceed this limit. Signatures are then verified
+                asynchronously in batches.
+            sync_concurrency (int, optional): number of block ranges fetched concurrently
+                while catching up with the blockchain history
+            new_heads_endpoint (str, optional): websocket URL or IPC path of the node.
+                If set, new blocks are processed as soon as the node announces them.
+            event_cache (str, optional): path to a local event cache file, that may be
+                shared with clients and tools. If set, the channel history is read from
+                the cache.
+            health_interval (float, optional): seconds between background refreshes of
+                the receiver's balances and the node liveness served to requests. If 0,
+                they're refreshed on every blockchain update.
+            blockchain (SharedBlockchain, optional): watcher shared with the channel
+                managers of other receivers. If set, the blockchain arguments above are
+                those of the watcher and are ignored here.
+            fast_start_max_lag (int, optional): if set, channels of the state file are
+                served before the channel history has been synced, as long as it's at most
+                this many blocks behind the node. Other payments are refused with an
+                insufficient confirmations error until the sync is complete.
+            state_snapshot (dict, optional): snapshot exported from the state of another
+                proxy of the receiver. If the state file doesn't exist yet, it's created
+                from the snapshot and the sync resumes from its checkpoint.
+            pending_credit_limit (int, optional): if set, the pending block is watched for
+                transactions creating channels to the receiver, and such a channel is
+                served as soon as the transaction is mined, before its event is confirmed.
+                The amount paid by a sender through channels that aren't confirmed yet
+                may not exceed this limit.
+        """
         gevent.Greenlet.__init__(self)
-        self.blockchain = Blockchain(
-            web3,
-            channel_manager_contract,
-            self,
-            n_confirmations=n_confirmations
-        )
+        shared = blockchain is not None
+        if not shared:
+            if event_cache is not None:
+                event_cache = EventCache(
+                    event_cache,
+                    channel_manager_contract,
+                    start_block=NETWORK_CFG.start_sync_block,
+                    n_confirmations=n_confirmations
+                )
+            blockchain = Blockchain(
+                web3,
+                channel_manager_contract,
+                self,
+                n_confirmations=n_confirmations,
+                sync_concurrency=sync_concurrency,
+                new_heads_endpoint=new_heads_endpoint,
+                event_cache=event_cache,
+                health_interval=health_interval
+            )
+        self.blockchain = blockchain
         self.receiver = privkey_to_addr(private_key)
         self.private_key = private_key
         self.channel_manager_contract = channel_manager_contract
         self.token_contract = token_contract
         self.n_confirmations = n_confirmations
+        self.fast_start_max_lag = fast_start_max_lag
+        self.verifier = BalanceProofVerifier(
+            self.receiver,
+            channel_manager_contract.address,
+            pool_size=verify_pool_size
+        )
+        self.deferred_verifier = None
+        if deferred_credit_limit > 0:
+            self.deferred_verifier = DeferredVerifier(self, deferred_credit_limit)
+        self.transactions = TransactionWorker(self, web3)
+        self.disputes = DisputeScheduler(self, web3)
+        self.pending_watcher = None
+        if pending_credit_limit > 0:
+            self.pending_watcher = PendingChannelWatcher(self, web3, pending_credit_limit)
         self.log = logging.getLogger('channel_manager')
         network_id = int(web3.version.network)
         assert is_same_address(privkey_to_addr(self.private_key), self.receiver)
@@ -74,6 +160,16 @@ class ChannelManager(gevent.Greenlet):
 
         if state_filename not in (None, ':memory:') and os.path.isfile(state_filename):
             self.state = ChannelManagerState.load(state_filename)
+        elif state_snapshot is not None:
+            self.state = import_snapshot(
+                state_snapshot,
+                state_filename,
+                web3,
+                channel_manager_contract.address,
+                self.receiver
+            )
+            self.log.info('state created from a snapshot, resuming from block %d',
+                          self.state.confirmed_head_number)
         else:
             self.state = ChannelManagerState(state_filename)
             self.state.setup_db(
@@ -102,6 +198,9 @@ class ChannelManager(gevent.Greenlet):
             raise StateContractAddrMismatch('%s != %s' % (
                 channel_manager_contract.address, self.state.contract_address))
 
+        if shared:
+            self.blockchain.add_channel_manager(self)
+
         self.log.debug('setting up channel manager, receiver=%s channel_contract=%s' %
                        (self.receiver, channel_manager_contract.address))
 
@@ -109,12 +208,37 @@ class ChannelManager(gevent.Greenlet):
         self.stop()
 
     def _run(self):
-        self.blockchain.start()
+        # a shared watcher is started by the first of its channel managers
+        if not self.blockchain.started:
+            self.blockchain.start()
+        self.transactions.start()
+        self.disputes.start()
+        if self.deferred_verifier is not None:
+            self.deferred_verifier.start()
+        if self.pending_watcher is not None:
+            self.pending_watcher.start()
 
     def stop(self):
-        if self.blockchain.running:
+        # stop the producers of closing transactions before the transaction worker
+        if self.pending_watcher is not None and self.pending_watcher.running:
+            self.pending_watcher.stop()
+            self.pending_watcher.join()
+        if self.deferred_verifier is not None and self.deferred_verifier.running:
+            self.deferred_verifier.stop()
+            self.deferred_verifier.join()
+            self.deferred_verifier.flush()
+        # a shared watcher is stopped by the last of its channel managers
+        if self.blockchain.detach(self) and self.blockchain.running:
             self.blockchain.stop()
             self.blockchain.join()
+        if self.disputes.running:
+            self.disputes.stop()
+            self.disputes.join()
+            self.disputes.flush()
+        if self.transactions.running:
+            self.transactions.stop()
+            self.transactions.join()
+            self.transactions.flush()
 
     def set_head(self,
                  unconfirmed_head_number: int,
@@ -140,6 +264,8 @@ class ChannelManager(gevent.Greenlet):
         c = Channel(self.state.receiver, sender, deposit, open_block_number)
         c.confirmed = True
         c.state = ChannelState.OPEN
+        if self.pending_watcher is not None:
+            self.pending_watcher.confirm(c)
         self.log.info('new channel opened (sender %s, block number %s)', sender, open_block_number)
         self.state.set_channel(c)
 
@@ -167,8 +293,10 @@ class ChannelManager(gevent.Greenlet):
         settle_timeout: int
     ):
         """Notify the channel manager that a the closing of a channel has been requested.
+        If the balance is lower than the latest balance proof, the closing is disputed before
+        the channel can be settled.
         Params:
-            settle_timeout (int):   settle timeout in blocks"""
+            settle_timeout (int):   block number from which the channel can be settled"""
         assert is_checksum_address(sender)
         assert settle_timeout >= 0
         if (sender, open_block_number) not in self.channels:
@@ -178,12 +306,18 @@ class ChannelManager(gevent.Greenlet):
                 open_block_number
             )
             return
+        if self.deferred_verifier is not None:
+            self.deferred_verifier.flush()
         c = self.channels[sender, open_block_number]
         if c.balance > balance:
-            self.log.warning('sender tried to cheat, sending challenge '
-                             '(sender %s, block number %s)',
-                             sender, open_block_number)
-            self.close_channel(sender, open_block_number)  # dispute by closing the channel
+            self.log.warning('sender tried to cheat, scheduling challenge '
+                             '(sender %s, block number %s, settle block %d)',
+                             sender, open_block_number, settle_timeout)
+            c.settle_timeout = settle_timeout
+            c.is_closed = True
+            c.mtime = time.time()
+            # dispute by closing the channel
+            self.disputes.schedule(sender, open_block_number, settle_timeout)
         else:
             self.log.info('valid channel close request received '
                           '(sender %s, block number %s, timeout %d)',
@@ -239,10 +373,37 @@ class ChannelManager(gevent.Greenlet):
         c.mtime = time.time()
         self.state.set_channel(c)
 
+    def revert_unconfirmed_channel_opened(self, sender: str, open_block_number: int):
+        """Forget an unconfirmed channel whose block has been reorganized away."""
+        assert is_checksum_address(sender)
+        # single row lookups, the cost of a rollback doesn't depend on the number of channels
+        if self.pending_watcher is not None:
+            self.pending_watcher.revert(sender, open_block_number)
+        if not self.state.channel_exists(sender, open_block_number):
+            return
+        if self.state.get_channel(sender, open_block_number).confirmed:
+            return
+        self.log.info('reverting unconfirmed channel (sender %s, block number %s)',
+                      sender, open_block_number)
+        self.state.del_channel(sender, open_block_number)
+
+    def revert_unconfirmed_channel_topup(self, sender: str, open_block_number: int, txhash):
+        """Forget an unconfirmed topup whose block has been reorganized away."""
+        assert is_checksum_address(sender)
+        if not self.state.channel_exists(sender, open_block_number):
+            return
+        c = self.state.get_channel(sender, open_block_number)
+        if c.unconfirmed_topups.pop(txhash, None) is None:
+            return
+        self.log.info('reverting unconfirmed deposit top up (sender %s, block number %s)',
+                      sender, open_block_number)
+        self.state.set_channel(c)
+
     # end events ####
 
     def close_channel(self, sender: str, open_block_number: int):
         """Close and settle a channel.
+        The closing transaction is sent by the transaction worker.
         Params:
             sender (str):               sender address
             open_block_number (int):    block the channel was open in
@@ -257,42 +418,42 @@ class ChannelManager(gevent.Greenlet):
         c = self.channels[sender, open_block_number]
         if c.last_signature is None:
             raise NoBalanceProofReceived('Cannot close a channel without a balance proof.')
-        # send closing tx
+        # update local state, the channel is closed once the transaction has been mined
+        c.state = ChannelState.CLOSE_PENDING
+        c.mtime = time.time()
+        self.state.set_channel(c)
+
+        self.transactions.close(sender, open_block_number)
+        self.log.info('queued channel close (sender %s, block number %s)',
+                      sender, open_block_number)
+
+    def create_close_transaction(self, channel, nonce: int = None, gas_price: int = None):
+        """Sign a transaction that closes and settles a channel with its latest balance proof.
+        Returns:
+            str: raw transaction
+        """
         closing_sig = sign_close(
             self.private_key,
-            sender,
-            open_block_number,
-            c.balance,
+            channel.sender,
+            channel.open_block_number,
+            channel.balance,
             self.channel_manager_contract.address
         )
-
-        raw_tx = create_signed_contract_transaction(
+        return create_signed_contract_transaction(
             self.private_key,
             self.channel_manager_contract,
             'cooperativeClose',
             [
                 self.state.receiver,
-                open_block_number,
-                c.balance,
-                decode_hex(c.last_signature),
+                channel.open_block_number,
+                channel.balance,
+                decode_hex(channel.last_signature),
                 closing_sig
-            ]
+            ],
+            nonce=nonce,
+            gas_price=gas_price
         )
 
-        # update local state
-        c.is_closed = True
-        c.mtime = time.time()
-        self.state.set_channel(c)
-
-        try:
-            txid = self.blockchain.web3.eth.sendRawTransaction(raw_tx)
-            self.log.info('sent channel close(sender %s, block number %s, tx %s)',
-                          sender, open_block_number, txid)
-        except InsufficientBalance:
-            c.state = ChannelState.CLOSE_PENDING
-            self.state.set_channel(c)
-            raise
-
     def force_close_channel(self, sender: str, open_block_number: int):
         """Forcibly remove a channel from our channel state"""
         assert is_checksum_address(sender)
@@ -349,6 +510,50 @@ class ChannelManager(gevent.Greenlet):
         """Get eth balance of the receiver"""
         return self.channel_manager_contract.web3.eth.getBalance(self.receiver)
 
+    def get_channel(self, sender: str, open_block_number: int, apply_pending: bool = True):
+        """Get a confirmed open channel that can be used for payments.
+
+        If deferred verification is enabled, balance and signature of the returned
+        channel reflect the latest accepted (but possibly not yet verified) balance proof,
+        unless `apply_pending` is False.
+        If pending channels are watched, a channel whose creation transaction has been
+        mined is returned before its event has been confirmed.
+
+        :returns: Channel, if it exists
+        """
+        assert is_checksum_address(sender)
+        if self.fast_start_max_lag is not None and not self.is_synced():
+            # served from the state file while the missed blocks are synced
+            lag = self.sync_lag
+            if lag is None or lag > self.fast_start_max_lag:
+                raise SyncInProgress('Channel history is being synced (%s blocks behind)' % lag)
+            if (sender, open_block_number) not in self.channels:
+                raise SyncInProgress(
+                    'Channel is not known yet, the channel history is being synced '
+                    '(sender=%s, open_block_number=%d)' % (sender, open_block_number))
+        c = None
+        if self.pending_watcher is not None and (sender, open_block_number) not in self.channels:
+            c = self.pending_watcher.get_channel(sender, open_block_number)
+        if c is None:
+            if (sender, open_block_number) in self.unconfirmed_channels:
+                raise InsufficientConfirmations(
+                    'Insufficient confirmations for the channel '
+                    '(sender=%s, open_block_number=%d)' % (sender, open_block_number))
+            try:
+                c = self.channels[sender, open_block_number]
+            except KeyError:
+                raise NoOpenChannel(
+                    'Channel does not exist or has been closed'
+                    '(sender=%s, open_block_number=%s)' % (sender, open_block_number))
+            if c.is_closed:
+                raise NoOpenChannel('Channel closing has been requested already.')
+        if self.deferred_verifier is not None:
+            if self.deferred_verifier.is_blacklisted(sender):
+                raise SenderBlacklisted('Sender has sent an invalid balance proof before.')
+            if apply_pending:
+                self.deferred_verifier.apply_pending(c)
+        return c
+
     def verify_balance_proof(self, sender, open_block_number, balance, signature):
         """Verify that a balance proof is valid and return the sender.
 
@@ -356,26 +561,12 @@ class ChannelManager(gevent.Greenlet):
 
         :returns: Channel, if it exists
         """
-        assert is_checksum_address(sender)
-        if (sender, open_block_number) in self.unconfirmed_channels:
-            raise InsufficientConfirmations(
-                'Insufficient confirmations for the channel '
-                '(sender=%s, open_block_number=%d)' % (sender, open_block_number))
-        try:
-            c = self.channels[sender, open_block_number]
-        except KeyError:
-            raise NoOpenChannel('Channel does not exist or has been closed'
-                                '(sender=%s, open_block_number=%s)' % (sender, open_block_number))
-        if c.is_closed:
-            raise NoOpenChannel('Channel closing has been requested already.')
-
+        c = self.get_channel(sender, open_block_number)
         if not is_same_address(
-                verify_balance_proof(
-                    self.receiver,
+                self.verifier.recover_sender(
                     open_block_number,
                     balance,
-                    decode_hex(signature),
-                    self.channel_manager_contract.address
+                    decode_hex(signature)
                 ),
                 sender
         ):
@@ -387,6 +578,9 @@ class ChannelManager(gevent.Greenlet):
         Method will try to reconstruct (verify) balance update data
         with a signature sent by the client.
         If verification is succesfull, an internal payment state is updated.
+        If deferred verification is enabled, the payment is registered right away
+        and verified later, as long as the sender's credit limit allows it.
+        Payments through channels that aren't confirmed yet are always verified.
         Parameters:
             sender (str):               sender of the balance proof
             open_block_number (int):    block the channel was opened in
@@ -394,19 +588,60 @@ class ChannelManager(gevent.Greenlet):
             signature(str):             balance proof to verify
         """
         assert is_checksum_address(sender)
+        if (self.pending_watcher is not None and
+                (sender, open_block_number) not in self.channels):
+            # the channel is served before it's confirmed, if at all
+            c = self.verify_balance_proof(sender, open_block_number, balance, signature)
+            self.check_balance(c, balance)
+            received = balance - c.balance
+            self.pending_watcher.register_payment(c, balance, signature)
+            return c.sender, received
+        if self.deferred_verifier is not None:
+            c = self.get_channel(sender, open_block_number)
+            self.check_balance(c, balance)
+            if self.deferred_verifier.defer(c, balance, signature):
+                self.log.debug('deferred payment verification '
+                               '(sender %s, block number %s, new balance %s)',
+                               c.sender, open_block_number, balance)
+                return c.sender, balance - c.balance
+            # over the credit limit - verify everything that's pending, then this one
+            self.deferred_verifier.flush()
         c = self.verify_balance_proof(sender, open_block_number, balance, signature)
-        if balance <= c.balance:
+        self.check_balance(c, balance)
+        received = balance - c.balance
+        self.commit_payment(sender, open_block_number, balance, signature)
+        return c.sender, received
+
+    def check_balance(self, channel, balance: int):
+        """Check that a new balance can be registered for a channel."""
+        if balance <= channel.balance:
             raise InvalidBalanceAmount('The balance must not decrease.')
-        if balance > c.deposit:
+        if balance > channel.deposit:
             raise InvalidBalanceProof('Balance must not be greater than deposit')
-        received = balance - c.balance
+
+    def commit_payment(self, sender: str, open_block_number: int, balance: int, signature: str):
+        """Store a verified balance proof in the channel state."""
+        c = self.channels[sender, open_block_number]
+        if balance <= c.balance:
+            return
         c.balance = balance
         c.last_signature = signature
         c.mtime = time.time()
         self.state.set_channel(c)
         self.log.debug('registered payment (sender %s, block number %s, new balance %s)',
                        c.sender, open_block_number, balance)
-        return c.sender, received
+
+    def rollback_unconfirmed(self, block_number: int, block_hash: str):
+        """Move the unconfirmed head back to the fork point of a reorg, after the
+        unconfirmed events above it have been reverted."""
+        if (self.state.confirmed_head_number is not None and
+                block_number < self.state.confirmed_head_number):
+            block_number = self.state.confirmed_head_number
+            block_hash = self.state.confirmed_head_hash
+        if (self.state.unconfirmed_head_number is None or
+                self.state.unconfirmed_head_number > block_number):
+            self.state.update_sync_state(unconfirmed_head_number=block_number,
+                                         unconfirmed_head_hash=block_hash)
 
     def reset_unconfirmed(self):
         """Forget all unconfirmed channels and topups to allow for a clean resync."""
@@ -465,8 +700,21 @@ class ChannelManager(gevent.Greenlet):
     def wait_sync(self):
         self.blockchain.wait_sync()
 
+    def is_synced(self) -> bool:
+        return self.blockchain.wait_sync_event.is_set()
+
+    @property
+    def sync_lag(self):
+        """Number of blocks the channel history is behind the node, None if unknown."""
+        return self.blockchain.sync_lag
+
+    @property
+    def health(self):
+        """Balances of the receiver and node liveness, refreshed in the background."""
+        return self.blockchain.get_health(self.receiver)
+
     def node_online(self):
-        return self.blockchain.is_connected.is_set()
+        return self.health.online
 
     def get_token_address(self):
         return self.token_contract.address
@@ -0,0 +1,241 @@
+"""Notifications of new blocks, pushed by the node or polled at adaptive intervals."""
+import json
+import logging
+import time
+
+import gevent
+import gevent.event
+from gevent import socket
+
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+log = logging.getLogger(__name__)
+
+
+class AdaptivePolling(object):
+    """Schedules polls of the node around the expected arrival of the next block.
+
+    The block time is estimated from the blocks seen so far. Until the next block
+    is due the node isn't polled, afterwards it's polled every `poll_interval` seconds.
+    """
+
+    def __init__(self, poll_interval: float = 2, smoothing: float = 0.2):
+        """
+        Args:
+            poll_interval (float, optional): seconds between polls once a block is due
+            smoothing (float, optional): weight of the latest block time in the estimate
+        """
+        assert poll_interval > 0
+        assert 0 < smoothing <= 1
+        self.poll_interval = poll_interval
+        self.smoothing = smoothing
+        self.block_time = None
+        self.head_number = None
+        self.head_time = None
+
+    def update(self, block_number: int, now: float = None):
+        """Record the latest block number seen on the node."""
+        now = time.time() if now is None else now
+        if self.head_number is not None and block_number <= self.head_number:
+            return
+        if self.head_number is not None:
+            block_time = (now - self.head_time) / (block_number - self.head_number)
+            if self.block_time is None:
+                self.block_time = block_time
+            else:
+                self.block_time += self.smoothing * (block_time - self.block_time)
+        self.head_number = block_number
+        self.head_time = now
+
+    def next_interval(self, now: float = None) -> float:
+        """
+        Returns:
+            float: seconds to wait before the node is polled again
+        """
+        if self.block_time is None:
+            return self.poll_interval
+        now = time.time() if now is None else now
+        remaining = self.head_time + self.block_time - now
+        if remaining > self.poll_interval:
+            return remaining
+        return self.poll_interval
+
+
+class IPCConnection(object):
+    """JSON-RPC connection over the IPC socket of a node.
+
+    The node doesn't delimit its messages, so they are split by decoding the stream.
+    """
+
+    def __init__(self, path: str, timeout: float = None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+
+    def send(self, message: str):
+        self.sock.sendall(message.encode())
+
+    def recv(self) -> str:
+        """Returns the next JSON message sent by the node."""
+        while True:
+            data = self.buffer.lstrip()
+            if data:
+                try:
+                    _, end = self.decoder.raw_decode(data)
+                except ValueError:
+                    pass
+                else:
+                    self.buffer = data[end:]
+                    return data[:end]
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError('IPC connection closed')
+            self.buffer += chunk.decode()
+
+    def close(self):
+        self.sock.close()
+
+
+class WebsocketConnection(object):
+    """JSON-RPC connection over a websocket.
+
+    websocket-client uses blocking sockets, so messages are received in a native thread.
+    """
+
+    def __init__(self, url: str, timeout: float = None):
+        self.ws = websocket.create_connection(url, timeout=timeout)
+
+    def send(self, message: str):
+        self.ws.send(message)
+
+    def recv(self) -> str:
+        return gevent.get_hub().threadpool.apply(self.ws.recv)
+
+    def close(self):
+        # interrupts a pending recv
+        self.ws.abort()
+        self.ws.close()
+
+
+def is_websocket_endpoint(endpoint: str) -> bool:
+    return endpoint.startswith(('ws://', 'wss://'))
+
+
+def check_endpoint(endpoint: str):
+    """Check that the transport of `endpoint` is available.
+
+    Raises:
+        RuntimeError: if the endpoint is a websocket URL and the optional
+            websocket-client package isn't installed
+    """
+    if is_websocket_endpoint(endpoint) and websocket is None:
+        raise RuntimeError(
+            'websocket-client has to be installed to subscribe to new blocks over a '
+            'websocket (pip install microraiden[websocket]), or use the IPC path of the node'
+        )
+
+
+def connect(endpoint: str, timeout: float = None):
+    """Open a connection that supports subscriptions to the node at `endpoint`.
+
+    Args:
+        endpoint (str): websocket URL (ws:// or wss://) or path of an IPC socket
+        timeout (float, optional): socket timeout in seconds
+    """
+    check_endpoint(endpoint)
+    if is_websocket_endpoint(endpoint):
+        return WebsocketConnection(endpoint, timeout=timeout)
+    return IPCConnection(endpoint, timeout=timeout)
+
+
+class NewHeadsSubscription(gevent.Greenlet):
+    """Subscription to the `newHeads` notifications of a node.
+
+    The connection is reopened after it drops. While it's down `connected` isn't set,
+    so the subscriber can fall back to polling.
+    """
+
+    def __init__(self, endpoint: str, reconnect_interval: float = 5):
+        """
+        Args:
+            endpoint (str): websocket URL or path of the IPC socket of the node
+            reconnect_interval (float, optional): seconds to wait before reconnecting
+        """
+        gevent.Greenlet.__init__(self)
+        check_endpoint(endpoint)
+        self.endpoint = endpoint
+        self.reconnect_interval = reconnect_interval
+        self.connected = gevent.event.Event()
+        self.new_head = gevent.event.Event()
+        self.head_number = None
+        self.n_notifications = 0
+        self.running = False
+        self.connection = None
+
+    def _run(self):
+        self.running = True
+        while self.running:
+            try:
+                self.connection = connect(self.endpoint)
+                self._subscribe()
+                log.info('subscribed to new blocks (%s)', self.endpoint)
+                self.connected.set()
+                while self.running:
+                    self._handle(json.loads(self.connection.recv()))
+            except Exception as e:
+                if not self.running:
+                    break
+                log.warning('new block subscription (%s) failed: %s. '
+                            'Reconnecting in %s seconds.',
+                            self.endpoint, e, self.reconnect_interval)
+            finally:
+                self._close()
+            gevent.sleep(self.reconnect_interval)
+
+    def _subscribe(self):
+        self.connection.send(json.dumps({
+            'jsonrpc': '2.0',
+            'id': 1,
+            'method': 'eth_subscribe',
+            'params': ['newHeads']
+        }))
+        response = json.loads(self.connection.recv())
+        if 'error' in response:
+            raise ValueError(response['error'])
+
+    def _handle(self, message):
+        if message.get('method') != 'eth_subscription':
+            return
+        self.head_number = int(message['params']['result']['number'], 16)
+        self.n_notifications += 1
+        self.new_head.set()
+
+    def _close(self):
+        if self.connected.is_set():
+            self.connected.clear()
+            # wake up the subscriber, so it can fall back to polling
+            self.new_head.set()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait for a new block.
+
+        Returns:
+            bool: True if a new block arrived, False on timeout or if the subscription
+                dropped
+        """
+        self.new_head.wait(timeout)
+        notified = self.new_head.is_set() and self.connected.is_set()
+        self.new_head.clear()
+        return notified
+
+    def stop(self):
+        self.running = False
+        self._close()
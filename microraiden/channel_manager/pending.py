@@ -0,0 +1,310 @@
+"""Early registration of channels from pending transactions.
+
+A new channel can't be paid through until its `ChannelCreated` event has been synced
+with enough confirmations. If enabled, the receiver watches the pending block for
+transactions that create channels to it. Once a client presents a balance proof for
+such a channel and the creation transaction has been mined in the claimed block, the
+channel is served right away. It isn't stored until its event is confirmed, and the
+amount paid through channels that aren't confirmed yet is limited per sender, as it's
+lost if the creation transaction is reorganized away. Channels whose event is late are
+no longer served and written off, but their payments are kept until the event arrives.
+"""
+import logging
+import time
+from collections import OrderedDict, namedtuple
+
+import gevent
+import requests
+from eth_abi import decode_abi
+from eth_utils import decode_hex, encode_hex, function_abi_to_4byte_selector
+from web3 import Web3
+
+from microraiden.exceptions import InsufficientConfirmations
+from microraiden.utils import is_same_address, to_checksum_address
+from .channel import Channel, ChannelState
+from .risk import RiskBudget
+
+log = logging.getLogger(__name__)
+
+# number of expired channels whose payments are kept for a late confirmation
+MAX_EXPIRED_CHANNELS = 10000
+
+PendingTransaction = namedtuple(
+    'PendingTransaction',
+    ['txhash', 'sender', 'deposit', 'first_block_number', 'seen']
+)
+
+
+def _function_abi(contract, name: str, n_inputs: int) -> dict:
+    return [
+        abi_element for abi_element in contract.abi
+        if abi_element['type'] == 'function' and abi_element['name'] == name and
+        len(abi_element['inputs']) == n_inputs
+    ][0]
+
+
+class PendingChannelWatcher(gevent.Greenlet):
+    """Registers channels to the receiver from pending creation transactions."""
+
+    def __init__(
+            self,
+            channel_manager,
+            web3: Web3,
+            credit_limit: int,
+            poll_interval: float = 0.5,
+            expiry: float = 600,
+            max_receipt_lookups: int = 3
+    ):
+        """
+        Args:
+            channel_manager (ChannelManager): channel manager of the receiver
+            web3 (Web3): web3 provider
+            credit_limit (int): maximum amount paid per sender through channels whose
+                creation isn't confirmed yet
+            poll_interval (float, optional): seconds between polls of the pending block
+            expiry (float, optional): seconds after which a channel whose creation hasn't
+                been confirmed is no longer served
+            max_receipt_lookups (int, optional): maximum number of transaction receipts
+                looked up per request for a channel that isn't known yet
+        """
+        gevent.Greenlet.__init__(self)
+        self.cm = channel_manager
+        self.web3 = web3
+        self.budget = RiskBudget(credit_limit)
+        self.poll_interval = poll_interval
+        self.expiry = expiry
+        self.max_receipt_lookups = max_receipt_lookups
+        # txhash => PendingTransaction
+        self.transactions = OrderedDict()
+        # (sender, open_block_number) => (Channel, txhash) of channels served early
+        self.channels = OrderedDict()
+        # (sender, open_block_number) => Channel that expired before its confirmation
+        self.expired = OrderedDict()
+        self.running = False
+        self.n_registered = 0
+        self.n_served = 0
+        self.n_confirmed = 0
+        self.n_lost = 0
+        self.n_recovered = 0
+
+        channel_manager_contract = channel_manager.channel_manager_contract
+        token_contract = channel_manager.token_contract
+        self.channel_manager_address = channel_manager_contract.address
+        # (to, function selector) => (argument types, (sender, receiver, deposit) getter)
+        self.decoders = {}
+        for contract, name, n_inputs, get_channel in (
+                (channel_manager_contract, 'createChannel', 2,
+                 lambda tx, args: (tx['from'], args[0], args[1])),
+                (channel_manager_contract, 'createChannelDelegate', 3,
+                 lambda tx, args: args),
+                (token_contract, 'transfer', 3, self._erc223_channel)
+        ):
+            function_abi = _function_abi(contract, name, n_inputs)
+            selector = encode_hex(function_abi_to_4byte_selector(function_abi))
+            types = [arg['type'] for arg in function_abi['inputs']]
+            self.decoders[contract.address.lower(), selector] = (types, get_channel)
+
+    def _run(self):
+        self.running = True
+        while self.running:
+            try:
+                self.poll()
+            except requests.exceptions.ConnectionError:
+                log.warning('Ethereum node refused connection, pending channels are not '
+                            'registered')
+            gevent.sleep(self.poll_interval)
+
+    def stop(self):
+        self.running = False
+
+    def _erc223_channel(self, tx, args):
+        to, deposit, data = args
+        # a transfer with the sender and the receiver as data creates a channel
+        if not is_same_address(to, self.channel_manager_address) or len(data) != 40:
+            return None
+        return data[:20], data[20:], deposit
+
+    def decode_transaction(self, tx):
+        """
+        Returns:
+            tuple: sender, receiver and deposit of the channel created by a transaction,
+                None if it doesn't create one
+        """
+        if tx['to'] is None or len(tx['input']) < 10:
+            return None
+        decoder = self.decoders.get((tx['to'].lower(), tx['input'][:10].lower()))
+        if decoder is None:
+            return None
+        types, get_channel = decoder
+        try:
+            args = decode_abi(types, decode_hex(tx['input'][10:]))
+        except Exception:
+            log.debug('failed to decode transaction input (tx %s)', encode_hex(tx['hash']),
+                      exc_info=True)
+            return None
+        channel = get_channel(tx, args)
+        if channel is None:
+            return None
+        sender, receiver, deposit = channel
+        return to_checksum_address(sender), to_checksum_address(receiver), deposit
+
+    def poll(self):
+        """Register the channels created by the transactions of the pending block."""
+        block = self.web3.eth.getBlock('pending', True)
+        if block is not None:
+            for tx in block['transactions']:
+                self.add_transaction(tx, block['number'])
+        self.expire()
+
+    def add_transaction(self, tx, block_number: int):
+        txhash = encode_hex(tx['hash'])
+        if txhash in self.transactions:
+            return
+        channel = self.decode_transaction(tx)
+        if channel is None:
+            return
+        sender, receiver, deposit = channel
+        if not is_same_address(receiver, self.cm.receiver) or deposit <= 0:
+            return
+        self.transactions[txhash] = PendingTransaction(
+            txhash,
+            sender,
+            deposit,
+            block_number,
+            time.time()
+        )
+        self.n_registered += 1
+        log.info('pending channel registered (sender %s, deposit %d, tx %s)',
+                 sender, deposit, txhash)
+
+    def get_channel(self, sender: str, open_block_number: int):
+        """Get a channel whose creation transaction has been mined in `open_block_number`,
+        but whose event hasn't been confirmed yet.
+
+        Returns:
+            Channel: channel object that isn't stored to the state, None if there's no
+                such channel
+        """
+        key = (sender, open_block_number)
+        if key in self.channels:
+            return self.channels[key][0]
+        bound = {txhash for _, txhash in self.channels.values()}
+        candidates = [
+            tx for tx in self.transactions.values()
+            if tx.sender == sender and tx.txhash not in bound and
+            tx.first_block_number <= open_block_number
+        ]
+        # the receipts are looked up on the request path, the transactions seen last
+        # before the claimed block are the most likely ones
+        candidates.sort(key=lambda tx: tx.first_block_number, reverse=True)
+        for tx in candidates[:self.max_receipt_lookups]:
+            receipt = self.web3.eth.getTransactionReceipt(tx.txhash)
+            if receipt is None:
+                continue
+            if receipt.get('status', 1) == 0:
+                log.info('pending channel creation failed (sender %s, tx %s)',
+                         sender, tx.txhash)
+                del self.transactions[tx.txhash]
+                continue
+            if receipt['blockNumber'] != open_block_number:
+                continue
+            channel = Channel(self.cm.receiver, sender, tx.deposit, open_block_number)
+            channel.state = ChannelState.OPEN
+            self.channels[key] = (channel, tx.txhash)
+            self.n_served += 1
+            log.info('serving channel before confirmation (sender %s, block number %s)',
+                     sender, open_block_number)
+            return channel
+        return None
+
+    def register_payment(self, channel, balance: int, signature: str):
+        """Register a verified payment through a channel returned by `get_channel`.
+
+        Raises:
+            InsufficientConfirmations: if the sender's credit limit doesn't allow it
+        """
+        received = balance - channel.balance
+        if not self.budget.can_extend(channel.sender, received):
+            raise InsufficientConfirmations(
+                'Credit limit of unconfirmed channels reached '
+                '(sender=%s, open_block_number=%d)' % (channel.sender, channel.open_block_number))
+        self.budget.extend(channel.sender, received)
+        channel.balance = balance
+        channel.last_signature = signature
+        channel.mtime = time.time()
+
+    def confirm(self, channel):
+        """Move the payments of a channel served early to its confirmed channel object.
+        The object is not stored to the state."""
+        key = (channel.sender, channel.open_block_number)
+        entry = self.channels.pop(key, None)
+        if entry is not None:
+            pending, txhash = entry
+            self.transactions.pop(txhash, None)
+            self.budget.settle(channel.sender, pending.balance)
+            self.n_confirmed += 1
+        elif key in self.expired:
+            # written off already
+            pending = self.expired.pop(key)
+            self.n_recovered += 1
+            log.info('expired channel has been confirmed late (sender %s, block number %s)',
+                     channel.sender, channel.open_block_number)
+        else:
+            return channel
+        if pending.balance > channel.balance:
+            channel.balance = pending.balance
+            channel.last_signature = pending.last_signature
+        return channel
+
+    def revert(self, sender: str, open_block_number: int):
+        """Forget a channel served early whose creation has been reorganized away."""
+        self.expired.pop((sender, open_block_number), None)
+        entry = self.channels.pop((sender, open_block_number), None)
+        if entry is None:
+            return
+        pending, txhash = entry
+        self.transactions.pop(txhash, None)
+        self._lose(pending)
+
+    def expire(self):
+        """Stop serving channels whose creation hasn't been confirmed in time and forget
+        their transactions. The payments of the channels are kept in case the event is
+        only late."""
+        deadline = time.time() - self.expiry
+        for key, (pending, txhash) in list(self.channels.items()):
+            if pending.ctime < deadline:
+                del self.channels[key]
+                self.transactions.pop(txhash, None)
+                self._lose(pending)
+                self.expired[key] = pending
+                if len(self.expired) > MAX_EXPIRED_CHANNELS:
+                    self.expired.popitem(last=False)
+        bound = {txhash for _, txhash in self.channels.values()}
+        for txhash, tx in list(self.transactions.items()):
+            if tx.seen < deadline and txhash not in bound:
+                del self.transactions[txhash]
+
+    def _lose(self, channel):
+        lost = self.budget.write_off(channel.sender, channel.balance)
+        self.n_lost += 1
+        log.warning('channel served before confirmation has not been confirmed '
+                    '(sender %s, block number %s, lost %d)',
+                    channel.sender, channel.open_block_number, lost)
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict: early registration statistics and at-risk exposure
+        """
+        metrics = self.budget.metrics()
+        metrics.update({
+            'pending_transactions': len(self.transactions),
+            'unconfirmed_channels': len(self.channels),
+            'expired_channels': len(self.expired),
+            'registered': self.n_registered,
+            'served': self.n_served,
+            'confirmed': self.n_confirmed,
+            'lost': self.n_lost,
+            'recovered': self.n_recovered
+        })
+        return metrics
@@ -0,0 +1,72 @@
+"""Accounting of tokens that have been served to senders without a verified payment."""
+from collections import defaultdict
+
+
+class RiskBudget(object):
+    """Per-sender credit limit for payments that have not been verified yet."""
+
+    def __init__(self, limit: int):
+        """
+        Args:
+            limit (int): maximum amount of unverified tokens per sender
+        """
+        assert limit >= 0
+        self.limit = limit
+        self.exposure = defaultdict(int)
+        self.written_off = 0
+
+    def can_extend(self, sender: str, amount: int) -> bool:
+        """
+        Returns:
+            bool: True if `amount` can be served to the sender on credit
+        """
+        return self.exposure[sender] + amount <= self.limit
+
+    def extend(self, sender: str, amount: int):
+        """Serve `amount` to the sender on credit."""
+        assert amount >= 0
+        self.exposure[sender] += amount
+
+    def settle(self, sender: str, amount: int):
+        """Remove `amount` from sender's exposure once the payment has been verified."""
+        assert amount <= self.exposure[sender]
+        self.exposure[sender] -= amount
+        if self.exposure[sender] == 0:
+            del self.exposure[sender]
+
+    def write_off(self, sender: str, amount: int = None) -> int:
+        """Forget sender's exposure, i.e. if the payments turned out to be invalid.
+
+        Args:
+            amount (int, optional): part of the exposure that is lost. All of it, if None.
+        Returns:
+            int: amount of tokens that were lost
+        """
+        if amount is None:
+            lost = self.exposure.pop(sender, 0)
+        else:
+            self.settle(sender, amount)
+            lost = amount
+        self.written_off += lost
+        return lost
+
+    @property
+    def total_exposure(self) -> int:
+        """
+        Returns:
+            int: sum of unverified tokens over all senders
+        """
+        return sum(self.exposure.values())
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict: at-risk exposure statistics
+        """
+        return {
+            'limit': self.limit,
+            'total_exposure': self.total_exposure,
+            'max_exposure': max(self.exposure.values(), default=0),
+            'senders_at_risk': len(self.exposure),
+            'written_off': self.written_off
+        }
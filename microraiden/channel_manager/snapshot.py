@@ -0,0 +1,146 @@
+"""Signed snapshots of the channel manager state, to bootstrap a new proxy.
+
+A snapshot holds the confirmed channels of a receiver and the confirmed head they're
+valid at (the checkpoint), signed with the receiver's key. A new state file created from
+a snapshot resumes the sync from the checkpoint, so only the blocks since the snapshot
+are fetched. Unconfirmed channels and topups aren't part of it, they're synced again.
+"""
+import json
+import os
+from typing import Any, Dict
+
+from eth_utils import decode_hex, encode_hex, keccak
+from web3 import Web3
+
+from microraiden.exceptions import (
+    InvalidSnapshot,
+    NetworkIdMismatch,
+    SnapshotNotCanonical,
+    StateFileException
+)
+from microraiden.utils import addr_from_sig, is_same_address, privkey_to_addr, sign
+from .channel import Channel, ChannelState
+from .state import ChannelManagerState
+
+SNAPSHOT_VERSION = 1
+
+SELECT_SNAPSHOT_CHANNELS_SQL = """
+SELECT `sender`, `open_block_number`, `deposit`, `balance`, `last_signature`,
+    `settle_timeout`, `mtime`, `ctime`, `state`
+FROM `channels`
+WHERE `confirmed` = 1
+ORDER BY `sender`, `open_block_number`
+"""
+
+
+def snapshot_hash(snapshot: Dict[str, Any]) -> bytes:
+    """Hash of the canonical JSON encoding of a snapshot, without its signature."""
+    content = {key: value for key, value in snapshot.items() if key != 'signature'}
+    return keccak(json.dumps(content, sort_keys=True, separators=(',', ':')).encode())
+
+
+def export_snapshot(state: ChannelManagerState, private_key: str) -> Dict[str, Any]:
+    """Snapshot of the confirmed channels of a state, signed by its receiver.
+
+    The channels and the checkpoint are read in one transaction, so a proxy may keep
+    using the state file meanwhile.
+    """
+    assert is_same_address(privkey_to_addr(private_key), state.receiver)
+    state.conn.execute('BEGIN')
+    try:
+        sync_state = state._sync_state
+        rows = state.conn.execute(SELECT_SNAPSHOT_CHANNELS_SQL).fetchall()
+    finally:
+        state.conn.rollback()
+    if sync_state['confirmed_head_hash'] is None:
+        raise StateFileException('the state has no confirmed head to resume from')
+
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'network_id': state.network_id,
+        'contract_address': state.contract_address,
+        'receiver': state.receiver,
+        'confirmed_head_number': sync_state['confirmed_head_number'],
+        # block hashes are stored as bytes by the sync
+        'confirmed_head_hash': encode_hex(sync_state['confirmed_head_hash']),
+        'channels': [
+            dict(row, deposit=str(int(row['deposit'])), balance=str(int(row['balance'])))
+            for row in rows
+        ]
+    }
+    snapshot['signature'] = encode_hex(sign(private_key, snapshot_hash(snapshot)))
+    return snapshot
+
+
+def verify_snapshot(snapshot: Dict[str, Any], receiver: str, contract_address: str):
+    """
+    Raises:
+        InvalidSnapshot: if the snapshot isn't signed by `receiver`, or is of another
+            contract
+    """
+    try:
+        if snapshot['version'] != SNAPSHOT_VERSION:
+            raise InvalidSnapshot('unsupported snapshot version %s' % snapshot['version'])
+        signer = addr_from_sig(decode_hex(snapshot['signature']), snapshot_hash(snapshot))
+    except (KeyError, TypeError, ValueError, AssertionError) as e:
+        raise InvalidSnapshot('malformed snapshot: %s' % e)
+    if not is_same_address(signer, snapshot['receiver']):
+        raise InvalidSnapshot('snapshot is not signed by its receiver')
+    if not is_same_address(snapshot['receiver'], receiver):
+        raise InvalidSnapshot('snapshot of receiver %s' % snapshot['receiver'])
+    if not is_same_address(snapshot['contract_address'], contract_address):
+        raise InvalidSnapshot('snapshot of contract %s' % snapshot['contract_address'])
+
+
+def import_snapshot(
+        snapshot: Dict[str, Any],
+        state_filename: str,
+        web3: Web3,
+        contract_address: str,
+        receiver: str
+) -> ChannelManagerState:
+    """Create a new state from a snapshot, after checking its signature and that its
+    checkpoint is still part of the canonical chain.
+
+    Raises:
+        InvalidSnapshot: if the snapshot isn't valid for the receiver and contract
+        SnapshotNotCanonical: if the checkpoint block has been reorganized away
+        NetworkIdMismatch: if the snapshot is of another network
+    """
+    verify_snapshot(snapshot, receiver, contract_address)
+    network_id = int(web3.version.network)
+    if network_id != snapshot['network_id']:
+        raise NetworkIdMismatch('Network id mismatch: snapshot=%d, backend=%d' % (
+                                snapshot['network_id'], network_id))
+    checkpoint_number = snapshot['confirmed_head_number']
+    checkpoint = web3.eth.getBlock(checkpoint_number)
+    if (checkpoint is None or
+            encode_hex(checkpoint.hash).lower() != snapshot['confirmed_head_hash'].lower()):
+        raise SnapshotNotCanonical('checkpoint block %d is not canonical' % checkpoint_number)
+    if state_filename not in (None, ':memory:') and os.path.exists(state_filename):
+        raise StateFileException('state file %s exists already' % state_filename)
+
+    channels = []
+    for row in snapshot['channels']:
+        channel = Channel(receiver, row['sender'], int(row['deposit']),
+                          row['open_block_number'])
+        channel.balance = int(row['balance'])
+        channel.last_signature = row['last_signature']
+        channel.settle_timeout = row['settle_timeout']
+        channel.mtime = row['mtime']
+        channel.ctime = row['ctime']
+        channel.state = ChannelState(row['state'])
+        channel.confirmed = True
+        channels.append(channel)
+
+    checkpoint_hash = decode_hex(snapshot['confirmed_head_hash'])
+    state = ChannelManagerState(state_filename)
+    state.setup_db(network_id, snapshot['contract_address'], snapshot['receiver'])
+    state.add_channels(channels)
+    state.update_sync_state(
+        confirmed_head_number=checkpoint_number,
+        confirmed_head_hash=checkpoint_hash,
+        unconfirmed_head_number=checkpoint_number,
+        unconfirmed_head_hash=checkpoint_hash
+    )
+    return state
@@ -4,9 +4,9 @@
 import sqlite3
 import os
 import logging
-from eth_utils import is_address
+from typing import List
 
-from microraiden.utils import check_permission_safety
+from microraiden.utils import check_permission_safety, is_address
 
 from microraiden.exceptions import (
     InsecureStateFile
@@ -114,6 +114,16 @@ WHERE `sender` = ? AND `open_block_number` = ?;
 DEL_CHANNEL_SQL = """
 DELETE FROM `channels` WHERE `sender` = ? AND `open_block_number` = ?"""
 
+# created on load as well, state files of earlier versions don't have it
+DISPUTES_CREATION_SQL = """
+CREATE TABLE IF NOT EXISTS `disputes` (
+    `sender`              CHAR(42)  NOT NULL,
+    `open_block_number`   INTEGER   NOT NULL,
+    `settle_block_number` INTEGER   NOT NULL,
+    PRIMARY KEY (`sender`, `open_block_number`)
+);
+"""
+
 
 class ChannelManagerState(object):
     """The part of the channel manager state that needs to persist."""
@@ -122,6 +132,7 @@ class ChannelManagerState(object):
         self.filename = filename
         self.conn = sqlite3.connect(self.filename, isolation_level="EXCLUSIVE")
         self.conn.row_factory = dict_factory
+        self.conn.executescript(DISPUTES_CREATION_SQL)
         if filename not in (None, ':memory:'):
             os.chmod(filename, 0o600)
 
@@ -334,12 +345,12 @@ class ChannelManagerState(object):
             self.conn.execute('INSERT OR REPLACE INTO topups VALUES (?, ?, ?)',
                               [channel_rowid, txhash, str(deposit)])
 
-    def add_channel(self, channel: Channel):
-        """Add or update channel state"""
+    @staticmethod
+    def _channel_params(channel: Channel):
         assert channel.open_block_number > 0
         assert channel.state is not ChannelState.UNDEFINED
         assert is_address(channel.sender)
-        params = [
+        return [
             channel.sender,
             channel.open_block_number,
             str(channel.deposit),
@@ -351,11 +362,23 @@ class ChannelManagerState(object):
             channel.state.value,
             channel.confirmed
         ]
-        self.conn.execute(ADD_CHANNEL_SQL, params)
+
+    def add_channel(self, channel: Channel):
+        """Add or update channel state"""
+        self.conn.execute(ADD_CHANNEL_SQL, self._channel_params(channel))
         rowid = self.get_channel_rowid(channel.sender, channel.open_block_number)
         self.set_unconfirmed_topups(rowid, channel.unconfirmed_topups)
         self.conn.commit()
 
+    def add_channels(self, channels: List[Channel]):
+        """Add or update many channels without unconfirmed topups in one transaction."""
+        assert all(not channel.unconfirmed_topups for channel in channels)
+        self.conn.executemany(
+            ADD_CHANNEL_SQL,
+            [self._channel_params(channel) for channel in channels]
+        )
+        self.conn.commit()
+
     def get_channel(self, sender: str, open_block_number: int):
         assert is_address(sender)
         assert open_block_number > 0
@@ -392,6 +415,30 @@ class ChannelManagerState(object):
         #               (sender, block))
         return ret
 
+    @property
+    def disputes(self):
+        """Get list of close requests to be challenged, ordered by the settle block number
+        Returns:
+            list: (sender, open_block_number, settle_block_number) tuples
+        """
+        c = self.conn.cursor()
+        c.execute('SELECT * FROM `disputes` ORDER BY `settle_block_number`')
+        return [
+            (result['sender'], result['open_block_number'], result['settle_block_number'])
+            for result in c.fetchall()
+        ]
+
+    def add_dispute(self, sender: str, open_block_number: int, settle_block_number: int):
+        assert is_address(sender)
+        self.conn.execute('INSERT OR REPLACE INTO `disputes` VALUES (?, ?, ?)',
+                          [sender, open_block_number, settle_block_number])
+        self.conn.commit()
+
+    def del_dispute(self, sender: str, open_block_number: int):
+        self.conn.execute('DELETE FROM `disputes` WHERE `sender` = ? AND `open_block_number` = ?',
+                          [sender, open_block_number])
+        self.conn.commit()
+
     def del_unconfirmed_channels(self):
         self.conn.execute('DELETE FROM `channels` WHERE `confirmed` = 0')
         self.conn.commit()
@@ -402,3 +449,4 @@ class ChannelManagerState(object):
         self.conn.execute('UPDATE `channels` SET `state` = ?'
                           'WHERE `sender` = ? AND `open_block_number` = ?',
                           [state, sender, open_block_number])
+        self.conn.commit()
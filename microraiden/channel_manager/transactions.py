@@ -0,0 +1,224 @@
+"""Sending of the receiver's transactions off the sync loop.
+
+Channels are closed by queueing an intent, the transaction is built, signed and sent
+by a background greenlet. It assigns the nonces of the receiver's transactions locally,
+so that closes and challenges sent in quick succession don't have to wait for each other
+to reach the node's pending pool, and tracks their receipts. Channels are in the
+CLOSE_PENDING state until their closing transaction has been mined, those left over from
+a previous run are closed again when the worker starts. A closing transaction that
+couldn't be sent or failed is retried a few times, one that couldn't be sent for an
+insufficient balance once the receiver's balance is sufficient.
+"""
+import logging
+import time
+from collections import OrderedDict, namedtuple
+
+import gevent
+import gevent.event
+import requests
+from eth_utils import encode_hex
+from ethereum.exceptions import InsufficientBalance
+from web3 import Web3
+
+from .channel import ChannelState
+
+log = logging.getLogger(__name__)
+
+CloseIntent = namedtuple('CloseIntent', ['sender', 'open_block_number'])
+
+SentTransaction = namedtuple('SentTransaction', ['intent', 'nonce', 'sent'])
+
+
+class TransactionWorker(gevent.Greenlet):
+    """Sends the closing transactions of channels and tracks their receipts."""
+
+    def __init__(
+            self,
+            channel_manager,
+            web3: Web3,
+            poll_interval: float = 2,
+            retry_interval: float = 30,
+            max_attempts: int = 3
+    ):
+        """
+        Args:
+            channel_manager (ChannelManager): channel manager of the closed channels
+            web3 (Web3): web3 provider
+            poll_interval (float, optional): seconds between checks of the receipts
+            retry_interval (float, optional): seconds to wait before a closing transaction
+                that couldn't be sent or failed is sent again
+            max_attempts (int, optional): number of attempts to close a channel. Channels
+                that couldn't be closed are closed again after a restart.
+        """
+        gevent.Greenlet.__init__(self)
+        self.cm = channel_manager
+        self.web3 = web3
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self.queue = OrderedDict()
+        # txhash => SentTransaction, until the transaction has been mined
+        self.sent = OrderedDict()
+        # (sender, open_block_number) of the sent transactions
+        self.unmined = set()
+        # (sender, open_block_number) => (CloseIntent, time of the next attempt)
+        self.retries = OrderedDict()
+        # (sender, open_block_number) => number of failed attempts
+        self.attempts = {}
+        # next nonce of the receiver, None if it has to be read from the node
+        self.nonce = None
+        self.wakeup = gevent.event.Event()
+        self.running = False
+        self.n_sent = 0
+        self.n_mined = 0
+        self.n_failed = 0
+
+    def _run(self):
+        self.running = True
+        self.restore()
+        while self.running:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            try:
+                self.process()
+            except requests.exceptions.ConnectionError:
+                log.warning('Ethereum node refused connection, retrying in %d seconds',
+                            self.poll_interval)
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+
+    def restore(self):
+        """Queue the closing of the channels left in the CLOSE_PENDING state."""
+        for sender, open_block_number in self.cm.state.pending_channels:
+            self.close(sender, open_block_number)
+
+    def close(self, sender: str, open_block_number: int):
+        """Queue the closing of a channel with its latest balance proof."""
+        key = (sender, open_block_number)
+        if key in self.unmined:
+            return
+        self.retries.pop(key, None)
+        self.queue[key] = CloseIntent(sender, open_block_number)
+        self.wakeup.set()
+
+    def assign_nonce(self) -> int:
+        """Get the nonce of the receiver's next transaction."""
+        if self.nonce is None:
+            self.nonce = self.web3.eth.getTransactionCount(self.cm.receiver, 'pending')
+        nonce = self.nonce
+        self.nonce += 1
+        return nonce
+
+    def reset_nonce(self):
+        """Read the nonce from the node again, i.e. after an assigned nonce wasn't used."""
+        self.nonce = None
+
+    def process(self):
+        """Check the receipts of the sent transactions and send the queued ones."""
+        for txhash, tx in list(self.sent.items()):
+            receipt = self.web3.eth.getTransactionReceipt(txhash)
+            if receipt is None:
+                continue
+            del self.sent[txhash]
+            self.unmined.discard(tx.intent)
+            if receipt.get('status', 1) == 0:
+                self._failed(tx.intent, 'transaction %s failed' % txhash)
+                continue
+            self.n_mined += 1
+            self.attempts.pop(tx.intent, None)
+            log.info('channel close mined (sender %s, block number %s, tx %s)',
+                     tx.intent.sender, tx.intent.open_block_number, txhash)
+            if self.cm.state.channel_exists(tx.intent.sender, tx.intent.open_block_number):
+                self.cm.state.set_channel_state(
+                    tx.intent.sender,
+                    tx.intent.open_block_number,
+                    ChannelState.CLOSED
+                )
+        now = time.time()
+        for key, (intent, next_attempt) in list(self.retries.items()):
+            if next_attempt <= now:
+                del self.retries[key]
+                self.queue.setdefault(key, intent)
+        while self.queue:
+            key, intent = self.queue.popitem(last=False)
+            try:
+                self._send(intent)
+            except Exception:
+                self.reset_nonce()
+                self.queue[key] = intent
+                self.queue.move_to_end(key, last=False)
+                raise
+
+    def flush(self):
+        """Send the queued transactions now."""
+        while self.queue:
+            key, intent = self.queue.popitem(last=False)
+            self._send(intent)
+
+    def _send(self, intent: CloseIntent):
+        if not self.cm.state.channel_exists(intent.sender, intent.open_block_number):
+            # settled meanwhile
+            return
+        channel = self.cm.state.get_channel(intent.sender, intent.open_block_number)
+        nonce = self.assign_nonce()
+        raw_tx = self.cm.create_close_transaction(channel, nonce=nonce)
+        try:
+            txhash = encode_hex(self.web3.eth.sendRawTransaction(raw_tx))
+        except InsufficientBalance:
+            self.reset_nonce()
+            log.fatal('Insufficient ETH balance of the receiver. '
+                      "Can't close the channel. "
+                      'Will retry once the balance is sufficient')
+            self.cm.blockchain.insufficient_balance = True
+            self._failed(intent, 'insufficient balance', retry=False)
+            return
+        except ValueError as e:
+            self.reset_nonce()
+            self._failed(intent, str(e))
+            return
+        self.n_sent += 1
+        self.sent[txhash] = SentTransaction(intent, nonce, time.time())
+        self.unmined.add(intent)
+        log.info('sent channel close (sender %s, block number %s, tx %s)',
+                 intent.sender, intent.open_block_number, txhash)
+
+    def _failed(self, intent: CloseIntent, reason: str, retry: bool = True):
+        self.n_failed += 1
+        log.warning('failed to close channel (sender %s, block number %s): %s',
+                    intent.sender, intent.open_block_number, reason)
+        if not self.cm.state.channel_exists(intent.sender, intent.open_block_number):
+            self.attempts.pop(intent, None)
+            return
+        # closed again on restart or once the balance is sufficient
+        self.cm.state.set_channel_state(
+            intent.sender,
+            intent.open_block_number,
+            ChannelState.CLOSE_PENDING
+        )
+        if not retry:
+            return
+        attempts = self.attempts.get(intent, 0) + 1
+        if attempts >= self.max_attempts:
+            del self.attempts[intent]
+            log.error('giving up closing channel after %d attempts '
+                      '(sender %s, block number %s)',
+                      attempts, intent.sender, intent.open_block_number)
+            return
+        self.attempts[intent] = attempts
+        self.retries[intent] = (intent, time.time() + self.retry_interval)
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict: transaction statistics
+        """
+        return {
+            'queued': len(self.queue),
+            'unmined': len(self.sent),
+            'retrying': len(self.retries),
+            'sent': self.n_sent,
+            'mined': self.n_mined,
+            'failed': self.n_failed
+        }
@@ -0,0 +1,73 @@
+"""Recovery of balance proof signers, optionally offloaded to a native thread pool."""
+import logging
+
+import gevent.threadpool
+
+from microraiden.utils import verify_balance_proof
+
+log = logging.getLogger(__name__)
+
+
+class BalanceProofVerifier(object):
+    """Recovers the signer of a balance proof.
+
+    coincurve's ECDSA recovery is a C call that releases the GIL. If `pool_size` is set,
+    the recovery runs in a bounded `gevent.threadpool.ThreadPool`, so that a burst of
+    paid requests does not block other greenlets (i.e. the `Blockchain` poller) on the hub.
+    Otherwise the recovery runs inline in the calling greenlet.
+    """
+
+    def __init__(self, receiver: str, contract_address: str, pool_size: int = 0):
+        """
+        Args:
+            receiver (str): receiver address the balance proofs are signed for
+            contract_address (str): address of the channel manager contract
+            pool_size (int, optional): number of native threads used for signature recovery.
+                If 0 (default), signatures are recovered on the gevent hub.
+        """
+        assert pool_size >= 0
+        self.receiver = receiver
+        self.contract_address = contract_address
+        self.pool_size = pool_size
+        self.pool = None
+        if pool_size > 0:
+            self.pool = gevent.threadpool.ThreadPool(pool_size)
+        self.n_verified = 0
+        self.max_queue_depth = 0
+
+    def recover_sender(self, open_block_number: int, balance: int, signature: bytes) -> str:
+        """Recover the address that signed a balance proof.
+
+        Returns:
+            str: address of the signer
+        """
+        args = (self.receiver, open_block_number, balance, signature, self.contract_address)
+        if self.pool is None:
+            signer = verify_balance_proof(*args)
+        else:
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth + 1)
+            signer = self.pool.apply(verify_balance_proof, args)
+        self.n_verified += 1
+        return signer
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        Returns:
+            int: number of signature recoveries that are queued or running in the pool
+        """
+        if self.pool is None:
+            return 0
+        return len(self.pool)
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict: pool configuration and queue statistics
+        """
+        return {
+            'pool_size': self.pool_size,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'verified': self.n_verified
+        }
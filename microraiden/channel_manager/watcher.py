@@ -0,0 +1,228 @@
+"""Blockchain watcher shared by the channel managers of several receivers."""
+from collections import OrderedDict
+
+
+from microraiden.constants import PROXY_BALANCE_LIMIT
+from microraiden.utils import RPCBatch, is_same_address, to_checksum_address
+from .blockchain import Blockchain
+from .health import HealthSnapshot, read_healths
+
+
+class SyncState(object):
+    """Sync progress of a shared watcher, with the interface of `ChannelManagerState`.
+
+    It isn't persisted: every channel manager stores its own progress, and a restarted
+    watcher resumes from the channel manager that is the furthest behind.
+    """
+
+    def __init__(self):
+        self.confirmed_head_number = None
+        self.confirmed_head_hash = None
+        self.unconfirmed_head_number = None
+        self.unconfirmed_head_hash = None
+
+    def update_sync_state(
+        self,
+        confirmed_head_number=None,
+        confirmed_head_hash=None,
+        unconfirmed_head_number=None,
+        unconfirmed_head_hash=None
+    ):
+        """Update block numbers and hashes of confirmed and unconfirmed head."""
+        if confirmed_head_number is not None:
+            self.confirmed_head_number = confirmed_head_number
+        if confirmed_head_hash is not None:
+            self.confirmed_head_hash = confirmed_head_hash
+        if unconfirmed_head_number is not None:
+            self.unconfirmed_head_number = unconfirmed_head_number
+        if unconfirmed_head_hash is not None:
+            self.unconfirmed_head_hash = unconfirmed_head_hash
+
+
+class ChannelManagerGroup(object):
+    """Channel managers of the receivers of a `SharedBlockchain`. The sync progress of the
+    watcher is relayed to all of them."""
+
+    def __init__(self):
+        # receiver => channel manager
+        self.channel_managers = OrderedDict()
+        self.state = SyncState()
+
+    def add(self, channel_manager):
+        receiver = to_checksum_address(channel_manager.state.receiver)
+        assert receiver not in self.channel_managers
+        # unconfirmed events are fetched again from the confirmed head
+        channel_manager.reset_unconfirmed()
+        self.channel_managers[receiver] = channel_manager
+
+        # resume from the channel manager that is the furthest behind
+        heads = [
+            (cm.state.confirmed_head_number, cm.state.confirmed_head_hash)
+            for cm in self.channel_managers.values()
+        ]
+        if any(number is None for number, _ in heads):
+            head_number, head_hash = None, None
+        else:
+            head_number, head_hash = min(heads, key=lambda head: head[0])
+        self.state.confirmed_head_number = head_number
+        self.state.confirmed_head_hash = head_hash
+        self.state.unconfirmed_head_number = head_number
+        self.state.unconfirmed_head_hash = head_hash
+
+    def set_head(self,
+                 unconfirmed_head_number,
+                 unconfirmed_head_hash,
+                 confirmed_head_number,
+                 confirmed_head_hash):
+        self.state.update_sync_state(
+            unconfirmed_head_number=unconfirmed_head_number,
+            unconfirmed_head_hash=unconfirmed_head_hash,
+            confirmed_head_number=confirmed_head_number,
+            confirmed_head_hash=confirmed_head_hash
+        )
+        for cm in self.channel_managers.values():
+            # channel managers that are ahead keep their confirmed progress until the
+            # watcher catches up, the unconfirmed events are relayed to them already
+            if (cm.state.confirmed_head_number is not None and
+                    cm.state.confirmed_head_number > confirmed_head_number):
+                if unconfirmed_head_number > cm.state.confirmed_head_number:
+                    cm.set_head(
+                        unconfirmed_head_number,
+                        unconfirmed_head_hash,
+                        cm.state.confirmed_head_number,
+                        cm.state.confirmed_head_hash
+                    )
+                continue
+            cm.set_head(
+                unconfirmed_head_number,
+                unconfirmed_head_hash,
+                confirmed_head_number,
+                confirmed_head_hash
+            )
+
+    def rollback_unconfirmed(self, block_number, block_hash):
+        self.state.update_sync_state(
+            unconfirmed_head_number=block_number,
+            unconfirmed_head_hash=block_hash
+        )
+        for cm in self.channel_managers.values():
+            cm.rollback_unconfirmed(block_number, block_hash)
+
+    def reset_unconfirmed(self):
+        for cm in self.channel_managers.values():
+            cm.reset_unconfirmed()
+        self.state.unconfirmed_head_number = self.state.confirmed_head_number
+        self.state.unconfirmed_head_hash = self.state.confirmed_head_hash
+
+
+class SharedBlockchain(Blockchain):
+    """Watches the channels of several receivers with a single scan of the contract.
+
+    The events of all registered receivers are fetched with one log query per block
+    range and relayed to the channel manager of their receiver, so the load on the node
+    depends on the activity of the contract, not on the number of receivers.
+
+    Example::
+
+        watcher = SharedBlockchain(web3, contract, n_confirmations=5)
+        books = ChannelManager(web3, contract, token, books_key, 'books.db',
+                               n_confirmations=5, blockchain=watcher)
+        music = ChannelManager(web3, contract, token, music_key, 'music.db',
+                               n_confirmations=5, blockchain=watcher)
+        books.start()
+        music.start()
+    """
+
+    def __init__(self, web3, channel_manager_contract, n_confirmations, **kwargs):
+        """
+        Args:
+            kwargs: additional arguments of `Blockchain`
+        """
+        super().__init__(
+            web3,
+            channel_manager_contract,
+            ChannelManagerGroup(),
+            n_confirmations,
+            **kwargs
+        )
+        # receiver => health snapshot
+        self.healths = {}
+
+    @property
+    def channel_managers(self):
+        """receiver => channel manager"""
+        return self.cm.channel_managers
+
+    def add_channel_manager(self, channel_manager):
+        """Watch the channels of the receiver of a channel manager.
+
+        Channel managers are registered before the watcher is started.
+        """
+        assert not self.started
+        assert channel_manager.n_confirmations == self.n_confirmations
+        assert is_same_address(
+            channel_manager.channel_manager_contract.address,
+            self.channel_manager_contract.address
+        )
+        self.cm.add(channel_manager)
+
+    def detach(self, channel_manager) -> bool:
+        """Stop watching the channels of the receiver of a stopped channel manager.
+
+        Returns:
+            bool: True if it was the last channel manager, i.e. the watcher can be stopped
+        """
+        self.channel_managers.pop(to_checksum_address(channel_manager.state.receiver), None)
+        return not self.channel_managers
+
+    def _run(self):
+        assert self.channel_managers, 'no channel manager has been added'
+        super()._run()
+
+    def _receivers(self):
+        return list(self.channel_managers)
+
+    def _channel_manager(self, log):
+        cm = self.channel_managers.get(to_checksum_address(log['args']['_receiver_address']))
+        if cm is None:
+            # detached
+            return None
+        # a channel manager that was ahead when the watcher started has handled the
+        # events up to its confirmed head already
+        confirmed_head_number = cm.state.confirmed_head_number
+        if confirmed_head_number is not None and log['blockNumber'] <= confirmed_head_number:
+            return None
+        return cm
+
+    def refresh_health(self):
+        """Read the balances of all receivers and the liveness of the node."""
+        if not self.channel_managers:
+            return
+        token_contract = next(iter(self.channel_managers.values())).token_contract
+        self.healths = read_healths(self.web3, token_contract, self._receivers())
+        if not self.healths:
+            return
+        # the node status without the balances of a receiver
+        self.health = next(iter(self.healths.values()))._replace(
+            eth_balance=None,
+            token_balance=None
+        )
+
+    def get_health(self, receiver):
+        """Health snapshot of a watched receiver. The balances of a receiver that hasn't
+        been read yet are None, i.e. unknown."""
+        health = self.healths.get(to_checksum_address(receiver), HealthSnapshot())
+        return health._replace(online=self.health.online)
+
+    def insufficient_balance_recover(self):
+        """Close the pending channels of the receivers whose balance is sufficient again."""
+        batch = RPCBatch(self.web3)
+        for receiver in self.channel_managers:
+            batch.get_balance(receiver)
+        recovered = True
+        for cm, balance in zip(self.channel_managers.values(), batch.send()):
+            if balance < PROXY_BALANCE_LIMIT:
+                recovered = False
+                continue
+            cm.close_pending_channels()
+        self.insufficient_balance = not recovered
@@ -15,6 +15,7 @@ Example::
         main()
 """
 import click
+import json
 import os
 import sys
 from eth_utils import to_checksum_address
@@ -39,12 +40,28 @@ from web3 import Web3, HTTPProvider
 from microraiden.make_helpers import make_paywalled_proxy
 from microraiden import utils, constants
 from microraiden.config import NETWORK_CFG
-from microraiden.exceptions import StateFileLocked, InsecureStateFile, NetworkIdMismatch
+from microraiden.exceptions import (
+    StateFileLocked,
+    InsecureStateFile,
+    NetworkIdMismatch,
+    InvalidSnapshot
+)
 from microraiden.proxy.paywalled_proxy import PaywalledProxy
 
 pass_app = click.make_pass_decorator(PaywalledProxy)
 
 
+def make_rpc_provider(rpc_provider: str, rpc_primary: str = None):
+    endpoint_uris = [uri.strip() for uri in rpc_provider.split(',')]
+    if len(endpoint_uris) == 1:
+        return HTTPProvider(rpc_provider, request_kwargs={'timeout': 60})
+    return utils.MultiHTTPProvider(
+        endpoint_uris,
+        request_kwargs={'timeout': 60},
+        primary=rpc_primary
+    )
+
+
 @click.group()
 @click.option(
     '--channel-manager-address',
@@ -82,7 +99,14 @@ pass_app = click.make_pass_decorator(PaywalledProxy)
 @click.option(
     '--rpc-provider',
     default=constants.WEB3_PROVIDER_DEFAULT,
-    help='Address of the Ethereum RPC provider'
+    help='Address of the Ethereum RPC provider. Several comma separated addresses: '
+         'requests go to the fastest node and fail over to the others.'
+)
+@click.option(
+    '--rpc-primary',
+    default=None,
+    help='With several RPC providers, send transactions only to this one instead of '
+         'to all of them.'
 )
 @click.option(
     '--ssl-key',
@@ -96,6 +120,69 @@ pass_app = click.make_pass_decorator(PaywalledProxy)
          'The directory should contain an index.html file with the payment info/webapp. '
          'Content of the directory (js files, images..) is available on the "js/" endpoint.'
 )
+@click.option(
+    '--verify-pool-size',
+    default=0,
+    type=int,
+    help='Number of native threads used to verify balance proof signatures. '
+         'If 0, signatures are verified in the main event loop.'
+)
+@click.option(
+    '--deferred-credit-limit',
+    default=0,
+    type=int,
+    help='Accept payments before their signature is verified, up to this amount of '
+         'unverified tokens per sender. If 0, every payment is verified before serving.'
+)
+@click.option(
+    '--pending-credit-limit',
+    default=0,
+    type=int,
+    help='Watch pending transactions and serve new channels as soon as they are mined, '
+         'up to this amount per sender before the channel is confirmed. If 0, channels '
+         'are served once they have enough confirmations.'
+)
+@click.option(
+    '--sync-concurrency',
+    default=4,
+    type=int,
+    help='Number of block ranges fetched concurrently while syncing the channel history.'
+)
+@click.option(
+    '--new-heads-endpoint',
+    default=None,
+    help='Websocket URL or IPC path of the Ethereum node. If set, new blocks are '
+         'processed as soon as the node announces them instead of being polled.'
+)
+@click.option(
+    '--event-cache',
+    default=None,
+    help='Path to a local event cache file. The channel history is read from the cache, '
+         'which can be shared with clients and tools.'
+)
+@click.option(
+    '--health-interval',
+    default=0,
+    type=float,
+    help='Seconds between refreshes of the ETH and token balance and the node status '
+         'served to requests. If 0, they are refreshed on every block.'
+)
+@click.option(
+    '--fast-start-max-lag',
+    default=None,
+    type=int,
+    help='Start serving the channels of the state file right away, while the blocks '
+         'missed since the last run are synced, as long as the state is at most this many '
+         'blocks behind. The sync status is served at /api/1/sync.'
+)
+@click.option(
+    '--state-snapshot',
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help='Snapshot exported from the state of another proxy of the receiver, with '
+         'python -m microraiden.state_snapshot. If the state file does not exist, it is '
+         'created from the snapshot and only the blocks since then are synced.'
+)
 @click.pass_context
 def main(
     ctx,
@@ -108,17 +195,30 @@ def main(
     private_key_password_file,
     paywall_info,
     rpc_provider,
+    rpc_primary,
+    verify_pool_size,
+    deferred_credit_limit,
+    pending_credit_limit,
+    sync_concurrency,
+    new_heads_endpoint,
+    event_cache,
+    health_interval,
+    fast_start_max_lag,
+    state_snapshot,
 ):
     private_key = utils.get_private_key(private_key, private_key_password_file)
     if private_key is None:
         sys.exit(1)
 
     receiver_address = privkey_to_addr(private_key)
+    if state_snapshot is not None:
+        with open(state_snapshot) as f:
+            state_snapshot = json.load(f)
 
     constants.paywall_html_dir = paywall_info
     while True:
         try:
-            web3 = Web3(HTTPProvider(rpc_provider, request_kwargs={'timeout': 60}))
+            web3 = Web3(make_rpc_provider(rpc_provider, rpc_primary))
             NETWORK_CFG.set_defaults(int(web3.version.network))
             channel_manager_address = to_checksum_address(
                 channel_manager_address or NETWORK_CFG.CHANNEL_MANAGER_ADDRESS
@@ -136,7 +236,16 @@ def main(
                 state_file = os.path.join(app_dir, state_file_name)
             app = make_paywalled_proxy(private_key, state_file,
                                        contract_address=channel_manager_address,
-                                       web3=web3)
+                                       web3=web3,
+                                       verify_pool_size=verify_pool_size,
+                                       deferred_credit_limit=deferred_credit_limit,
+                                       pending_credit_limit=pending_credit_limit,
+                                       sync_concurrency=sync_concurrency,
+                                       new_heads_endpoint=new_heads_endpoint,
+                                       event_cache=event_cache,
+                                       health_interval=health_interval,
+                                       fast_start_max_lag=fast_start_max_lag,
+                                       state_snapshot=state_snapshot)
         except StateFileLocked as ex:
             log.warning('Another uRaiden process is already running (%s)!' % str(ex))
         except InsecureStateFile as ex:
@@ -148,6 +257,9 @@ def main(
         except NetworkIdMismatch as ex:
             log.fatal(str(ex))
             raise
+        except InvalidSnapshot as ex:
+            log.fatal('The state snapshot can not be used: %s' % str(ex))
+            raise
         except requests.exceptions.ConnectionError as ex:
             log.warning("Ethereum node refused connection: %s" % str(ex))
         else:
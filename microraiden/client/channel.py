@@ -1,15 +1,17 @@
 import logging
 from enum import Enum
 
-from eth_utils import decode_hex, is_same_address
+from eth_utils import decode_hex
 from typing import Callable
 
 from microraiden.client.context import Context
+from microraiden.client.presigner import BalanceProofPresigner
 from microraiden.utils import (
     get_event_blocking,
     create_signed_contract_transaction,
     sign_balance_proof,
     verify_closing_sig,
+    is_same_address,
     keccak256
 )
 
@@ -35,6 +37,7 @@ class Channel:
     ):
         self._balance = 0
         self._balance_sig = None
+        self.presigner = None
 
         self.core = core
         self.sender = sender
@@ -57,22 +60,47 @@ class Channel:
         return keccak256(self.sender, self.receiver, self.block)
 
     def update_balance(self, value):
+        balance_sig = None
+        if self.presigner is not None:
+            balance_sig = self.presigner.pop(value)
         self._balance = value
-        self._balance_sig = self.sign()
+        self._balance_sig = balance_sig or self.sign()
 
     @property
     def balance_sig(self):
         return self._balance_sig
 
-    def sign(self):
+    def sign(self, balance: int = None):
+        if balance is None:
+            balance = self.balance
         return sign_balance_proof(
             self.core.private_key,
             self.receiver,
             self.block,
-            self.balance,
+            balance,
             self.core.channel_manager.address
         )
 
+    def enable_presigning(self, price: int, depth: int = 10):
+        """
+        Starts signing balance proofs for the next `depth` transfers of value `price` in the
+        background, so that `create_transfer` can use them without delay.
+        """
+        if self.presigner is not None:
+            if self.presigner.price == price and self.presigner.depth == depth:
+                return
+            self.disable_presigning()
+        log.debug('Presigning {} balance proofs of value {} on channel to {}.'.format(
+            depth, price, self.receiver
+        ))
+        self.presigner = BalanceProofPresigner(self, price, depth)
+        self.presigner.start()
+
+    def disable_presigning(self):
+        if self.presigner is not None:
+            self.presigner.stop()
+            self.presigner = None
+
     def topup(self, deposit):
         """
         Attempts to increase the deposit in an existing channel. Block until confirmation.
@@ -174,6 +202,7 @@ class Channel:
                 event['blockNumber']
             ))
             self.state = Channel.State.settling
+            self.disable_presigning()
             return event
         else:
             log.error('No event received.')
@@ -232,6 +261,7 @@ class Channel:
         if event:
             log.debug('Successfully closed channel in block {}.'.format(event['blockNumber']))
             self.state = Channel.State.closed
+            self.disable_presigning()
             return event
         else:
             log.error('No event received.')
@@ -288,6 +318,7 @@ class Channel:
         if event:
             log.debug('Successfully settled channel in block {}.'.format(event['blockNumber']))
             self.state = Channel.State.closed
+            self.disable_presigning()
             self.on_settle(self)
             return event
         else:
@@ -2,15 +2,18 @@ import logging
 from typing import List, Optional
 
 import os
-from eth_utils import decode_hex, is_same_address, is_hex, remove_0x_prefix, to_checksum_address
+from eth_utils import decode_hex, is_hex, remove_0x_prefix
 from web3 import Web3
 from web3.providers.rpc import HTTPProvider
 
 from microraiden.utils import (
     get_private_key,
-    get_logs,
+    get_events,
     get_event_blocking,
-    create_signed_contract_transaction
+    EventCache,
+    create_signed_contract_transaction,
+    is_same_address,
+    to_checksum_address
 )
 
 from microraiden.config import NETWORK_CFG
@@ -27,7 +30,8 @@ class Client:
             private_key: str = None,
             key_password_path: str = None,
             channel_manager_address: str = None,
-            web3: Web3 = None
+            web3: Web3 = None,
+            event_cache: str = None
     ) -> None:
         """
 
@@ -36,6 +40,8 @@ class Client:
             key_password_path:
             channel_manager_address:
             web3:
+            event_cache: path to a local event cache file. If set, channels are synced
+                from the cache and only new blocks are queried.
         """
         is_hex_key = is_hex(private_key) and len(remove_0x_prefix(private_key)) == 64
         is_path = os.path.exists(private_key)
@@ -59,6 +65,14 @@ class Client:
 
         self.context = Context(private_key, web3, channel_manager_address)
 
+        self.event_cache = None
+        if event_cache is not None:
+            self.event_cache = EventCache(
+                event_cache,
+                self.context.channel_manager,
+                start_block=NETWORK_CFG.start_sync_block
+            )
+
         self.sync_channels()
 
     def sync_channels(self):
@@ -68,26 +82,28 @@ class Client:
         Naturally, balance signatures cannot be recovered from the blockchain.
         """
         filters = {'_sender_address': self.context.address}
-        create = get_logs(
-            self.context.channel_manager,
-            'ChannelCreated',
-            argument_filters=filters
-        )
-        topup = get_logs(
-            self.context.channel_manager,
-            'ChannelToppedUp',
-            argument_filters=filters
-        )
-        close = get_logs(
-            self.context.channel_manager,
-            'ChannelCloseRequested',
-            argument_filters=filters
-        )
-        settle = get_logs(
+        event_names = [
+            'ChannelCreated', 'ChannelToppedUp', 'ChannelCloseRequested', 'ChannelSettled'
+        ]
+        from_block = 0
+        events = []
+        if self.event_cache is not None:
+            # only blocks after the cached ones are queried
+            from_block = self.event_cache.update() + 1
+            events = self.event_cache.get_logs(
+                sender=self.context.address,
+                event_names=event_names
+            )
+        events += get_events(
             self.context.channel_manager,
-            'ChannelSettled',
+            event_names,
+            from_block=from_block,
             argument_filters=filters
         )
+        create = [e for e in events if e['event'] == 'ChannelCreated']
+        topup = [e for e in events if e['event'] == 'ChannelToppedUp']
+        close = [e for e in events if e['event'] == 'ChannelCloseRequested']
+        settle = [e for e in events if e['event'] == 'ChannelSettled']
 
         channel_key_to_channel = {}
 
@@ -0,0 +1,100 @@
+import logging
+import threading
+from typing import Dict, Optional
+
+log = logging.getLogger(__name__)
+
+
+class BalanceProofPresigner:
+    """
+    Signs upcoming balance proofs of a channel in a background thread.
+
+    For a resource with a fixed price, the next balances of a channel are predictable:
+    `balance + k * price`. The presigner keeps up to `depth` of these signatures ready, so that
+    `Channel.create_transfer` doesn't have to do the signing in the request path. The queue is
+    invalidated if the channel's balance is updated to an unexpected value.
+    """
+    WAKEUP_INTERVAL = 1
+
+    def __init__(self, channel, price: int, depth: int = 10):
+        assert price > 0
+        assert depth > 0
+        self.channel = channel
+        self.price = price
+        self.depth = depth
+        self._signatures = {}  # type: Dict[int, bytes]
+        self._next_balance = channel.balance + price
+        self._generation = 0
+        self._running = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name='presigner', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._signatures.clear()
+            self._cond.notify()
+
+    def pop(self, balance: int) -> Optional[bytes]:
+        """
+        Returns:
+            bytes: a presigned balance proof for `balance`, or None if there is none available.
+        """
+        with self._cond:
+            signature = self._signatures.pop(balance, None)
+            if signature is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self._skip_to(balance)
+            self._cond.notify()
+            return signature
+
+    def _skip_to(self, balance: int):
+        """Continue presigning after `balance` that is going to be signed by the caller."""
+        expected = (
+            balance >= self.channel.balance and
+            (balance - self.channel.balance) % self.price == 0
+        )
+        if expected:
+            for stale in [b for b in self._signatures if b <= balance]:
+                del self._signatures[stale]
+            self._next_balance = max(self._next_balance, balance + self.price)
+        else:
+            log.debug('Unexpected balance {}, invalidating presigned balance proofs.'.format(
+                balance
+            ))
+            self._signatures.clear()
+            self._next_balance = balance + self.price
+            self._generation += 1
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and (
+                    len(self._signatures) >= self.depth or
+                    self._next_balance > self.channel.deposit
+                ):
+                    self._cond.wait(self.WAKEUP_INTERVAL)
+                if not self._running:
+                    return
+                generation = self._generation
+                balance = self._next_balance
+                self._next_balance += self.price
+
+            signature = self.channel.sign(balance)
+
+            with self._cond:
+                fresh = generation == self._generation and balance > self.channel.balance
+                if self._running and fresh:
+                    self._signatures[balance] = signature
@@ -3,13 +3,13 @@ import time
 from typing import Callable, Tuple, Union
 
 import requests
-from eth_utils import is_same_address, decode_hex, encode_hex
+from eth_utils import decode_hex, encode_hex
 from munch import Munch
 from requests import Response
 
 from microraiden.header import HTTPHeaders
 from microraiden.client import Client, Channel
-from microraiden.utils import verify_balance_proof
+from microraiden.utils import verify_balance_proof, is_same_address
 
 log = logging.getLogger(__name__)
 
@@ -23,6 +23,7 @@ class Session(requests.Session):
             initial_deposit: Callable[[int], int] = lambda price: 10 * price,
             topup_deposit: Callable[[int], int] = lambda price: 5 * price,
             close_channel_on_exit: bool = False,
+            presign_depth: int = 0,
             **client_kwargs
     ) -> None:
         requests.Session.__init__(self)
@@ -33,11 +34,14 @@ class Session(requests.Session):
         self.initial_deposit = initial_deposit
         self.topup_deposit = topup_deposit
         self.close_channel_on_exit = close_channel_on_exit
+        self.presign_depth = presign_depth
 
         if self.client is None:
             self.client = Client(**client_kwargs)
 
     def close(self):
+        if self.channel is not None:
+            self.channel.disable_presigning()
         if self.close_channel_on_exit and self.channel.state == Channel.State.open:
             self.close_channel()
         requests.Session.close(self)
@@ -287,6 +291,9 @@ class Session(requests.Session):
             log.error("No channel could be created or sufficiently topped up.")
             return False
 
+        if self.presign_depth > 0:
+            self.channel.enable_presigning(price, self.presign_depth)
+
         self.channel.create_transfer(price)
         log.debug(
             'Sending new balance proof. New channel balance: {}/{}'
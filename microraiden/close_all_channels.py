@@ -27,10 +27,8 @@ from eth_utils import (
     is_same_address,
     denoms,
 )
-from ethereum.tester import TransactionFailed
 from web3 import Web3, HTTPProvider
 from web3.contract import Contract
-from web3.exceptions import BadFunctionCallOutput
 
 from microraiden import (
     config,
@@ -78,6 +76,12 @@ log = logging.getLogger('close_all_channels')
     type=int,
     help='Gas price, in Gwei'
 )
+@click.option(
+    '--event-cache',
+    default=None,
+    help='Path to a local event cache file. Channels settled according to the cache '
+         'are skipped.'
+)
 def main(
         rpc_provider: HTTPProvider,
         private_key: str,
@@ -85,6 +89,7 @@ def main(
         state_file: str,
         channel_manager_address: str,
         gas_price: int,
+        event_cache: str,
 ):
     private_key = utils.get_private_key(private_key, private_key_password_file)
     if private_key is None:
@@ -132,6 +137,11 @@ def main(
         state,
         channel_manager_contract,
         gas_price * denoms.gwei if gas_price else None,
+        event_cache=utils.EventCache(
+            event_cache,
+            channel_manager_contract,
+            start_block=config.NETWORK_CFG.start_sync_block
+        ) if event_cache else None
     )
 
 
@@ -140,7 +150,8 @@ def close_open_channels(
         state: ChannelManagerState,
         channel_manager_contract: Contract,
         gas_price: int = None,
-        wait=lambda: gevent.sleep(1)
+        wait=lambda: gevent.sleep(1),
+        event_cache: utils.EventCache = None
 ):
     """Closes all open channels that belong to a receiver.
 
@@ -151,18 +162,36 @@ def close_open_channels(
         gas_price (int, optional): gas price you want to use
             (a network default will be used if not set)
         wait (callable): pause between checks for a succesfull transaction
+        event_cache (EventCache, optional): channels settled according to the cache
+            are skipped
     """
     web3 = channel_manager_contract.web3
     pending_txs = {}
 
-    for channel in state.channels.values():
-        if not channel.last_signature:
-            continue
-
+    channels = [channel for channel in state.channels.values() if channel.last_signature]
+    if event_cache is not None:
+        event_cache.update()
+        settled = {
+            (log['args']['_sender_address'], log['args']['_open_block_number'])
+            for log in event_cache.get_logs(
+                receiver=state.receiver,
+                event_names=['ChannelSettled']
+            )
+        }
+        channels = [
+            channel for channel in channels
+            if (channel.sender, channel.open_block_number) not in settled
+        ]
+    # read the on-chain info of all channels at the same block
+    channel_infos = utils.get_channel_infos(
+        channel_manager_contract,
+        [(channel.sender, channel.receiver, channel.open_block_number) for channel in channels],
+        block_identifier=web3.eth.blockNumber
+    )
+    for channel in channels:
         channel_id = (channel.sender, channel.receiver, channel.open_block_number)
-        try:
-            channel_info = channel_manager_contract.call().getChannelInfo(*channel_id)
-        except (BadFunctionCallOutput, TransactionFailed):
+        channel_info = channel_infos[channel_id]
+        if channel_info is None:
             continue
         _, deposit, settle_block_number, closing_balance, transferred_tokens = channel_info
         available_tokens = channel.balance - transferred_tokens
@@ -208,17 +237,14 @@ def close_open_channels(
     total_tokens = 0
     total_gas = 0
     gas_price = 0
-    for channel_id, close_info in pending_txs.items():
+    # wait for txs to be mined
+    mined_txs = utils.wait_for_transactions(
+        web3,
+        [tx_hash for tx_hash, _ in pending_txs.values()],
+        wait
+    )
+    for (channel_id, close_info), (tx, receipt) in zip(pending_txs.items(), mined_txs):
         tx_hash, available_tokens = close_info
-        receipt = None
-        # wait for tx to be mined
-        while True:
-            receipt = web3.eth.getTransactionReceipt(tx_hash)
-            if not receipt or not receipt.blockNumber:
-                wait()
-            else:
-                break
-        tx = web3.eth.getTransaction(tx_hash)
         total_gas += receipt.gasUsed
         gas_price = tx.gasPrice
         if receipt.gasUsed == tx.gas or getattr(receipt, 'status', None) == 0:
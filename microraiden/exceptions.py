@@ -13,6 +13,11 @@ class InvalidBalanceProof(MicroRaidenException):
     pass
 
 
+class SenderBlacklisted(InvalidBalanceProof):
+    """Sender has sent an invalid balance proof before and is not served anymore."""
+    pass
+
+
 class NoOpenChannel(MicroRaidenException):
     """Attempt to use nonexisting channel."""
     pass
@@ -23,6 +28,11 @@ class InsufficientConfirmations(MicroRaidenException):
     pass
 
 
+class SyncInProgress(InsufficientConfirmations):
+    """The channel history is being synced, the channel may not be known yet."""
+    pass
+
+
 class NoBalanceProofReceived(MicroRaidenException):
     """Attempt to close channel with no registered payments."""
     pass
@@ -61,3 +71,19 @@ class InsecureStateFile(StateFileException):
 class NetworkIdMismatch(StateFileException):
     """RPC endpoint and database have different network id."""
     pass
+
+
+class EventCacheMismatch(StateFileException):
+    """The event cache file belongs to a different contract."""
+    pass
+
+
+class InvalidSnapshot(StateFileException):
+    """The state snapshot is malformed, isn't signed by its receiver or doesn't match
+    the channel manager."""
+    pass
+
+
+class SnapshotNotCanonical(InvalidSnapshot):
+    """The checkpoint block of the state snapshot isn't part of the chain anymore."""
+    pass
@@ -42,7 +42,8 @@ def make_channel_manager(
         private_key: str,
         channel_manager_address: str,
         state_filename: str,
-        web3: Web3
+        web3: Web3,
+        **kwargs
 ) -> ChannelManager:
     """
     Args:
@@ -50,6 +51,7 @@ def make_channel_manager(
         channel_manager_address (str): channel manager contract to use
         state_filename (str): path to the channel manager state database
         web3 (Web3): web3 provider
+        kwargs: additional arguments passed to the ChannelManager
     Returns:
         ChannelManager: intialized and synced channel manager
 
@@ -65,7 +67,8 @@ def make_channel_manager(
             channel_manager_contract,
             token_contract,
             private_key,
-            state_filename=state_filename
+            state_filename=state_filename,
+            **kwargs
         )
     except StateReceiverAddrMismatch as e:
         log.error(
@@ -89,7 +92,8 @@ def make_paywalled_proxy(
         state_filename: str,
         contract_address=None,
         flask_app=None,
-        web3=None
+        web3=None,
+        **kwargs
 ) -> PaywalledProxy:
     """
     Args:
@@ -99,6 +103,7 @@ def make_paywalled_proxy(
         contract_address (str, optional): address of the channel manager contract.
         flask_app (optional): make proxy use this flask app
         web3 (Web3, optional): do not create a new web3 provider, but use this param instead
+        kwargs: additional arguments passed to the ChannelManager
     Returns:
         PaywalledProxy: an initialized proxy.
         Do not forget to call `run()` to start serving requests.
@@ -106,5 +111,11 @@ def make_paywalled_proxy(
     if web3 is None:
         web3 = Web3(HTTPProvider(constants.WEB3_PROVIDER_DEFAULT, request_kwargs={'timeout': 60}))
         contract_address = contract_address or NETWORK_CFG.CHANNEL_MANAGER_ADDRESS
-    channel_manager = make_channel_manager(private_key, contract_address, state_filename, web3)
+    channel_manager = make_channel_manager(
+        private_key,
+        contract_address,
+        state_filename,
+        web3,
+        **kwargs
+    )
     return PaywalledProxy(channel_manager, flask_app, constants.HTML_DIR, constants.JSLIB_DIR)
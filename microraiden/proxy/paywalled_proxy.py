@@ -20,6 +20,7 @@ from microraiden.proxy.resources import (
     ChannelManagementLogout,
     ChannelManagementRoot,
     ChannelManagementStats,
+    ChannelManagementSync,
 )
 
 from microraiden.proxy.resources.expensive import LightClientProxy
@@ -68,28 +69,76 @@ class PaywalledProxy:
 
         self.light_client_proxy = LightClientProxy(safe_join(paywall_html_dir, "index.html"))
         self.paywall = Paywall(channel_manager, self.light_client_proxy)
+        # route prefix => (channel manager, paywall) of additional receivers
+        self.receivers = {}
 
         # REST interface
         self.api.add_resource(ChannelManagementLogin, API_PATH + "/login")
         self.api.add_resource(ChannelManagementLogout, API_PATH + "/logout")
+        self.add_management_api(self.channel_manager)
+        self.api.add_resource(ChannelManagementRoot, "/cm")
+
+    def add_management_api(self, channel_manager: ChannelManager, prefix: str = ''):
+        kwargs = {'channel_manager': channel_manager}
         self.api.add_resource(ChannelManagementChannelInfo,
-                              API_PATH + "/channels/<string:sender_address>/<int:opening_block>",
-                              resource_class_kwargs={'channel_manager': self.channel_manager})
+                              prefix + API_PATH +
+                              "/channels/<string:sender_address>/<int:opening_block>",
+                              endpoint=prefix + 'channelmanagementchannelinfo',
+                              resource_class_kwargs=kwargs)
         self.api.add_resource(ChannelManagementAdmin,
-                              API_PATH + "/admin",
-                              resource_class_kwargs={'channel_manager': self.channel_manager})
+                              prefix + API_PATH + "/admin",
+                              endpoint=prefix + 'channelmanagementadmin',
+                              resource_class_kwargs=kwargs)
         self.api.add_resource(ChannelManagementAdminChannels,
-                              API_PATH +
+                              prefix + API_PATH +
                               "/admin/channels/<string:sender_address>/<int:opening_block>",
-                              resource_class_kwargs={'channel_manager': self.channel_manager})
+                              endpoint=prefix + 'channelmanagementadminchannels',
+                              resource_class_kwargs=kwargs)
         self.api.add_resource(ChannelManagementListChannels,
-                              API_PATH + "/channels/",
-                              API_PATH + "/channels/<string:sender_address>",
-                              resource_class_kwargs={'channel_manager': self.channel_manager})
+                              prefix + API_PATH + "/channels/",
+                              prefix + API_PATH + "/channels/<string:sender_address>",
+                              endpoint=prefix + 'channelmanagementlistchannels',
+                              resource_class_kwargs=kwargs)
         self.api.add_resource(ChannelManagementStats,
-                              API_PATH + "/stats",
-                              resource_class_kwargs={'channel_manager': self.channel_manager})
-        self.api.add_resource(ChannelManagementRoot, "/cm")
+                              prefix + API_PATH + "/stats",
+                              endpoint=prefix + 'channelmanagementstats',
+                              resource_class_kwargs=kwargs)
+        self.api.add_resource(ChannelManagementSync,
+                              prefix + API_PATH + "/sync",
+                              endpoint=prefix + 'channelmanagementsync',
+                              resource_class_kwargs=kwargs)
+
+    def add_receiver(self, channel_manager: ChannelManager, prefix: str):
+        """Serve the channels of another receiver behind a route prefix.
+
+        Paywalled resources whose url starts with `prefix` are paid to this receiver,
+        and its management API is served under `prefix`. The channel managers of the
+        receivers usually share a `SharedBlockchain`.
+        """
+        assert isinstance(channel_manager, ChannelManager)
+        assert prefix.startswith('/') and not prefix.endswith('/')
+        assert prefix not in self.receivers
+        channel_manager.start()
+        paywall = Paywall(channel_manager, self.light_client_proxy)
+        self.receivers[prefix] = (channel_manager, paywall)
+        self.add_management_api(channel_manager, prefix)
+
+    @property
+    def channel_managers(self):
+        return [self.channel_manager] + [cm for cm, _ in self.receivers.values()]
+
+    def get_receiver(self, url: str):
+        """Returns:
+            tuple: (channel manager, paywall) of the receiver the resource at `url` is
+                paid to, the one with the longest matching prefix
+        """
+        prefixes = [
+            prefix for prefix in self.receivers
+            if url == prefix or url.startswith(prefix + '/')
+        ]
+        if not prefixes:
+            return self.channel_manager, self.paywall
+        return self.receivers[max(prefixes, key=len)]
 
     def run(self,
             host: str='localhost',
@@ -101,7 +150,10 @@ class PaywalledProxy:
         assert ssl_context is None or len(ssl_context) == 2
         # register our custom error handler to ignore some exceptions and fail on others
 #        register_error_handler(self.gevent_error_handler)
-        self.channel_manager.wait_sync()
+        # with fast start, the state file is served while the missed blocks are synced
+        for channel_manager in self.channel_managers:
+            if channel_manager.fast_start_max_lag is None:
+                channel_manager.wait_sync()
         from gevent.pywsgi import WSGIServer
         if ((ssl_context is not None) and
            (len(ssl_context) == 2) and
@@ -131,7 +183,8 @@ class PaywalledProxy:
         try:
             self.server_greenlet.join()
         finally:
-            self.channel_manager.stop()
+            for channel_manager in self.channel_managers:
+                channel_manager.stop()
 
     @staticmethod
     def gevent_error_handler(context, exc_info):
@@ -142,11 +195,12 @@ class PaywalledProxy:
         gevent.get_hub().handle_system_error(exc_info[0], exc_info[1])
 
     def add_paywalled_resource(self, cls: Expensive, url: str, price: int=None, *args, **kwargs):
+        channel_manager, paywall = self.get_receiver(url)
         cfg = {
-            'channel_manager': self.channel_manager,
+            'channel_manager': channel_manager,
             'light_client_proxy': self.light_client_proxy,
             'price': price,
-            'paywall': self.paywall
+            'paywall': paywall
         }
         if 'resource_class_kwargs' in kwargs:
             cfg.update(kwargs.pop('resource_class_kwargs'))
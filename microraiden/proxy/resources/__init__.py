@@ -5,6 +5,7 @@ from .management import (
     ChannelManagementAdminChannels,
     ChannelManagementListChannels,
     ChannelManagementStats,
+    ChannelManagementSync,
     ChannelManagementChannelInfo,
 )
 from .login import (
@@ -21,6 +22,7 @@ __all__ = (
     ChannelManagementAdmin,
     ChannelManagementAdminChannels,
     ChannelManagementStats,
+    ChannelManagementSync,
     ChannelManagementLogin,
     ChannelManagementLogout,
     PaywalledProxyUrl
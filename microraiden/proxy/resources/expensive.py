@@ -1,10 +1,10 @@
 import logging
 from flask_restful import Resource
-from eth_utils import is_address
 
 from microraiden.channel_manager import (
     ChannelManager,
 )
+from microraiden.utils import is_address
 from .paywall_decorator import paywall_decorator
 
 log = logging.getLogger(__name__)
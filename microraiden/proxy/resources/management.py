@@ -1,11 +1,12 @@
 from flask_restful import Resource, reqparse
 from collections import defaultdict
 
-from microraiden.utils import sign_close
+from microraiden.utils import sign_close, is_address, to_checksum_address, MultiHTTPProvider
 from microraiden.proxy.resources.login import auth
-from eth_utils import encode_hex, is_address, to_checksum_address
+from eth_utils import encode_hex
 
 from microraiden.channel_manager import Channel, ChannelManager
+from microraiden.channel_manager.health import health_to_dict
 from microraiden.exceptions import NoOpenChannel, InvalidBalanceProof
 
 
@@ -32,21 +33,60 @@ class ChannelManagementStats(Resource):
             else:
                 open_channels.append(v)
         contract_address = self.channel_manager.channel_manager_contract.address
+        deferred = None
+        if self.channel_manager.deferred_verifier is not None:
+            deferred = self.channel_manager.deferred_verifier.metrics()
+        pending = None
+        if self.channel_manager.pending_watcher is not None:
+            pending = self.channel_manager.pending_watcher.metrics()
+        health = self.channel_manager.health
+        rpc = None
+        provider = self.channel_manager.blockchain.web3.providers[0]
+        if isinstance(provider, MultiHTTPProvider):
+            rpc = provider.metrics()
         return {'balance_sum': self.channel_manager.get_locked_balance(),
                 'deposit_sum': deposit_sum,
                 'open_channels': len(open_channels),
                 'pending_channels': len(pending_channels),
                 'unique_senders': len(unique_senders),
-                'liquid_balance': self.channel_manager.get_liquid_balance(),
+                'liquid_balance': health.token_balance,
+                'eth_balance': health.eth_balance,
                 'token_address': self.channel_manager.token_contract.address,
                 'contract_address': contract_address,
                 'receiver_address': self.channel_manager.receiver,
                 'manager_abi': self.channel_manager.channel_manager_contract.abi,
                 'token_abi': self.channel_manager.token_contract.abi,
-                'sync_block': self.channel_manager.blockchain.sync_start_block
+                'sync_block': self.channel_manager.blockchain.sync_start_block,
+                'verifier': self.channel_manager.verifier.metrics(),
+                'deferred': deferred,
+                'pending': pending,
+                'disputes': self.channel_manager.disputes.metrics(),
+                'transactions': self.channel_manager.transactions.metrics(),
+                'node': health_to_dict(health),
+                'sync_lag': self.channel_manager.sync_lag,
+                'rpc': rpc
                 }
 
 
+class ChannelManagementSync(Resource):
+    """Sync status of the channel history. Responds with 503 until it's synced, so that
+    traffic can be gated on it."""
+
+    def __init__(self, channel_manager: ChannelManager):
+        super(ChannelManagementSync, self).__init__()
+        self.channel_manager = channel_manager
+
+    def get(self):
+        synced = self.channel_manager.is_synced()
+        return {'synced': synced,
+                'lag': self.channel_manager.sync_lag,
+                'current_block': self.channel_manager.blockchain.current_block,
+                'confirmed_head': self.channel_manager.state.confirmed_head_number,
+                'unconfirmed_head': self.channel_manager.state.unconfirmed_head_number,
+                'fast_start_max_lag': self.channel_manager.fast_start_max_lag
+                }, 200 if synced else 503
+
+
 class ChannelManagementListChannels(Resource):
     def __init__(self, channel_manager: ChannelManager):
         super(ChannelManagementListChannels, self).__init__()
@@ -15,7 +15,7 @@ from microraiden.exceptions import (
 import microraiden.constants as constants
 from microraiden.proxy.resources.request_data import RequestData
 from functools import wraps
-from eth_utils import is_address
+from microraiden.utils import is_address
 
 log = logging.getLogger(__name__)
 
@@ -35,9 +35,13 @@ class Paywall(object):
         self.light_client_proxy = light_client_proxy
 
     def access(self, resource, method, *args, **kwargs):
-        if self.channel_manager.node_online() is False:
+        # read from the snapshot refreshed by the blockchain greenlet
+        health = self.channel_manager.health
+        if health.online is False:
             return "Ethereum node is not responding", 502
-        if self.channel_manager.get_eth_balance() < constants.PROXY_BALANCE_LIMIT:
+        # an unknown balance, e.g. of a receiver that hasn't been read yet, isn't low
+        if (health.eth_balance is not None and
+                health.eth_balance < constants.PROXY_BALANCE_LIMIT):
             return "Channel manager ETH balance is below limit", 502
         try:
             data = RequestData(request.headers, request.cookies)
@@ -94,9 +98,14 @@ class Paywall(object):
 
         # try to get an existing channel
         try:
-            channel = self.channel_manager.verify_balance_proof(
-                data.sender_address, data.open_block_number,
-                data.balance, data.balance_signature)
+            if self.channel_manager.deferred_verifier is not None:
+                # signature is verified later, after the payment has been registered
+                channel = self.channel_manager.get_channel(
+                    data.sender_address, data.open_block_number, apply_pending=False)
+            else:
+                channel = self.channel_manager.verify_balance_proof(
+                    data.sender_address, data.open_block_number,
+                    data.balance, data.balance_signature)
         except InsufficientConfirmations as e:
             log.debug('Refused payment: Insufficient confirmations (sender=%s, block=%d)' %
                       (data.sender_address, data.open_block_number))
@@ -128,6 +137,10 @@ class Paywall(object):
             })
         if channel.last_signature is not None:
             headers.update({header.BALANCE_SIGNATURE: channel.last_signature})
+        if self.channel_manager.deferred_verifier is not None:
+            # the headers only carry verified balance proofs, the amount is checked
+            # against the accepted ones
+            channel = self.channel_manager.deferred_verifier.apply_pending(channel)
 
         amount_sent = data.balance - channel.balance
 
@@ -146,6 +159,10 @@ class Paywall(object):
         except (InvalidBalanceAmount, InvalidBalanceProof):
             # balance sent to the proxy is less than in the previous proof
             return True, headers
+        except InsufficientConfirmations:
+            # credit limit of a channel that isn't confirmed yet reached
+            headers.update({header.INSUF_CONFS: "1"})
+            return True, headers
 
         # all ok, return premium content
         return False, headers
@@ -1,7 +1,6 @@
 from werkzeug.datastructures import EnvironHeaders
-from eth_utils import to_checksum_address
-from eth_utils import is_address
 from microraiden import HTTPHeaders as header
+from microraiden.utils import is_address, to_checksum_address
 
 
 class RequestData:
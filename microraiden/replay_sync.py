@@ -0,0 +1,541 @@
+"""
+Benchmark of the channel sync, replaying an event stream without a live chain.
+
+The logs of the channel manager contract are stored as JSON lines, in the format
+`eth_getLogs` returns them. They're either recorded from a node (`record`) or generated
+from a seed (`generate`). `run` serves them from a local fake node and drives
+`Blockchain._update` and a `ChannelManager` until the sync is complete, then reports
+the events processed per second, the time spent in RPC requests and in the channel
+manager (event handling and state writes), and the peak memory.
+
+Example::
+
+    $ python -m microraiden.replay_sync generate --channels 10000 --seed 1 events.jsonl
+    $ python -m microraiden.replay_sync run events.jsonl
+"""
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from functools import wraps
+from typing import Any, Dict, Iterator, List
+
+if __package__ is None:
+    # add /microraiden/ to path
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+    sys.path.insert(0, path)
+    # remove /microraiden/microraiden/ from path
+    path = os.path.abspath(os.path.dirname(__file__))
+    if path in sys.path:
+        sys.path.remove(path)
+
+import click
+from eth_abi import decode_abi, encode_abi
+from eth_utils import decode_hex, encode_hex, keccak
+from web3 import Web3, HTTPProvider
+
+from microraiden import constants
+from microraiden.channel_manager import Blockchain, ChannelManager
+from microraiden.constants import (
+    CONTRACT_METADATA,
+    CHANNEL_MANAGER_ABI_NAME,
+    CHANNEL_MANAGER_CONTRACT_VERSION,
+    TOKEN_ABI_NAME
+)
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.utils import LogQuery, privkey_to_addr, to_checksum_address
+from microraiden.utils.event_cache import CHANNEL_EVENTS
+from microraiden.utils.event_decoder import make_event_decoders
+
+log = logging.getLogger('replay_sync')
+
+# key of the receiver the events are replayed to
+RECEIVER_PRIVKEY = '0x' + '12' * 32
+# settle timeout of generated close requests, in blocks
+SETTLE_TIMEOUT = 500
+
+GET_CHANNEL_INFO_SELECTOR = keccak(b'getChannelInfo(address,address,uint32)')[:4]
+
+# methods of the channel manager called by the Blockchain
+CHANNEL_MANAGER_HANDLERS = [
+    'set_head',
+    'reset_unconfirmed',
+    'event_channel_opened',
+    'unconfirmed_event_channel_opened',
+    'event_channel_topup',
+    'unconfirmed_event_channel_topup',
+    'event_channel_close_requested',
+    'event_channel_settled',
+    'force_close_channel'
+]
+
+
+def channel_manager_abi() -> List[Dict[str, Any]]:
+    return CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+
+
+def address_topic(address: str) -> str:
+    return '0x' + '00' * 12 + address[2:].lower()
+
+
+def read_logs(filename: str) -> List[Dict[str, Any]]:
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_logs(logs: Iterator[Dict[str, Any]], output) -> int:
+    """
+    Returns:
+        int: number of written logs
+    """
+    n_logs = 0
+    for raw_log in logs:
+        output.write(json.dumps(raw_log, sort_keys=True) + '\n')
+        n_logs += 1
+    return n_logs
+
+
+def record_logs(
+        web3: Web3,
+        contract_address: str,
+        from_block: int,
+        to_block: int,
+        receiver: str = None,
+        chunk_size: int = 10000
+) -> Iterator[Dict[str, Any]]:
+    """Fetch the raw channel events of a contract from a node, in chunks of blocks.
+
+    Args:
+        receiver (str, optional): if set, only the events of this receiver are recorded
+    """
+    contract = web3.eth.contract(address=contract_address, abi=channel_manager_abi())
+    argument_filters = {'_receiver_address': receiver} if receiver is not None else None
+    query = LogQuery(contract, CHANNEL_EVENTS, argument_filters)
+    for range_start in range(from_block, to_block + 1, chunk_size):
+        range_end = min(range_start + chunk_size - 1, to_block)
+        raw_logs = web3.manager.request_blocking(
+            'eth_getLogs',
+            [query.filter_params(range_start, range_end)]
+        )
+        log.info('recorded %d events of blocks %d-%d', len(raw_logs), range_start, range_end)
+        for raw_log in raw_logs:
+            yield dict(raw_log)
+
+
+def generate_logs(
+        n_channels: int,
+        seed: int = 0,
+        start_block: int = 1000,
+        blocks_per_channel: int = 2,
+        topup_rate: float = 0.5,
+        close_rate: float = 0.3,
+        n_receivers: int = 1,
+        contract_address: str = '0x' + 'aa' * 20
+) -> List[Dict[str, Any]]:
+    """Generate the raw events of synthetic channels.
+
+    Every channel is opened in its own block, may be topped up and may be closed,
+    cooperatively or after a close request. Channels are spread over `n_receivers`
+    receivers; the first one is the receiver the events are replayed to by default.
+
+    Returns:
+        list: logs ordered by (blockNumber, logIndex)
+    """
+    rng = random.Random(seed)
+    provider = FakeRPCProvider()
+    contract = Web3(provider).eth.contract(
+        address=to_checksum_address(contract_address),
+        abi=channel_manager_abi()
+    )
+    receivers = [
+        to_checksum_address('0x%040x' % rng.getrandbits(160)) for _ in range(n_receivers)
+    ]
+    senders = [
+        to_checksum_address('0x%040x' % rng.getrandbits(160))
+        for _ in range(max(n_channels // 2, 1))
+    ]
+    # (block number, event name, arguments)
+    events = []
+    for i in range(n_channels):
+        channel = dict(
+            _sender_address=rng.choice(senders),
+            _receiver_address=receivers[i % n_receivers]
+        )
+        open_block_number = start_block + i * blocks_per_channel + rng.randrange(
+            blocks_per_channel
+        )
+        deposit = rng.randint(1, 100) * 10 ** 18
+        events.append((open_block_number, 'ChannelCreated', dict(channel, _deposit=deposit)))
+        block_number = open_block_number
+        while rng.random() < topup_rate:
+            block_number += rng.randint(1, 100)
+            added_deposit = rng.randint(1, 100) * 10 ** 18
+            deposit += added_deposit
+            events.append((block_number, 'ChannelToppedUp', dict(
+                channel,
+                _open_block_number=open_block_number,
+                _added_deposit=added_deposit
+            )))
+        if rng.random() >= close_rate:
+            continue
+        balance = rng.randint(0, deposit)
+        block_number += rng.randint(1, 1000)
+        if rng.random() < 0.5:
+            events.append((block_number, 'ChannelCloseRequested', dict(
+                channel,
+                _open_block_number=open_block_number,
+                _balance=balance
+            )))
+            block_number += SETTLE_TIMEOUT
+        events.append((block_number, 'ChannelSettled', dict(
+            channel,
+            _open_block_number=open_block_number,
+            _balance=balance,
+            _receiver_tokens=balance
+        )))
+
+    events.sort(key=lambda event: event[0])
+    for block_number, event_name, args in events:
+        provider.add_log(contract, event_name, block_number, **args)
+    return provider.logs
+
+
+class ReplayRPCProvider(FakeRPCProvider):
+    """Fake node serving a fixed list of logs, indexed by block.
+
+    `getChannelInfo` calls are answered from the events of the logs, and the time spent
+    answering requests (including the simulated `latency`) is accumulated in
+    `request_time`.
+    """
+
+    def __init__(self, logs: List[Dict[str, Any]], latency: float = 0):
+        super().__init__(latency=latency)
+        self.logs = sorted(
+            logs,
+            key=lambda raw_log: (int(raw_log['blockNumber'], 16), int(raw_log['logIndex'], 16))
+        )
+        self.log_blocks = [int(raw_log['blockNumber'], 16) for raw_log in self.logs]
+        self.block_number = self.log_blocks[-1] if self.logs else 0
+        self.request_time = 0.0
+        # (sender, receiver, open block number) => deposit, settle block, closing balance
+        self.channel_infos = {}  # type: Dict[tuple, List[int]]
+        decoders = make_event_decoders(channel_manager_abi())
+        for raw_log in self.logs:
+            decoder = decoders.get(raw_log['topics'][0].lower())
+            if decoder is not None:
+                self._update_channel_info(raw_log, decoder.decode(raw_log))
+
+    def _update_channel_info(self, raw_log, event):
+        args = event['args']
+        if event['event'] == 'ChannelCreated':
+            open_block_number = int(raw_log['blockNumber'], 16)
+        elif '_open_block_number' in args:
+            open_block_number = args['_open_block_number']
+        else:
+            return
+        key = (
+            args['_sender_address'].lower(),
+            args['_receiver_address'].lower(),
+            open_block_number
+        )
+        if event['event'] == 'ChannelCreated':
+            self.channel_infos[key] = [args['_deposit'], 0, 0]
+        elif key not in self.channel_infos:
+            return
+        elif event['event'] == 'ChannelToppedUp':
+            self.channel_infos[key][0] += args['_added_deposit']
+        elif event['event'] == 'ChannelCloseRequested':
+            self.channel_infos[key][1] = int(raw_log['blockNumber'], 16) + SETTLE_TIMEOUT
+            self.channel_infos[key][2] = args['_balance']
+
+    def _logs_in_range(self, from_block, to_block):
+        return self.logs[
+            bisect_left(self.log_blocks, from_block):bisect_right(self.log_blocks, to_block)
+        ]
+
+    def make_request(self, method, params):
+        t_start = time.time()
+        try:
+            return super().make_request(method, params)
+        finally:
+            self.request_time += time.time() - t_start
+
+    def eth_call(self, transaction, block_id='latest'):
+        data = decode_hex(transaction['data'])
+        if data[:4] != GET_CHANNEL_INFO_SELECTOR:
+            return super().eth_call(transaction, block_id)
+        sender, receiver, open_block_number = decode_abi(
+            ['address', 'address', 'uint32'],
+            data[4:]
+        )
+        info = self.channel_infos.get((sender.lower(), receiver.lower(), open_block_number))
+        if info is None:
+            # the contract's require fails
+            return '0x'
+        deposit, settle_block_number, closing_balance = info
+        channel_key = keccak(decode_hex(sender) + decode_hex(receiver) +
+                             open_block_number.to_bytes(4, 'big'))
+        return encode_hex(encode_abi(
+            ['bytes32', 'uint192', 'uint32', 'uint192', 'uint192'],
+            [channel_key, deposit, settle_block_number, closing_balance, 0]
+        ))
+
+
+class Stopwatch(object):
+    """Accumulates the time spent in wrapped functions."""
+
+    def __init__(self):
+        self.time = 0.0
+        self.calls = 0
+
+    def wrap(self, function):
+        @wraps(function)
+        def timed(*args, **kwargs):
+            t_start = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.time += time.time() - t_start
+                self.calls += 1
+        return timed
+
+
+def main_receiver(logs: List[Dict[str, Any]]) -> str:
+    """The receiver with the most events."""
+    receivers = Counter(raw_log['topics'][2].lower() for raw_log in logs
+                        if len(raw_log['topics']) > 2)
+    return to_checksum_address('0x' + receivers.most_common(1)[0][0][-40:])
+
+
+def replay(
+        logs: List[Dict[str, Any]],
+        receiver: str = None,
+        n_confirmations: int = 5,
+        chunk_size: int = 10000,
+        concurrency: int = 1,
+        state_file: str = None,
+        latency: float = 0,
+        trace_memory: bool = False
+) -> dict:
+    """Sync a channel manager from a list of raw logs served by a fake node.
+
+    The events of `receiver` are replayed to a channel manager with the key
+    `RECEIVER_PRIVKEY`, the events of other receivers are filtered out by the node.
+
+    Args:
+        receiver (str, optional): receiver whose events are replayed. Defaults to the
+            receiver with the most events.
+        chunk_size (int, optional): initial number of blocks queried at once
+        concurrency (int, optional): number of block ranges fetched concurrently
+        state_file (str, optional): path of the state database. Defaults to a
+            temporary file.
+        latency (float, optional): seconds every RPC request takes
+        trace_memory (bool, optional): measure the peak of the memory allocated during
+            the sync. It slows down the sync.
+    Returns:
+        dict: benchmark report
+    """
+    assert logs, 'no logs to replay'
+    receiver = receiver or main_receiver(logs)
+    replay_receiver = privkey_to_addr(RECEIVER_PRIVKEY)
+    recorded_topic = address_topic(receiver)
+    n_events = 0
+    replayed_logs = []
+    for raw_log in logs:
+        if len(raw_log['topics']) > 2 and raw_log['topics'][2].lower() == recorded_topic:
+            topics = list(raw_log['topics'])
+            topics[2] = address_topic(replay_receiver)
+            raw_log = dict(raw_log, topics=topics)
+            n_events += 1
+        replayed_logs.append(raw_log)
+
+    provider = ReplayRPCProvider(replayed_logs, latency=latency)
+    first_block = provider.log_blocks[0]
+    last_block = provider.log_blocks[-1]
+    # all events are confirmed at the end of the sync
+    provider.block_number = last_block + n_confirmations
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=to_checksum_address(replayed_logs[0]['address']),
+        abi=channel_manager_abi()
+    )
+    token_contract = web3.eth.contract(
+        address=to_checksum_address('0x' + 'bb' * 20),
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if state_file is None:
+            state_file = os.path.join(tmpdir, 'state.db')
+        cm = ChannelManager(web3, contract, token_contract, RECEIVER_PRIVKEY,
+                            state_filename=state_file, n_confirmations=n_confirmations)
+        cm.blockchain = Blockchain(
+            web3,
+            contract,
+            cm,
+            n_confirmations,
+            sync_chunk_size=chunk_size,
+            sync_concurrency=concurrency
+        )
+        cm.blockchain.sync_start_block = first_block - 1
+        state_stopwatch = Stopwatch()
+        for name in CHANNEL_MANAGER_HANDLERS:
+            setattr(cm, name, state_stopwatch.wrap(getattr(cm, name)))
+
+        if trace_memory:
+            tracemalloc.start()
+        n_updates = 0
+        t_start = time.time()
+        try:
+            while not cm.blockchain.wait_sync_event.is_set():
+                cm.blockchain._update()
+                n_updates += 1
+            duration = time.time() - t_start
+            peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        n_channels = cm.state.n_channels
+        if state_file != ':memory:':
+            cm.lock_state.release()
+        cm.state.conn.close()
+
+    return {
+        'n_events': n_events,
+        'n_blocks': provider.block_number - first_block + 1,
+        'n_updates': n_updates,
+        'n_requests': sum(provider.calls.values()),
+        'n_channels': n_channels,
+        'duration': duration,
+        'events_per_second': n_events / duration if duration else None,
+        # request time of concurrent queries may add up to more than the duration
+        'rpc_time': provider.request_time,
+        'state_time': state_stopwatch.time,
+        # log decoding and sync logic
+        'other_time': max(duration - provider.request_time - state_stopwatch.time, 0),
+        'peak_traced_memory': peak_memory,
+        # kilobytes on Linux
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command()
+@click.option(
+    '--rpc-provider',
+    default=constants.WEB3_PROVIDER_DEFAULT,
+    help='Address of the Ethereum RPC provider'
+)
+@click.option(
+    '--contract-address',
+    required=True,
+    help='Address of the channel manager contract'
+)
+@click.option(
+    '--receiver',
+    default=None,
+    help='Only record the events of this receiver'
+)
+@click.option('--from-block', required=True, type=int, help='First recorded block')
+@click.option('--to-block', default=None, type=int, help='Last recorded block')
+@click.option(
+    '--chunk-size',
+    default=10000,
+    type=int,
+    help='Number of blocks queried at once'
+)
+@click.argument('output', type=click.File('w'))
+def record(rpc_provider, contract_address, receiver, from_block, to_block, chunk_size, output):
+    """Record the channel events of a contract from a node."""
+    web3 = Web3(HTTPProvider(rpc_provider, request_kwargs={'timeout': 60}))
+    if to_block is None:
+        to_block = web3.eth.blockNumber
+    n_logs = write_logs(record_logs(
+        web3,
+        to_checksum_address(contract_address),
+        from_block,
+        to_block,
+        receiver=receiver,
+        chunk_size=chunk_size
+    ), output)
+    log.info('recorded %d events', n_logs)
+
+
+@main.command()
+@click.option('--channels', default=10000, type=int, help='Number of channels')
+@click.option('--seed', default=0, type=int, help='Seed of the random generator')
+@click.option('--receivers', default=1, type=int, help='Number of receivers')
+@click.argument('output', type=click.File('w'))
+def generate(channels, seed, receivers, output):
+    """Generate the channel events of synthetic channels."""
+    n_logs = write_logs(generate_logs(channels, seed=seed, n_receivers=receivers), output)
+    log.info('generated %d events', n_logs)
+
+
+@main.command()
+@click.option(
+    '--receiver',
+    default=None,
+    help='Receiver whose events are replayed. Defaults to the one with the most events.'
+)
+@click.option('--confirmations', default=5, type=int, help='Number of confirmations')
+@click.option(
+    '--chunk-size',
+    default=10000,
+    type=int,
+    help='Initial number of blocks queried at once'
+)
+@click.option(
+    '--concurrency',
+    default=1,
+    type=int,
+    help='Number of block ranges fetched concurrently'
+)
+@click.option('--latency', default=0.0, type=float, help='Seconds every RPC request takes')
+@click.option(
+    '--state-file',
+    default=None,
+    type=click.Path(dir_okay=False),
+    help='State file of the channel manager. Defaults to a temporary file.'
+)
+@click.option(
+    '--trace-memory',
+    default=False,
+    is_flag=True,
+    help='Measure the peak of the memory allocated during the sync (slower)'
+)
+@click.argument('logs_file', type=click.Path(exists=True, dir_okay=False))
+def run(receiver, confirmations, chunk_size, concurrency, latency, state_file, trace_memory,
+        logs_file):
+    """Replay recorded or generated events and report the sync throughput."""
+    report = replay(
+        read_logs(logs_file),
+        receiver=receiver,
+        n_confirmations=confirmations,
+        chunk_size=chunk_size,
+        concurrency=concurrency,
+        state_file=state_file,
+        latency=latency,
+        trace_memory=trace_memory
+    )
+    click.echo(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    # the channel manager logs every event, which would be measured too
+    logging.getLogger('blockchain').setLevel(logging.WARNING)
+    logging.getLogger('channel_manager').setLevel(logging.WARNING)
+    main()
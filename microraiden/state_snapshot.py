@@ -0,0 +1,90 @@
+"""
+Utility module used to export a signed snapshot of a channel manager state file.
+
+The snapshot holds the confirmed channels and the confirmed head of the state. A new
+proxy of the same receiver started with `--state-snapshot` creates its state file from
+it, after checking the signature and that the head is still part of the chain, and only
+syncs the blocks since the snapshot.
+
+Example::
+
+    $ python -m microraiden.state_snapshot --private-key ~/.keys/my_key.json \\
+        --state-file ~/.config/microraiden/0x1234_0x5678.db snapshot.json
+"""
+import json
+import logging
+import os
+import sys
+
+if __package__ is None:
+    # add /microraiden/ to path
+    path = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+    sys.path.insert(0, path)
+    # remove /microraiden/microraiden/ from path
+    path = os.path.abspath(os.path.dirname(__file__))
+    if path in sys.path:
+        sys.path.remove(path)
+
+import click
+
+from microraiden import utils
+from microraiden.channel_manager import ChannelManagerState
+from microraiden.channel_manager.snapshot import export_snapshot
+from microraiden.exceptions import StateFileException
+
+log = logging.getLogger('state_snapshot')
+
+
+@click.command()
+@click.option(
+    '--private-key',
+    required=True,
+    help='Path to private key file of the proxy',
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True)
+)
+@click.option(
+    '--private-key-password-file',
+    default=None,
+    help='Path to file containing password for the JSON-encoded private key',
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True)
+)
+@click.option(
+    '--state-file',
+    required=True,
+    help='State file of the proxy',
+    type=click.Path(exists=True, dir_okay=False, resolve_path=True)
+)
+@click.argument('output', type=click.File('w'))
+def main(
+        private_key: str,
+        private_key_password_file: str,
+        state_file: str,
+        output
+):
+    private_key = utils.get_private_key(private_key, private_key_password_file)
+    if private_key is None:
+        sys.exit(1)
+
+    try:
+        state = ChannelManagerState.load(state_file)
+    except StateFileException as e:
+        log.fatal('Error reading state file: %s', e)
+        sys.exit(1)
+    if not utils.is_same_address(state.receiver, utils.privkey_to_addr(private_key)):
+        log.fatal('Private key does not match receiver address in state file')
+        sys.exit(1)
+
+    try:
+        snapshot = export_snapshot(state, private_key)
+    except StateFileException as e:
+        log.fatal(str(e))
+        sys.exit(1)
+    json.dump(snapshot, output, indent=2)
+    output.write('\n')
+    log.info('Exported %d channels at block %d', len(snapshot['channels']),
+             snapshot['confirmed_head_number'])
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
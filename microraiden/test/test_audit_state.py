@@ -0,0 +1,99 @@
+import json
+import shutil
+
+import pytest
+from click.testing import CliRunner
+from eth_utils import encode_hex
+
+from microraiden.audit_state import audit_state, main
+from microraiden.channel_manager import (
+    Channel,
+    ChannelState,
+    ChannelManagerState
+)
+from microraiden.utils import privkey_to_addr, sign_balance_proof
+
+CONTRACT_ADDRESS = '0xaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa'
+RECEIVER_ADDRESS = '0xbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb'
+SENDER_PRIVATE_KEY = '0xa0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0'
+SENDER_ADDRESS = privkey_to_addr(SENDER_PRIVATE_KEY)
+NETWORK_ID = 123
+
+
+def add_channel(state, open_block_number, deposit, balance, signature):
+    channel = Channel(RECEIVER_ADDRESS, SENDER_ADDRESS, deposit, open_block_number)
+    channel.state = ChannelState.OPEN
+    channel.balance = balance
+    channel.last_signature = signature
+    state.set_channel(channel)
+
+
+def sign(open_block_number, balance):
+    return encode_hex(sign_balance_proof(
+        SENDER_PRIVATE_KEY,
+        RECEIVER_ADDRESS,
+        open_block_number,
+        balance,
+        CONTRACT_ADDRESS
+    ))
+
+
+@pytest.fixture()
+def state_file(tmpdir):
+    db = tmpdir.join("state.db")
+    state = ChannelManagerState(db.strpath)
+    state.setup_db(NETWORK_ID, CONTRACT_ADDRESS, RECEIVER_ADDRESS)
+    # valid channels
+    for i in range(1, 21):
+        add_channel(state, i, 10, i % 10, sign(i, i % 10) if i % 10 else None)
+    # balance exceeds the deposit
+    add_channel(state, 100, 10, 12, sign(100, 12))
+    # proof signed for a different balance
+    add_channel(state, 101, 10, 5, sign(101, 4))
+    # payment without a proof
+    add_channel(state, 102, 10, 5, None)
+    # garbage signature
+    add_channel(state, 103, 10, 5, '0x' + 'bb' * 65)
+    state.conn.close()
+    return db.strpath
+
+
+@pytest.mark.parametrize('processes', [1, 3])
+def test_audit_state(state_file, processes):
+    report = audit_state(state_file, processes=processes, batch_size=7)
+    assert report['receiver'] == RECEIVER_ADDRESS
+    assert report['network_id'] == NETWORK_ID
+    assert report['n_channels'] == 24
+    assert report['n_failed'] == 4
+    errors = {
+        channel['open_block_number']: channel['errors']
+        for channel in report['failed']
+    }
+    assert errors[100] == ['balance_exceeds_deposit']
+    assert errors[101] == ['invalid_signature']
+    assert errors[102] == ['missing_signature']
+    assert errors[103] in (['malformed_signature'], ['invalid_signature'])
+
+
+def test_audit_state_special_path(state_file, tmpdir):
+    # characters of the URI syntax
+    path = tmpdir.mkdir('a?b#c%20d').join('state?mode=rw#%41.db').strpath
+    shutil.copyfile(state_file, path)
+    report = audit_state(path, processes=1, batch_size=7)
+    assert report['n_channels'] == 24
+    assert report['n_failed'] == 4
+
+
+def test_audit_state_cli(state_file, tmpdir):
+    # the audit must not interfere with a running proxy
+    state = ChannelManagerState.load(state_file)
+    output = tmpdir.join('report.json')
+    result = CliRunner().invoke(main, [
+        '--state-file', state_file,
+        '--processes', '2',
+        '--output', output.strpath
+    ])
+    assert result.exit_code == 1
+    assert json.loads(output.read())['n_failed'] == 4
+    add_channel(state, 200, 10, 0, None)
+    assert state.n_channels == 25
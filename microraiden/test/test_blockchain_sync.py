@@ -0,0 +1,836 @@
+import time
+import logging
+
+import gevent
+import pytest
+from eth_utils import decode_hex
+from web3 import Web3, HTTPProvider
+
+from microraiden.channel_manager import (
+    Blockchain,
+    ChannelManager,
+    ChannelManagerState,
+    SharedBlockchain
+)
+from microraiden.channel_manager.chunk_size import AdaptiveChunkSize, is_range_error
+from microraiden.channel_manager import new_heads
+from microraiden.channel_manager.new_heads import AdaptivePolling, NewHeadsSubscription
+from microraiden.constants import (
+    CONTRACT_METADATA,
+    CHANNEL_MANAGER_ABI_NAME,
+    CHANNEL_MANAGER_CONTRACT_VERSION,
+    TOKEN_ABI_NAME
+)
+from microraiden.test.utils.fake_rpc import (
+    FakeRPCProvider,
+    FakeNewHeadsServer,
+    FakeHTTPServer,
+    FakeWebsocketNode
+)
+from microraiden.utils import (
+    EventCache,
+    LogQuery,
+    RPCBatch,
+    get_channel_infos,
+    privkey_to_addr,
+    to_checksum_address
+)
+
+log = logging.getLogger(__name__)
+
+CONTRACT_ADDRESS = to_checksum_address('0x' + 'aa' * 20)
+TOKEN_ADDRESS = to_checksum_address('0x' + 'bb' * 20)
+RECEIVER_ADDRESS = to_checksum_address('0x' + 'cc' * 20)
+N_CONFIRMATIONS = 5
+
+
+class ChannelManagerStub(object):
+    """Records the events relayed by the Blockchain."""
+
+    def __init__(self, receiver=RECEIVER_ADDRESS):
+        self.state = ChannelManagerState(':memory:')
+        self.state.setup_db(1337, CONTRACT_ADDRESS, receiver)
+        self.receiver = receiver
+        self.n_confirmations = N_CONFIRMATIONS
+        self.channels = {}
+        self.unconfirmed_channels = {}
+        self.opened = []
+        self.topups = []
+        self.unconfirmed_topups = {}
+        self.n_set_head = 0
+        self.n_resets = 0
+        self.close_requests = {}
+        self.force_closed = []
+
+    def set_head(self, unconfirmed_head_number, unconfirmed_head_hash,
+                 confirmed_head_number, confirmed_head_hash):
+        self.n_set_head += 1
+        # with the checks of the channel manager
+        ChannelManager.set_head(self, unconfirmed_head_number, unconfirmed_head_hash,
+                                confirmed_head_number, confirmed_head_hash)
+
+    def unconfirmed_event_channel_opened(self, sender, open_block_number, deposit):
+        self.unconfirmed_channels[sender, open_block_number] = deposit
+
+    def event_channel_opened(self, sender, open_block_number, deposit):
+        self.unconfirmed_channels.pop((sender, open_block_number), None)
+        self.channels[sender, open_block_number] = deposit
+        self.opened.append((sender, open_block_number))
+
+    def unconfirmed_event_channel_topup(self, sender, open_block_number, txhash, added_deposit):
+        self.unconfirmed_topups[txhash] = (sender, open_block_number, added_deposit)
+
+    def event_channel_topup(self, sender, open_block_number, txhash, added_deposit):
+        assert (sender, open_block_number) in self.channels
+        self.channels[sender, open_block_number] += added_deposit
+        self.topups.append((sender, open_block_number))
+        self.unconfirmed_topups.pop(txhash, None)
+
+    def event_channel_close_requested(self, sender, open_block_number, balance, timeout):
+        self.close_requests[sender, open_block_number] = (balance, timeout)
+
+    def force_close_channel(self, sender, open_block_number):
+        self.force_closed.append((sender, open_block_number))
+
+    def revert_unconfirmed_channel_opened(self, sender, open_block_number):
+        del self.unconfirmed_channels[sender, open_block_number]
+
+    def revert_unconfirmed_channel_topup(self, sender, open_block_number, txhash):
+        del self.unconfirmed_topups[txhash]
+
+    def rollback_unconfirmed(self, block_number, block_hash):
+        ChannelManager.rollback_unconfirmed(self, block_number, block_hash)
+
+    def reset_unconfirmed(self):
+        self.n_resets += 1
+        self.unconfirmed_channels = {}
+        self.unconfirmed_topups = {}
+        self.state.unconfirmed_head_number = self.state.confirmed_head_number
+        self.state.unconfirmed_head_hash = self.state.confirmed_head_hash
+
+
+def make_blockchain(provider, chunk_size=None, **kwargs):
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=CONTRACT_ADDRESS,
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+    cm = ChannelManagerStub()
+    cm.token_contract = web3.eth.contract(
+        address=TOKEN_ADDRESS,
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    blockchain = Blockchain(web3, contract, cm, N_CONFIRMATIONS, **kwargs)
+    blockchain.sync_start_block = 0
+    if chunk_size is not None:
+        blockchain.chunk_size = chunk_size
+    return blockchain, contract
+
+
+def add_channels(provider, contract, blocks, receiver=RECEIVER_ADDRESS):
+    for i, block in enumerate(blocks):
+        sender = to_checksum_address('0x%040x' % (i + 1))
+        provider.add_log(contract, 'ChannelCreated', block, _deposit=10,
+                         _sender_address=sender, _receiver_address=receiver)
+        provider.add_log(contract, 'ChannelToppedUp', block, _open_block_number=block,
+                         _added_deposit=5, _sender_address=sender,
+                         _receiver_address=receiver)
+
+
+def sync(blockchain):
+    while not blockchain.wait_sync_event.is_set():
+        blockchain._update()
+
+
+def test_chunk_size():
+    chunk_size = AdaptiveChunkSize(1000, min_size=10, max_size=4000, target_latency=1)
+    chunk_size.update(1000, 0, 0.1)
+    assert chunk_size.size == 2000
+    # cut short by the chain head
+    chunk_size.update(10, 0, 0.1)
+    assert chunk_size.size == 2000
+    chunk_size.update(2000, 100, 4)
+    assert chunk_size.size == 1000
+    chunk_size.update(1000, 100, 1.25)
+    assert chunk_size.size == 800
+    chunk_size.update(800, 100, 0.75)
+    assert chunk_size.size == 800
+    chunk_size.update(800, 0, 0.1)
+    chunk_size.update(1600, 0, 0.1)
+    chunk_size.update(3200, 0, 0.1)
+    assert chunk_size.size == 4000
+    for _ in range(10):
+        chunk_size.shrink()
+    assert chunk_size.size == 10
+    assert chunk_size.n_errors == 10
+
+    # dense range, grow only up to the size that worked
+    chunk_size.update(10, 100, 0.1)
+    assert chunk_size.size == 10
+    chunk_size.update(10, 0, 0.1)
+    assert chunk_size.size == 20
+
+    assert is_range_error(ValueError({
+        'code': -32005,
+        'message': 'query returned more than 10000 results'
+    }))
+    assert is_range_error(ValueError({'code': -32000, 'message': 'request timed out'}))
+    assert not is_range_error(ValueError({'code': -32601, 'message': 'Method not found'}))
+    assert not is_range_error(KeyError('timeout'))
+
+
+def test_adaptive_sync():
+    provider = FakeRPCProvider(
+        block_number=2 * 1000 * 1000,
+        max_results=50,
+        max_range=300 * 1000
+    )
+    blockchain, contract = make_blockchain(provider, sync_concurrency=1)
+    # sparse history with a dense range of channels
+    blocks = list(range(1500 * 1000, 1510 * 1000, 50)) + [1900 * 1000]
+    add_channels(provider, contract, blocks)
+
+    sync(blockchain)
+
+    cm = blockchain.cm
+    assert len(cm.opened) == len(blocks)
+    assert len(cm.topups) == len(blocks)
+    assert all(deposit == 15 for deposit in cm.channels.values())
+    assert cm.state.unconfirmed_head_number == provider.block_number
+    assert cm.state.confirmed_head_number == provider.block_number - N_CONFIRMATIONS
+    assert blockchain.chunk_size.n_errors > 0
+    # progress is stored after every range
+    assert 1 < cm.n_set_head < provider.calls['eth_getLogs']
+
+
+def test_adaptive_sync_benchmark():
+    latency = 0.001
+    block_number = 500 * 1000
+    blocks = list(range(400 * 1000, 410 * 1000, 50))
+    results = {}
+    for name, chunk_size in [
+        ('fixed', AdaptiveChunkSize(1000, min_size=1000, max_size=1000)),
+        ('adaptive', None)
+    ]:
+        provider = FakeRPCProvider(
+            block_number=block_number,
+            max_results=50,
+            max_range=300 * 1000,
+            latency=latency
+        )
+        blockchain, contract = make_blockchain(provider, chunk_size, sync_concurrency=1)
+        add_channels(provider, contract, blocks)
+        t_start = time.time()
+        sync(blockchain)
+        results[name] = (provider.calls['eth_getLogs'], time.time() - t_start)
+        assert len(blockchain.cm.opened) == len(blocks)
+
+    log.info('sync of %d blocks (latency %ss): fixed chunks %d queries in %fs, '
+             'adaptive chunks %d queries in %fs',
+             block_number, latency, results['fixed'][0], results['fixed'][1],
+             results['adaptive'][0], results['adaptive'][1])
+    assert results['adaptive'][0] < results['fixed'][0]
+
+
+def test_backfill():
+    provider = FakeRPCProvider(
+        block_number=2 * 1000 * 1000,
+        max_results=50,
+        max_range=300 * 1000,
+        latency=0.001
+    )
+    blockchain, contract = make_blockchain(provider, sync_concurrency=4)
+    blocks = list(range(1500 * 1000, 1510 * 1000, 50)) + [1900 * 1000]
+    add_channels(provider, contract, blocks)
+    blockchain._make_queries()
+
+    # stop at a range boundary in the middle of the history
+    blockchain.cm.state.update_sync_state(confirmed_head_number=0, unconfirmed_head_number=0)
+    blockchain.current_block = provider.block_number
+    blockchain._backfill(1505 * 1000)
+    cm = blockchain.cm
+    assert cm.state.confirmed_head_number == 1505 * 1000
+    # the unconfirmed head stays ahead of the confirmed one
+    assert cm.state.unconfirmed_head_number == 1505 * 1000 + N_CONFIRMATIONS
+    # events are applied in block order (topups of unknown channels would fail)
+    assert cm.opened == [
+        (to_checksum_address('0x%040x' % (i + 1)), block)
+        for i, block in enumerate(blocks) if block <= 1505 * 1000
+    ]
+
+    sync(blockchain)
+
+    assert cm.opened == [
+        (to_checksum_address('0x%040x' % (i + 1)), block) for i, block in enumerate(blocks)
+    ]
+    assert len(cm.topups) == len(blocks)
+    assert all(deposit == 15 for deposit in cm.channels.values())
+    assert cm.unconfirmed_channels == {}
+    assert cm.state.unconfirmed_head_number == provider.block_number
+    assert cm.state.confirmed_head_number == provider.block_number - N_CONFIRMATIONS
+
+
+def test_backfill_benchmark():
+    latency = 0.01
+    blocks = list(range(50 * 1000, 55 * 1000, 50))
+    results = {}
+    for sync_concurrency in [1, 8]:
+        provider = FakeRPCProvider(block_number=100 * 1000, max_results=50, latency=latency)
+        blockchain, contract = make_blockchain(
+            provider,
+            AdaptiveChunkSize(1000, max_size=1000),
+            sync_concurrency=sync_concurrency
+        )
+        add_channels(provider, contract, blocks)
+        t_start = time.time()
+        sync(blockchain)
+        results[sync_concurrency] = time.time() - t_start
+        assert len(blockchain.cm.opened) == len(blocks)
+
+    log.info('sync of 100000 blocks in 1000 block ranges (latency %ss): '
+             'sequential %fs, 8 concurrent queries %fs', latency, results[1], results[8])
+    assert results[8] < results[1]
+
+
+def test_adaptive_polling():
+    polling = AdaptivePolling(poll_interval=2, smoothing=0.5)
+    assert polling.next_interval(now=0) == 2
+    polling.update(100, now=0)
+    polling.update(100, now=5)
+    polling.update(102, now=20)
+    assert polling.block_time == 10
+    # the next block is due in 10s
+    assert polling.next_interval(now=20) == 10
+    assert polling.next_interval(now=27) == 3
+    # overdue
+    assert polling.next_interval(now=29) == 2
+    assert polling.next_interval(now=40) == 2
+    polling.update(103, now=40)
+    assert polling.block_time == 15
+
+
+def test_new_heads_subscription(tmpdir):
+    server = FakeNewHeadsServer(str(tmpdir.join('node.ipc')))
+    server.start()
+    subscription = NewHeadsSubscription(server.path, reconnect_interval=0.1)
+    subscription.start()
+    try:
+        assert subscription.connected.wait(5)
+        server.publish(10)
+        server.publish(11)
+        assert subscription.wait(5)
+        gevent.sleep(0.1)
+        assert subscription.head_number == 11
+        assert subscription.n_notifications == 2
+
+        # the subscription is renewed after the connection drops
+        server.drop()
+        assert not subscription.wait(5)
+        assert not subscription.connected.is_set()
+        assert subscription.connected.wait(5)
+        assert server.n_subscriptions == 2
+        server.publish(12)
+        assert subscription.wait(5)
+        assert subscription.head_number == 12
+    finally:
+        subscription.stop()
+        subscription.join(5)
+        server.stop()
+    assert subscription.dead
+
+
+def test_new_heads_websocket(monkeypatch):
+    node = FakeWebsocketNode()
+    monkeypatch.setattr(new_heads, 'websocket', node)
+    subscription = NewHeadsSubscription('ws://localhost:8546', reconnect_interval=0.1)
+    subscription.start()
+    try:
+        assert subscription.connected.wait(5)
+        assert node.urls == ['ws://localhost:8546']
+        node.publish(10)
+        assert subscription.wait(5)
+        assert subscription.head_number == 10
+
+        # the subscription is renewed after the connection drops
+        node.drop()
+        assert not subscription.wait(5)
+        assert subscription.connected.wait(5)
+        assert node.n_subscriptions == 2
+        node.publish(11)
+        assert subscription.wait(5)
+        assert subscription.head_number == 11
+    finally:
+        subscription.stop()
+        subscription.join(5)
+    assert subscription.dead
+    assert node.connections == []
+
+
+def test_new_heads_websocket_unavailable(monkeypatch, tmpdir):
+    monkeypatch.setattr(new_heads, 'websocket', None)
+    with pytest.raises(RuntimeError, match='websocket-client'):
+        make_blockchain(FakeRPCProvider(), new_heads_endpoint='ws://localhost:8546')
+    # IPC doesn't need it
+    NewHeadsSubscription(str(tmpdir.join('node.ipc')))
+
+
+def measure_event_latency(provider, blockchain, contract, publish, n_blocks=5):
+    """Returns the average time between a new block with a ChannelCreated event and
+    the unconfirmed channel showing up in the channel manager."""
+    cm = blockchain.cm
+    latencies = []
+    for i in range(n_blocks):
+        block = provider.block_number + 1
+        sender = to_checksum_address('0x%040x' % (i + 1))
+        # blocks don't arrive in sync with polling
+        gevent.sleep(0.05)
+        provider.add_log(contract, 'ChannelCreated', block, _deposit=10,
+                         _sender_address=sender, _receiver_address=RECEIVER_ADDRESS)
+        t_start = time.time()
+        publish(block)
+        while (sender, block) not in cm.unconfirmed_channels:
+            gevent.sleep(0.001)
+        latencies.append(time.time() - t_start)
+    return sum(latencies) / len(latencies)
+
+
+def test_new_heads_latency(tmpdir):
+    server = FakeNewHeadsServer(str(tmpdir.join('node.ipc')))
+    server.start()
+    results = {}
+    for name in ['polling', 'subscription']:
+        provider = FakeRPCProvider(block_number=1000)
+        if name == 'subscription':
+            blockchain, contract = make_blockchain(provider, new_heads_endpoint=server.path)
+            publish = server.publish
+        else:
+            blockchain, contract = make_blockchain(provider)
+            publish = lambda block: None  # noqa
+        blockchain.poll_interval = 0.5
+        blockchain.start()
+        try:
+            blockchain.wait_sync()
+            if name == 'subscription':
+                assert blockchain.new_heads.connected.wait(5)
+            n_requests = sum(provider.calls.values())
+            gevent.sleep(1)
+            idle_requests = sum(provider.calls.values()) - n_requests
+            results[name] = (
+                measure_event_latency(provider, blockchain, contract, publish),
+                idle_requests
+            )
+        finally:
+            blockchain.stop()
+            blockchain.join(5)
+    server.stop()
+
+    log.info('event to state latency: polling every 0.5s %fs (%d requests/s idle), '
+             'new block subscription %fs (%d requests/s idle)',
+             results['polling'][0], results['polling'][1],
+             results['subscription'][0], results['subscription'][1])
+    assert results['subscription'][0] < 0.1
+    assert results['subscription'][0] < results['polling'][0]
+    assert results['subscription'][1] == 0
+
+
+def test_reorg_rollback():
+    provider = FakeRPCProvider(block_number=1000)
+    blockchain, contract = make_blockchain(provider)
+    cm = blockchain.cm
+    senders = [to_checksum_address('0x%040x' % (i + 1)) for i in range(3)]
+    channel = dict(_receiver_address=RECEIVER_ADDRESS)
+    provider.add_log(contract, 'ChannelCreated', 900, _deposit=10,
+                     _sender_address=senders[0], **channel)
+    provider.block_number = 1000
+    sync(blockchain)
+    assert cm.channels == {(senders[0], 900): 10}
+
+    # one new block per update
+    provider.add_log(contract, 'ChannelCreated', 1001, _deposit=10,
+                     _sender_address=senders[1], **channel)
+    blockchain._update()
+    provider.add_log(contract, 'ChannelToppedUp', 1002, _open_block_number=900,
+                     _added_deposit=5, _sender_address=senders[0], **channel)
+    blockchain._update()
+    provider.add_log(contract, 'ChannelCreated', 1003, _deposit=10,
+                     _sender_address=senders[2], **channel)
+    blockchain._update()
+    assert set(cm.unconfirmed_channels) == {(senders[1], 1001), (senders[2], 1003)}
+    assert len(cm.unconfirmed_topups) == 1
+    assert len(blockchain.unconfirmed_logs) == 3
+
+    # blocks after 1001 are replaced, the topup is mined again in 1005
+    provider.reorg(1001, 1004)
+    n_requests = provider.calls['eth_getBlockByNumber']
+    blockchain._update()
+    # the head, and the remembered blocks 1003, 1002, 1001
+    assert provider.calls['eth_getBlockByNumber'] - n_requests <= 4 + 2
+    assert cm.n_resets == 0
+    assert set(cm.unconfirmed_channels) == {(senders[1], 1001)}
+    assert cm.unconfirmed_topups == {}
+    assert cm.state.unconfirmed_head_number == 1004
+    assert cm.state.unconfirmed_head_hash == blockchain.web3.eth.getBlock(1004).hash
+
+    provider.add_log(contract, 'ChannelToppedUp', 1005, _open_block_number=900,
+                     _added_deposit=5, _sender_address=senders[0], **channel)
+    blockchain._update()
+    assert len(cm.unconfirmed_topups) == 1
+    for _ in range(N_CONFIRMATIONS):
+        provider.block_number += 1
+        blockchain._update()
+    assert cm.channels == {(senders[0], 900): 15, (senders[1], 1001): 10}
+    assert cm.unconfirmed_channels == {}
+    assert len(blockchain.unconfirmed_logs) == 0
+
+    # without remembered blocks, e.g. after a restart, all unconfirmed events are reset
+    blockchain.block_hashes.clear()
+    provider.reorg(provider.block_number - 2, provider.block_number)
+    blockchain._update()
+    assert cm.n_resets == 1
+    assert cm.state.unconfirmed_head_number == provider.block_number
+
+
+def test_promote_buffered_events():
+    provider = FakeRPCProvider(block_number=1000)
+    blockchain, contract = make_blockchain(provider)
+    cm = blockchain.cm
+    sync(blockchain)
+
+    def new_block(i):
+        sender = to_checksum_address('0x%040x' % (i + 1))
+        provider.add_log(contract, 'ChannelCreated', provider.block_number + 1, _deposit=10,
+                         _sender_address=sender, _receiver_address=RECEIVER_ADDRESS)
+        blockchain._update()
+
+    n_requests = provider.calls['eth_getLogs']
+    for i in range(20):
+        new_block(i)
+    # every event is fetched once, while it's unconfirmed
+    assert provider.calls['eth_getLogs'] - n_requests == 20
+    assert len(cm.channels) == 20 - N_CONFIRMATIONS
+    assert len(cm.unconfirmed_channels) == N_CONFIRMATIONS
+
+    # after a restart, the confirmed range is fetched until the buffer covers it
+    blockchain, contract = make_blockchain(provider)
+    blockchain.cm = cm
+    blockchain.wait_sync_event.set()
+    n_requests = provider.calls['eth_getLogs']
+    for i in range(20, 40):
+        new_block(i)
+    assert provider.calls['eth_getLogs'] - n_requests == 20 + N_CONFIRMATIONS
+    assert len(cm.channels) == 40 - N_CONFIRMATIONS
+    assert len(cm.unconfirmed_channels) == N_CONFIRMATIONS
+
+
+@pytest.fixture
+def http_server():
+    server = FakeHTTPServer(FakeRPCProvider(block_number=1000))
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_rpc_batch(http_server):
+    provider = http_server.provider
+    web3 = Web3(HTTPProvider(http_server.url))
+    _, contract = make_blockchain(provider)
+    add_channels(provider, contract, [100, 200])
+    query = LogQuery(contract, ['ChannelCreated', 'ChannelToppedUp'])
+
+    batch = RPCBatch(web3)
+    assert batch.is_batched
+    batch.block_number()
+    batch.get_block(100)
+    batch.get_block(2000)
+    batch.get_logs(query, 0, 150)
+    block_number, block, missing_block, logs = batch.send()
+    assert http_server.batch_sizes == [4]
+    assert block_number == 1000
+    assert block.hash == web3.eth.getBlock(100).hash
+    assert missing_block is None
+    assert [log['event'] for log in logs] == ['ChannelCreated', 'ChannelToppedUp']
+    assert logs == query.get_logs(0, 150)
+    assert len(batch) == 0
+
+    # the node refuses the query, like web3 does
+    provider.max_results = 1
+    batch.get_logs(query, 0, 150)
+    with pytest.raises(ValueError):
+        batch.send()
+
+    # nodes without eth_getLogs are queried with log filters
+    provider.max_results = None
+    provider.supports_get_logs = False
+    batch.get_logs(query, 150, 250)
+    assert [log['blockNumber'] for log in batch.send()[0]] == [200, 200]
+
+
+def test_batched_update(http_server):
+    provider = http_server.provider
+    blockchain, contract = make_blockchain(HTTPProvider(http_server.url))
+    sync(blockchain)
+    http_server.n_requests = 0
+    for i in range(10):
+        add_channels(provider, contract, [provider.block_number + 1])
+        blockchain._update()
+    # one batch for the head and the reorg check, one for the logs and new heads
+    assert http_server.n_requests == 2 * 10
+    assert len(blockchain.cm.channels) == 10 - N_CONFIRMATIONS
+    assert blockchain.cm.state.unconfirmed_head_hash == decode_hex(provider.block_hash(1010))
+
+
+def test_channel_infos(http_server):
+    provider = http_server.provider
+    _, contract = make_blockchain(provider)
+    channel_ids = [
+        (to_checksum_address('0x%040x' % (i + 1)), RECEIVER_ADDRESS, 100 + i)
+        for i in range(250)
+    ]
+    for i, channel_id in enumerate(channel_ids[::2]):
+        provider.set_call_result(contract, 'getChannelInfo', channel_id,
+                                 [b'\x01' * 32, 10 + i, 0, 0, i])
+
+    http_contract = Web3(HTTPProvider(http_server.url)).eth.contract(
+        address=CONTRACT_ADDRESS,
+        abi=contract.abi
+    )
+    channel_infos = get_channel_infos(http_contract, channel_ids, block_identifier=1000,
+                                      batch_size=100, concurrency=2)
+    assert sorted(http_server.batch_sizes) == [50, 100, 100]
+    assert channel_infos[channel_ids[2]] == (b'\x01' * 32, 11, 0, 0, 1)
+    assert channel_infos[channel_ids[1]] is None
+    assert len([info for info in channel_infos.values() if info is not None]) == 125
+
+    # the same without batches
+    assert get_channel_infos(contract, channel_ids) == channel_infos
+
+    # failed calls aren't mistaken for channels that don't exist
+    provider.call_error = {'code': -32000, 'message': 'header not found'}
+    for channel_contract in (http_contract, contract):
+        with pytest.raises(ValueError):
+            get_channel_infos(channel_contract, channel_ids[:3])
+
+
+def test_close_requested(http_server):
+    provider = http_server.provider
+    blockchain, contract = make_blockchain(HTTPProvider(http_server.url))
+    senders = [to_checksum_address('0x%040x' % (i + 1)) for i in range(3)]
+    for i, sender in enumerate(senders):
+        provider.add_log(contract, 'ChannelCreated', 100, _deposit=10,
+                         _sender_address=sender, _receiver_address=RECEIVER_ADDRESS)
+        provider.add_log(contract, 'ChannelCloseRequested', 200, _open_block_number=100,
+                         _balance=i, _sender_address=sender,
+                         _receiver_address=RECEIVER_ADDRESS)
+    # the last channel has been settled already
+    for sender in senders[:2]:
+        provider.set_call_result(contract, 'getChannelInfo',
+                                 [sender, RECEIVER_ADDRESS, 100], [b'\x01' * 32, 10, 300, 0, 0])
+    provider.block_number = 1000
+    sync(blockchain)
+    cm = blockchain.cm
+    assert cm.close_requests == {(senders[0], 100): (0, 300), (senders[1], 100): (1, 300)}
+    assert cm.force_closed == [(senders[2], 100)]
+    # the channel info is read with one request
+    assert provider.calls['eth_call'] == 3
+    assert 3 in http_server.batch_sizes
+
+
+def test_sync_from_event_cache(tmpdir):
+    provider = FakeRPCProvider(block_number=0)
+    filename = str(tmpdir.join('events.db'))
+    blockchain, contract = make_blockchain(provider)
+    blocks = list(range(1000, 200 * 1000, 1000))
+    add_channels(provider, contract, blocks)
+    provider.block_number = 300 * 1000
+    blockchain.event_cache = EventCache(filename, contract, n_confirmations=N_CONFIRMATIONS)
+    sync(blockchain)
+    assert len(blockchain.cm.channels) == len(blocks)
+
+    # another component sharing the cache only queries the blocks after the cached ones
+    provider.block_number += 10
+    blockchain, contract = make_blockchain(provider)
+    blockchain.event_cache = EventCache(filename, contract, n_confirmations=N_CONFIRMATIONS)
+    n_queries = provider.calls['eth_getLogs']
+    sync(blockchain)
+    # only the new blocks for the cache, the unconfirmed head is moved to the current block
+    assert provider.calls['eth_getLogs'] - n_queries == 1
+    assert blockchain.cm.state.confirmed_head_number == provider.block_number - N_CONFIRMATIONS
+    assert blockchain.cm.state.unconfirmed_head_number == provider.block_number
+    assert len(blockchain.cm.channels) == len(blocks)
+    assert all(deposit == 15 for deposit in blockchain.cm.channels.values())
+
+
+def test_shared_watcher_sync_from_event_cache(tmpdir):
+    keys = ['0x' + '%02x' % (0x21 + i) * 32 for i in range(2)]
+    receivers = [privkey_to_addr(key) for key in keys]
+    provider = FakeRPCProvider(block_number=0)
+    web3 = Web3(provider)
+    _, contract = make_blockchain(provider)
+    token_contract = web3.eth.contract(
+        address=TOKEN_ADDRESS,
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+    add_channels(provider, contract, [1000, 2000], receivers[0])
+    add_channels(provider, contract, [1500], receivers[1])
+    provider.block_number = 300 * 1000
+    event_cache = EventCache(str(tmpdir.join('events.db')), contract,
+                             n_confirmations=N_CONFIRMATIONS)
+    watcher = SharedBlockchain(web3, contract, N_CONFIRMATIONS, event_cache=event_cache)
+    watcher.sync_start_block = 0
+    # the heads are relayed to the channel managers themselves
+    cms = [
+        ChannelManager(web3, contract, token_contract, key, state_filename=':memory:',
+                       n_confirmations=N_CONFIRMATIONS, blockchain=watcher)
+        for key in keys
+    ]
+    sync(watcher)
+    assert [len(cm.channels) for cm in cms] == [2, 1]
+    assert all(c.deposit == 15 for cm in cms for c in cm.channels.values())
+    for cm in cms:
+        assert cm.state.confirmed_head_number == provider.block_number - N_CONFIRMATIONS
+        assert cm.state.unconfirmed_head_number == provider.block_number
+
+
+def test_shared_watcher():
+    receivers = [to_checksum_address('0x%040x' % (0xc0 + i)) for i in range(3)]
+    provider = FakeRPCProvider(block_number=10 * 1000)
+    web3 = Web3(provider)
+    _, contract = make_blockchain(provider)
+    add_channels(provider, contract, [100, 200], receivers[0])
+    add_channels(provider, contract, [150], receivers[1])
+    # not watched
+    add_channels(provider, contract, [120], receivers[2])
+
+    def make_watcher(cms):
+        watcher = SharedBlockchain(web3, contract, N_CONFIRMATIONS)
+        watcher.sync_start_block = 0
+        for cm in cms:
+            cm.channel_manager_contract = contract
+            watcher.add_channel_manager(cm)
+        return watcher
+
+    cms = [ChannelManagerStub(receiver) for receiver in receivers[:2]]
+    watcher = make_watcher(cms)
+    sync(watcher)
+    assert sorted(cms[0].channels.values()) == [15, 15]
+    assert list(cms[1].channels.values()) == [15]
+    for cm in cms:
+        assert cm.state.confirmed_head_number == provider.block_number - N_CONFIRMATIONS
+    # one log query per range for all receivers
+    n_get_logs = provider.calls['eth_getLogs']
+    provider.calls.clear()
+    blockchain = Blockchain(web3, contract, ChannelManagerStub(receivers[0]), N_CONFIRMATIONS)
+    blockchain.sync_start_block = 0
+    sync(blockchain)
+    assert provider.calls['eth_getLogs'] == n_get_logs
+
+    # a new receiver joins, the watcher resumes from its head without relaying
+    # the events twice to the others
+    provider.block_number += 1000
+    add_channels(provider, contract, [10500], receivers[1])
+    cms.append(ChannelManagerStub(receivers[2]))
+    watcher = make_watcher(cms)
+    assert watcher.cm.state.confirmed_head_number is None
+    sync(watcher)
+    assert len(cms[0].topups) == 2
+    assert len(cms[1].topups) == 2
+    assert len(cms[2].topups) == 1
+    for cm in cms:
+        assert cm.state.confirmed_head_number == provider.block_number - N_CONFIRMATIONS
+
+
+def test_shared_watcher_reorg():
+    receivers = [to_checksum_address('0x%040x' % (0xc0 + i)) for i in range(2)]
+    provider = FakeRPCProvider(block_number=1000)
+    web3 = Web3(provider)
+    _, contract = make_blockchain(provider)
+    cms = [ChannelManagerStub(receiver) for receiver in receivers]
+    watcher = SharedBlockchain(web3, contract, N_CONFIRMATIONS)
+    watcher.sync_start_block = 0
+    for cm in cms:
+        cm.channel_manager_contract = contract
+        watcher.add_channel_manager(cm)
+    sync(watcher)
+
+    for i, receiver in enumerate(receivers):
+        provider.add_log(contract, 'ChannelCreated', 1001 + i, _deposit=10,
+                         _sender_address=to_checksum_address('0x%040x' % (i + 1)),
+                         _receiver_address=receiver)
+        watcher._update()
+    provider.block_number += 1
+    watcher._update()
+    for cm in cms:
+        assert len(cm.unconfirmed_channels) == 1
+        assert cm.state.unconfirmed_head_number == 1003
+
+    # the unconfirmed heads of all channel managers are rolled back
+    n_resets = [cm.n_resets for cm in cms]
+    provider.reorg(1001, 1001)
+    watcher._update()
+    assert len(cms[0].unconfirmed_channels) == 1
+    assert cms[1].unconfirmed_channels == {}
+    assert [cm.n_resets for cm in cms] == n_resets
+    for cm in cms:
+        assert cm.state.unconfirmed_head_number == 1001
+        assert cm.state.unconfirmed_head_hash == web3.eth.getBlock(1001).hash
+
+
+def test_shared_watcher_relays_unconfirmed_head():
+    receivers = [to_checksum_address('0x%040x' % (0xc0 + i)) for i in range(2)]
+    provider = FakeRPCProvider(block_number=1000)
+    web3 = Web3(provider)
+    _, contract = make_blockchain(provider)
+    cms = [ChannelManagerStub(receiver) for receiver in receivers]
+    # the second channel manager is ahead
+    cms[1].state.update_sync_state(confirmed_head_number=900, confirmed_head_hash=b'\x01' * 32,
+                                   unconfirmed_head_number=900,
+                                   unconfirmed_head_hash=b'\x01' * 32)
+    cms[0].state.update_sync_state(confirmed_head_number=800, confirmed_head_hash=b'\x02' * 32,
+                                   unconfirmed_head_number=800,
+                                   unconfirmed_head_hash=b'\x02' * 32)
+    watcher = SharedBlockchain(web3, contract, N_CONFIRMATIONS, sync_chunk_size=103,
+                               sync_concurrency=1)
+    for cm in cms:
+        cm.channel_manager_contract = contract
+        watcher.add_channel_manager(cm)
+    watcher._update()
+    assert watcher.cm.state.confirmed_head_number == 898
+    # the confirmed head is kept until the watcher catches up, the unconfirmed one moves
+    assert cms[1].state.confirmed_head_number == 900
+    assert cms[1].state.unconfirmed_head_number == 903
+    assert cms[0].state.confirmed_head_number == 898
+    sync(watcher)
+    for cm in cms:
+        assert cm.state.confirmed_head_number == 1000 - N_CONFIRMATIONS
+        assert cm.state.unconfirmed_head_number == 1000
+
+
+def test_shared_watcher_stop():
+    keys = ['0x' + '%02x' % (0x21 + i) * 32 for i in range(2)]
+    provider = FakeRPCProvider(block_number=1000)
+    web3 = Web3(provider)
+    _, contract = make_blockchain(provider)
+    token_contract = web3.eth.contract(
+        address=TOKEN_ADDRESS,
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+    watcher = SharedBlockchain(web3, contract, N_CONFIRMATIONS)
+    cms = [
+        ChannelManager(web3, contract, token_contract, key, state_filename=':memory:',
+                       n_confirmations=N_CONFIRMATIONS, blockchain=watcher)
+        for key in keys
+    ]
+    for cm in cms:
+        cm.start()
+        cm.join(5)
+    assert watcher.wait_sync_event.wait(5)
+
+    # the watcher keeps running for the remaining channel manager
+    cms[0].stop()
+    assert watcher.running
+    assert list(watcher.channel_managers) == [cms[1].receiver]
+    cms[1].stop()
+    assert not watcher.running
+    assert watcher.dead
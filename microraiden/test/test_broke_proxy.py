@@ -25,6 +25,8 @@ def test_cheating_client(
     )
     tx_hash = web3.eth.sendRawTransaction(tx)
     wait_for_transaction(tx_hash)
+    # the paywall reads the balance from the background health snapshot
+    doggo_proxy.channel_manager.blockchain.refresh_health()
     response = session.get(http_doggo_url)
     # proxy is expected to return 502 - it has no funds
     assert response.status_code == 502
@@ -36,6 +38,8 @@ def test_cheating_client(
     )
     tx_hash = web3.eth.sendRawTransaction(tx)
     wait_for_transaction(tx_hash)
+    # the paywall reads the balance from the background health snapshot
+    doggo_proxy.channel_manager.blockchain.refresh_health()
     response = session.get(http_doggo_url)
     # now it should proceed normally
     assert response.status_code == 200
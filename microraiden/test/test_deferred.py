@@ -0,0 +1,267 @@
+import copy
+import time
+import logging
+import datetime
+
+from eth_utils import encode_hex
+from flask import Flask, request
+from web3 import Web3
+
+from microraiden import HTTPHeaders as header
+from microraiden.channel_manager import (
+    BalanceProofVerifier,
+    Channel,
+    ChannelManager,
+    ChannelState,
+    DeferredVerifier,
+    RiskBudget
+)
+from microraiden.constants import (
+    CONTRACT_METADATA,
+    CHANNEL_MANAGER_ABI_NAME,
+    CHANNEL_MANAGER_CONTRACT_VERSION,
+    TOKEN_ABI_NAME
+)
+from microraiden.proxy.resources.paywall_decorator import Paywall
+from microraiden.proxy.resources.request_data import RequestData
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.utils import privkey_to_addr, sign_balance_proof, to_checksum_address
+
+log = logging.getLogger(__name__)
+
+SENDER_PRIVATE_KEY = '0xa0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0'
+SENDER_ADDR = privkey_to_addr(SENDER_PRIVATE_KEY)
+OTHER_PRIVATE_KEY = '0xc2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2c2'
+OTHER_ADDR = privkey_to_addr(OTHER_PRIVATE_KEY)
+RECEIVER_PRIVATE_KEY = '0xb1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1'
+RECEIVER_ADDR = privkey_to_addr(RECEIVER_PRIVATE_KEY)
+CONTRACT_ADDR = to_checksum_address('0x' + 'aa' * 20)
+OPEN_BLOCK_NUMBER = 315123
+
+
+class ChannelManagerStub(object):
+    """Holds the channel state the DeferredVerifier commits to."""
+
+    def __init__(self, deposit: int, senders=(SENDER_ADDR,)):
+        self._channels = {}
+        for sender in senders:
+            channel = Channel(RECEIVER_ADDR, sender, deposit, OPEN_BLOCK_NUMBER)
+            channel.state = ChannelState.OPEN
+            self._channels[sender, OPEN_BLOCK_NUMBER] = channel
+        self.verifier = BalanceProofVerifier(RECEIVER_ADDR, CONTRACT_ADDR)
+        self.closed = []
+
+    @property
+    def channels(self):
+        # like ChannelManagerState, return fresh objects
+        return {key: copy.copy(c) for key, c in self._channels.items()}
+
+    def commit_payment(self, sender, open_block_number, balance, signature):
+        c = self._channels[sender, open_block_number]
+        c.balance = balance
+        c.last_signature = signature
+
+    def force_close_channel(self, sender, open_block_number):
+        self.closed.append((sender, open_block_number))
+
+
+def sign(balance: int, privkey: str = SENDER_PRIVATE_KEY) -> str:
+    return encode_hex(sign_balance_proof(
+        privkey, RECEIVER_ADDR, OPEN_BLOCK_NUMBER, balance, CONTRACT_ADDR
+    ))
+
+
+def pay(cm: ChannelManagerStub, deferred: DeferredVerifier, balance: int, signature: str):
+    channel = deferred.apply_pending(cm.channels[SENDER_ADDR, OPEN_BLOCK_NUMBER])
+    return deferred.defer(channel, balance, signature)
+
+
+def test_risk_budget():
+    budget = RiskBudget(10)
+    assert budget.can_extend(SENDER_ADDR, 10)
+    assert not budget.can_extend(SENDER_ADDR, 11)
+    budget.extend(SENDER_ADDR, 6)
+    assert not budget.can_extend(SENDER_ADDR, 5)
+    assert budget.total_exposure == 6
+    budget.settle(SENDER_ADDR, 4)
+    assert budget.can_extend(SENDER_ADDR, 8)
+    assert budget.write_off(SENDER_ADDR) == 2
+    assert budget.metrics() == {
+        'limit': 10,
+        'total_exposure': 0,
+        'max_exposure': 0,
+        'senders_at_risk': 0,
+        'written_off': 2
+    }
+
+
+def test_deferred_payments():
+    cm = ChannelManagerStub(100)
+    deferred = DeferredVerifier(cm, credit_limit=3)
+
+    assert pay(cm, deferred, 1, sign(1))
+    assert pay(cm, deferred, 3, sign(3))
+    # credit limit exceeded
+    assert not pay(cm, deferred, 4, sign(4))
+    assert deferred.budget.exposure[SENDER_ADDR] == 3
+
+    # nothing is committed before the proofs have been verified
+    channel = cm.channels[SENDER_ADDR, OPEN_BLOCK_NUMBER]
+    assert channel.balance == 0
+    assert deferred.apply_pending(channel).balance == 3
+    assert channel.last_signature == sign(3)
+
+    deferred.flush()
+    channel = cm.channels[SENDER_ADDR, OPEN_BLOCK_NUMBER]
+    assert channel.balance == 3
+    assert channel.last_signature == sign(3)
+    assert deferred.latest == {}
+    assert pay(cm, deferred, 6, sign(6))
+
+    metrics = deferred.metrics()
+    assert metrics['verified'] == 2
+    assert metrics['pending'] == 1
+    assert metrics['total_exposure'] == 3
+    assert metrics['invalid'] == 0
+
+
+def test_invalid_deferred_payment():
+    cm = ChannelManagerStub(100)
+    deferred = DeferredVerifier(cm, credit_limit=10)
+
+    assert pay(cm, deferred, 1, sign(1))
+    assert pay(cm, deferred, 2, sign(2, OTHER_PRIVATE_KEY))
+    assert pay(cm, deferred, 3, sign(3))
+    deferred.flush()
+
+    # only the invalid proof is dropped, the sender is only claimed by the request
+    channel = cm.channels[SENDER_ADDR, OPEN_BLOCK_NUMBER]
+    assert channel.balance == 3
+    assert channel.last_signature == sign(3)
+    assert not deferred.is_blacklisted(SENDER_ADDR)
+    assert cm.closed == []
+
+    metrics = deferred.metrics()
+    assert metrics['invalid'] == 1
+    assert metrics['written_off'] == 1
+    assert metrics['total_exposure'] == 0
+    assert metrics['pending'] == 0
+
+
+def test_forged_deferred_payment():
+    cm = ChannelManagerStub(100)
+    deferred = DeferredVerifier(cm, credit_limit=10)
+    assert pay(cm, deferred, 1, sign(1))
+    deferred.flush()
+
+    # a forged proof is applied until it has been verified
+    assert pay(cm, deferred, 5, '0x' + '44' * 65)
+    channel = cm.channels[SENDER_ADDR, OPEN_BLOCK_NUMBER]
+    assert deferred.apply_pending(channel).balance == 5
+    deferred.flush()
+
+    # back to the last verified proof, the sender can pay again
+    channel = deferred.apply_pending(cm.channels[SENDER_ADDR, OPEN_BLOCK_NUMBER])
+    assert channel.balance == 1
+    assert channel.last_signature == sign(1)
+    assert deferred.latest == {}
+    assert pay(cm, deferred, 2, sign(2))
+    deferred.flush()
+    assert cm.channels[SENDER_ADDR, OPEN_BLOCK_NUMBER].balance == 2
+    assert not deferred.is_blacklisted(SENDER_ADDR)
+    assert cm.closed == []
+
+
+def test_proof_of_another_channel():
+    cm = ChannelManagerStub(100, senders=(SENDER_ADDR, OTHER_ADDR))
+    deferred = DeferredVerifier(cm, credit_limit=10)
+    assert pay(cm, deferred, 1, sign(1))
+    # proof of the other sender's own channel, sent for the sender's channel
+    assert pay(cm, deferred, 2, sign(2, OTHER_PRIVATE_KEY))
+    deferred.flush()
+
+    # the preceding proof of the channel is served again
+    channel = deferred.apply_pending(cm.channels[SENDER_ADDR, OPEN_BLOCK_NUMBER])
+    assert channel.balance == 1
+    assert not deferred.is_blacklisted(SENDER_ADDR)
+    assert deferred.is_blacklisted(OTHER_ADDR)
+    assert cm.closed == [(OTHER_ADDR, OPEN_BLOCK_NUMBER)]
+
+
+def test_paywall_headers():
+    provider = FakeRPCProvider(block_number=1000)
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=CONTRACT_ADDR,
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+    token_contract = web3.eth.contract(
+        address=to_checksum_address('0x' + 'bb' * 20),
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+    cm = ChannelManager(web3, contract, token_contract, RECEIVER_PRIVATE_KEY,
+                        state_filename=':memory:', deferred_credit_limit=10)
+    channel = Channel(RECEIVER_ADDR, SENDER_ADDR, 100, OPEN_BLOCK_NUMBER)
+    channel.confirmed = True
+    channel.state = ChannelState.OPEN
+    channel.balance = 1
+    channel.last_signature = sign(1)
+    cm.state.set_channel(channel)
+    paywall = Paywall(cm)
+
+    def check(balance: int):
+        request_headers = {
+            header.SENDER_ADDRESS: SENDER_ADDR,
+            header.OPEN_BLOCK: str(OPEN_BLOCK_NUMBER),
+            header.BALANCE: str(balance),
+            header.BALANCE_SIGNATURE: sign(balance)
+        }
+        with Flask(__name__).test_request_context('/', headers=request_headers):
+            return paywall.paywall_check(1, RequestData(request.headers))
+
+    paywalled, _ = check(2)
+    assert not paywalled
+    # the accepted proof isn't sent back before it has been verified
+    paywalled, headers = check(2)
+    assert paywalled
+    assert headers[header.SENDER_BALANCE] == 1
+    assert headers[header.BALANCE_SIGNATURE] == sign(1)
+    assert not check(3)[0]
+
+    cm.deferred_verifier.flush()
+    paywalled, headers = check(3)
+    assert paywalled
+    assert headers[header.SENDER_BALANCE] == 3
+    assert headers[header.BALANCE_SIGNATURE] == sign(3)
+
+
+def test_deferred_latency():
+    n = 100
+    signatures = [sign(i + 1) for i in range(n)]
+
+    # synchronous path: each proof is verified before it's accepted
+    cm = ChannelManagerStub(n)
+    t_start = time.time()
+    for i, signature in enumerate(signatures):
+        cm.verifier.recover_sender(OPEN_BLOCK_NUMBER, i + 1, bytes.fromhex(signature[2:]))
+        cm.commit_payment(SENDER_ADDR, OPEN_BLOCK_NUMBER, i + 1, signature)
+    t_sync = time.time() - t_start
+
+    # deferred path: proofs are accepted right away and verified in a batch
+    cm = ChannelManagerStub(n)
+    deferred = DeferredVerifier(cm, credit_limit=n, batch_size=n)
+    t_start = time.time()
+    for i, signature in enumerate(signatures):
+        assert pay(cm, deferred, i + 1, signature)
+    t_accept = time.time() - t_start
+    deferred.flush()
+    t_deferred = time.time() - t_start
+
+    assert cm.channels[SENDER_ADDR, OPEN_BLOCK_NUMBER].balance == n
+    assert deferred.n_verified == n
+    log.info("%d payments: synchronous %s (%f / s), deferred acceptance %s (%f / s), "
+             "deferred total %s",
+             n, datetime.timedelta(seconds=t_sync), n / t_sync,
+             datetime.timedelta(seconds=t_accept), n / max(t_accept, 1e-9),
+             datetime.timedelta(seconds=t_deferred))
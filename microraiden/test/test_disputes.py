@@ -0,0 +1,176 @@
+import pytest
+import rlp
+from ethereum.exceptions import InsufficientBalance
+from eth_utils import decode_hex, encode_hex, keccak
+from ethereum.transactions import Transaction
+from web3 import Web3
+
+from microraiden.channel_manager import Channel, ChannelManager, ChannelState
+from microraiden.config import NETWORK_CFG
+from microraiden.constants import (
+    CONTRACT_METADATA,
+    CHANNEL_MANAGER_ABI_NAME,
+    CHANNEL_MANAGER_CONTRACT_VERSION,
+    TOKEN_ABI_NAME
+)
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.utils import privkey_to_addr, sign_close, to_checksum_address
+
+RECEIVER_PRIVKEY = '0x' + '12' * 32
+RECEIVER_ADDRESS = privkey_to_addr(RECEIVER_PRIVKEY)
+CONTRACT_ADDRESS = to_checksum_address('0x' + 'aa' * 20)
+SENDERS = [to_checksum_address('0x' + '%02x' % i * 20) for i in range(1, 4)]
+
+
+@pytest.fixture
+def provider():
+    provider = FakeRPCProvider(block_number=1000)
+    # EIP155 signatures of the crypto utils support one byte chain ids only
+    provider.network_id = '3'
+    return provider
+
+
+def make_channel_manager(provider, state_filename=':memory:'):
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=CONTRACT_ADDRESS,
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+    token_contract = web3.eth.contract(
+        address=to_checksum_address('0x' + 'bb' * 20),
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+    return ChannelManager(web3, contract, token_contract, RECEIVER_PRIVKEY,
+                          state_filename=state_filename)
+
+
+@pytest.fixture
+def channel_manager(provider):
+    cm = make_channel_manager(provider)
+    for sender in SENDERS:
+        channel = Channel(RECEIVER_ADDRESS, sender, 10, 500)
+        channel.confirmed = True
+        channel.state = ChannelState.OPEN
+        channel.balance = 5
+        channel.last_signature = '0x' + '33' * 65
+        cm.state.set_channel(channel)
+    return cm
+
+
+def sent_transactions(provider):
+    return [
+        (encode_hex(keccak(decode_hex(raw_tx))), rlp.decode(decode_hex(raw_tx), Transaction))
+        for raw_tx in provider.raw_transactions
+    ]
+
+
+def test_challenge_order(provider, channel_manager):
+    cm = channel_manager
+    for sender, settle_block_number in zip(SENDERS, [1030, 1010, 1020]):
+        cm.event_channel_close_requested(sender, 500, 3, settle_block_number)
+        assert cm.channels[sender, 500].is_closed
+    assert provider.raw_transactions == []
+    assert cm.disputes.metrics()['queued'] == 3
+
+    cm.disputes.process()
+    sent = sent_transactions(provider)
+    # earliest deadline first
+    challenge_data = [
+        cm.channel_manager_contract.encodeABI('cooperativeClose', args=[
+            RECEIVER_ADDRESS, 500, 5, decode_hex('0x' + '33' * 65),
+            sign_close(RECEIVER_PRIVKEY, sender, 500, 5, CONTRACT_ADDRESS)
+        ]) for sender in (SENDERS[1], SENDERS[2], SENDERS[0])
+    ]
+    assert [encode_hex(tx.data) for _, tx in sent] == challenge_data
+    assert cm.disputes.metrics()['next_deadline_slack'] == 10
+
+    provider.mine_transaction(sent[0][0], 1002)
+    cm.state.del_channel(SENDERS[2], 500)
+    cm.disputes.process()
+    metrics = cm.disputes.metrics()
+    assert metrics['queued'] == 1
+    assert metrics['challenged'] == 1
+    assert metrics['min_slack'] == 8
+
+
+def test_resubmit_challenge(provider, channel_manager):
+    cm = channel_manager
+    cm.event_channel_close_requested(SENDERS[0], 500, 3, 1010)
+    # a valid close request isn't disputed
+    cm.event_channel_close_requested(SENDERS[1], 500, 5, 1010)
+    cm.disputes.process()
+    provider.block_number = 1002
+    cm.disputes.process()
+    assert len(provider.raw_transactions) == 1
+
+    # not mined within `resubmit_blocks`
+    provider.block_number = 1003
+    cm.disputes.process()
+    (first_txhash, first), (txhash, replacement) = sent_transactions(provider)
+    assert replacement.nonce == first.nonce
+    assert replacement.gasprice == int(NETWORK_CFG.GAS_PRICE * cm.disputes.gas_price_bump)
+
+    provider.mine_transaction(first_txhash, 1004)
+    cm.disputes.process()
+    metrics = cm.disputes.metrics()
+    assert metrics['resubmitted'] == 1
+    assert metrics['challenged'] == 1
+    assert metrics['queued'] == 0
+
+
+def test_missed_deadline(provider, channel_manager):
+    cm = channel_manager
+    cm.event_channel_close_requested(SENDERS[0], 500, 3, 1005)
+    cm.disputes.process()
+    provider.block_number = 1005
+    cm.disputes.process()
+    metrics = cm.disputes.metrics()
+    assert metrics['missed'] == 1
+    assert metrics['queued'] == 0
+
+
+def test_restore_disputes(provider, channel_manager, tmpdir):
+    state_filename = str(tmpdir.join('state.db'))
+    cm = make_channel_manager(provider, state_filename)
+    for channel in channel_manager.channels.values():
+        cm.state.set_channel(channel)
+    cm.event_channel_close_requested(SENDERS[0], 500, 3, 1010)
+    cm.event_channel_close_requested(SENDERS[1], 500, 3, 1020)
+    # sent on shutdown
+    cm.disputes.flush()
+    sent = sent_transactions(provider)
+    assert len(sent) == 2
+    provider.mine_transaction(sent[0][0], 1002)
+    cm.disputes.process()
+    assert cm.state.disputes == [(SENDERS[1], 500, 1020)]
+    # restarted before the remaining challenge has been mined
+    cm.lock_state.release()
+    cm.state.conn.close()
+
+    cm = make_channel_manager(provider, state_filename)
+    cm.disputes.restore()
+    assert cm.disputes.metrics()['queued'] == 1
+    cm.disputes.process()
+    txhash, challenge = sent_transactions(provider)[2]
+    assert challenge.data == sent[1][1].data
+    provider.mine_transaction(txhash, 1004)
+    cm.disputes.process()
+    assert cm.disputes.metrics()['challenged'] == 1
+    assert cm.state.disputes == []
+    cm.lock_state.release()
+
+
+def test_insufficient_balance(provider, channel_manager, monkeypatch):
+    cm = channel_manager
+    web3 = cm.disputes.web3
+
+    def send_raw_transaction(raw_tx):
+        raise InsufficientBalance('insufficient balance')
+    monkeypatch.setattr(web3.eth, 'sendRawTransaction', send_raw_transaction)
+    cm.event_channel_close_requested(SENDERS[0], 500, 3, 1010)
+    cm.disputes.process()
+    assert cm.blockchain.insufficient_balance
+    # retried, the dispute is kept
+    assert cm.disputes.metrics()['queued'] == 1
+    assert cm.state.disputes == [(SENDERS[0], 500, 1010)]
@@ -0,0 +1,99 @@
+import pytest
+from flask import Flask, request
+from web3 import Web3
+
+from microraiden import HTTPHeaders as header
+from microraiden.channel_manager import Channel, ChannelManager, ChannelState
+from microraiden.constants import (
+    CONTRACT_METADATA,
+    CHANNEL_MANAGER_ABI_NAME,
+    CHANNEL_MANAGER_CONTRACT_VERSION,
+    TOKEN_ABI_NAME
+)
+from microraiden.exceptions import NoOpenChannel, SyncInProgress
+from microraiden.proxy.resources import ChannelManagementSync
+from microraiden.proxy.resources.paywall_decorator import Paywall
+from microraiden.proxy.resources.request_data import RequestData
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.utils import privkey_to_addr, to_checksum_address
+
+RECEIVER_PRIVKEY = '0x' + '12' * 32
+SENDER_ADDRESS = to_checksum_address('0x' + '01' * 20)
+
+
+def make_channel_manager(fast_start_max_lag=None):
+    provider = FakeRPCProvider(block_number=1000)
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=to_checksum_address('0x' + 'aa' * 20),
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+    token_contract = web3.eth.contract(
+        address=to_checksum_address('0x' + 'bb' * 20),
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+    cm = ChannelManager(web3, contract, token_contract, RECEIVER_PRIVKEY,
+                        state_filename=':memory:', fast_start_max_lag=fast_start_max_lag)
+    # state of an earlier run
+    channel = Channel(privkey_to_addr(RECEIVER_PRIVKEY), SENDER_ADDRESS, 10, 500)
+    channel.confirmed = True
+    channel.state = ChannelState.OPEN
+    cm.state.set_channel(channel)
+    cm.state.update_sync_state(
+        confirmed_head_number=940,
+        unconfirmed_head_number=950
+    )
+    return cm
+
+
+def test_fast_start():
+    cm = make_channel_manager(fast_start_max_lag=100)
+    assert not cm.is_synced()
+    # the node hasn't been queried yet
+    assert cm.sync_lag is None
+    with pytest.raises(SyncInProgress):
+        cm.get_channel(SENDER_ADDRESS, 500)
+
+    cm.blockchain.current_block = 1000
+    assert cm.sync_lag == 50
+    assert cm.get_channel(SENDER_ADDRESS, 500).deposit == 10
+    # the channel may have been opened in the blocks that haven't been synced
+    unknown_sender = to_checksum_address('0x' + '02' * 20)
+    with pytest.raises(SyncInProgress):
+        cm.get_channel(unknown_sender, 990)
+
+    # the client is asked to retry
+    paywall = Paywall(cm)
+    request_headers = {
+        header.SENDER_ADDRESS: unknown_sender,
+        header.OPEN_BLOCK: '990',
+        header.BALANCE: '1',
+        header.BALANCE_SIGNATURE: '0x' + '00' * 65
+    }
+    with Flask(__name__).test_request_context('/', headers=request_headers):
+        paywalled, headers = paywall.paywall_check(1, RequestData(request.headers))
+    assert paywalled
+    assert headers[header.INSUF_CONFS] == '1'
+
+    # the state is too stale
+    cm.blockchain.current_block = 1100
+    with pytest.raises(SyncInProgress):
+        cm.get_channel(SENDER_ADDRESS, 500)
+    status, code = ChannelManagementSync(cm).get()
+    assert code == 503
+    assert status['synced'] is False
+    assert status['lag'] == 150
+
+    cm.blockchain.wait_sync_event.set()
+    status, code = ChannelManagementSync(cm).get()
+    assert code == 200
+    with pytest.raises(NoOpenChannel):
+        cm.get_channel(unknown_sender, 990)
+
+
+def test_no_fast_start():
+    cm = make_channel_manager()
+    with pytest.raises(NoOpenChannel):
+        cm.get_channel(to_checksum_address('0x' + '02' * 20), 990)
+    assert cm.get_channel(SENDER_ADDRESS, 500).deposit == 10
@@ -0,0 +1,166 @@
+import time
+import logging
+
+import gevent
+import pytest
+from flask import Flask
+from web3 import Web3
+
+from microraiden.channel_manager import ChannelManager, SharedBlockchain
+from microraiden.channel_manager.health import HealthSnapshot
+from microraiden.constants import (
+    CONTRACT_METADATA,
+    CHANNEL_MANAGER_ABI_NAME,
+    CHANNEL_MANAGER_CONTRACT_VERSION,
+    PROXY_BALANCE_LIMIT,
+    TOKEN_ABI_NAME
+)
+from microraiden.proxy.resources.paywall_decorator import Paywall
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.utils import privkey_to_addr, to_checksum_address
+
+log = logging.getLogger(__name__)
+
+RECEIVER_PRIVKEY = '0x' + '12' * 32
+RECEIVER_ADDRESS = privkey_to_addr(RECEIVER_PRIVKEY)
+
+
+class FreeResource(object):
+    @staticmethod
+    def price():
+        return 0
+
+
+def serve(path):
+    return 'OK', 200
+
+
+@pytest.fixture
+def provider():
+    provider = FakeRPCProvider(block_number=1000)
+    provider.balances[RECEIVER_ADDRESS.lower()] = PROXY_BALANCE_LIMIT * 2
+    return provider
+
+
+@pytest.fixture
+def channel_manager(provider):
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=to_checksum_address('0x' + 'aa' * 20),
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+    token_contract = web3.eth.contract(
+        address=to_checksum_address('0x' + 'bb' * 20),
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+    provider.set_call_result(token_contract, 'balanceOf', [RECEIVER_ADDRESS], [5])
+    return ChannelManager(web3, contract, token_contract, RECEIVER_PRIVKEY,
+                          state_filename=':memory:')
+
+
+def test_health_snapshot(provider, channel_manager):
+    blockchain = channel_manager.blockchain
+    assert channel_manager.health == HealthSnapshot()
+    # unknown until the node has been read
+    assert channel_manager.node_online() is None
+    assert blockchain.health_due()
+
+    blockchain.refresh_health()
+    health = channel_manager.health
+    assert channel_manager.node_online() is True
+    assert health.eth_balance == PROXY_BALANCE_LIMIT * 2
+    assert health.token_balance == 5
+    assert health.block_number == 1000
+
+    blockchain.health_interval = 60
+    assert not blockchain.health_due()
+    blockchain.health_interval = 0
+    assert blockchain.health_due()
+
+
+def measure_paywall(paywall, n_requests):
+    app = Flask(__name__)
+    t_start = time.time()
+    for _ in range(n_requests):
+        with app.test_request_context('/'):
+            assert paywall.access(FreeResource(), serve).status_code == 200
+    return n_requests / (time.time() - t_start)
+
+
+def test_paywall_reads_snapshot(provider, channel_manager):
+    paywall = Paywall(channel_manager)
+    channel_manager.blockchain.refresh_health()
+    provider.latency = 0.01
+    n_requests = 50
+
+    n_calls = sum(provider.calls.values())
+    rps = measure_paywall(paywall, n_requests)
+    # the node isn't queried on the request path
+    assert sum(provider.calls.values()) == n_calls
+
+    # compared to reading the balance from the node on every request
+    def access_live(resource, method):
+        channel_manager.get_eth_balance()
+        return Paywall.access(paywall, resource, method)
+    paywall.access = access_live
+    live_rps = measure_paywall(paywall, n_requests)
+    log.info('paywall: %d requests/s with the health snapshot, %d requests/s with '
+             'a %.3fs balance query per request', rps, live_rps, provider.latency)
+    assert rps > 5 * live_rps
+
+    # requests are refused once the snapshot shows a low balance
+    del paywall.access
+    provider.balances[RECEIVER_ADDRESS.lower()] = 0
+    channel_manager.blockchain.refresh_health()
+    with Flask(__name__).test_request_context('/'):
+        assert paywall.access(FreeResource(), serve)[1] == 502
+
+
+def test_unknown_balance(provider, channel_manager):
+    contract = channel_manager.channel_manager_contract
+    watcher = SharedBlockchain(channel_manager.blockchain.web3, contract, n_confirmations=1)
+    # nothing to read without receivers
+    watcher.refresh_health()
+    assert watcher.health == HealthSnapshot()
+
+    watcher.add_channel_manager(channel_manager)
+    watcher.refresh_health()
+    other_health = watcher.get_health(to_checksum_address('0x' + 'cc' * 20))
+    assert other_health.online is True
+    assert other_health.eth_balance is None
+
+    # a receiver whose balance hasn't been read yet is served
+    channel_manager.blockchain = watcher
+    watcher.healths.clear()
+    paywall = Paywall(channel_manager)
+    with Flask(__name__).test_request_context('/'):
+        assert paywall.access(FreeResource(), serve).status_code == 200
+
+
+def test_health_read_error(provider, channel_manager):
+    paywall = Paywall(channel_manager)
+    # served before the first read
+    with Flask(__name__).test_request_context('/'):
+        assert paywall.access(FreeResource(), serve).status_code == 200
+
+    blockchain = channel_manager.blockchain
+    blockchain.poll_interval = 0.01
+    provider.call_error = {'code': -32000, 'message': 'execution error'}
+    blockchain.start()
+    try:
+        blockchain.wait_sync()
+        # the sync goes on with the node marked offline
+        assert not blockchain.dead
+        assert channel_manager.node_online() is False
+        with Flask(__name__).test_request_context('/'):
+            assert paywall.access(FreeResource(), serve)[1] == 502
+
+        provider.call_error = None
+        with gevent.Timeout(5):
+            while not channel_manager.node_online():
+                gevent.sleep(0.01)
+        assert channel_manager.health.token_balance == 5
+    finally:
+        blockchain.stop()
+        blockchain.join()
@@ -0,0 +1,225 @@
+import logging
+import time
+
+import pytest
+from web3 import Web3
+from web3.middleware.pythonic import log_entry_formatter
+from web3.utils.events import get_event_data
+
+import microraiden.utils.contract
+from microraiden.constants import CONTRACT_METADATA, CHANNEL_MANAGER_ABI_NAME
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.exceptions import EventCacheMismatch
+from microraiden.utils import EventCache, LogQuery, get_events, get_logs, is_same_address
+from microraiden.utils.event_decoder import get_event_decoders
+
+log = logging.getLogger(__name__)
+
+CONTRACT_ADDRESS = '0x' + 'aa' * 20
+SENDER_ADDRESS = '0x' + 'bb' * 20
+RECEIVER_ADDRESS = '0x' + 'cc' * 20
+OTHER_RECEIVER_ADDRESS = '0x' + 'dd' * 20
+EVENTS = ['ChannelCreated', 'ChannelToppedUp', 'ChannelCloseRequested', 'ChannelSettled']
+
+
+@pytest.fixture
+def provider():
+    return FakeRPCProvider()
+
+
+@pytest.fixture
+def contract(provider):
+    web3 = Web3(provider)
+    return web3.eth.contract(
+        address=Web3.toChecksumAddress(CONTRACT_ADDRESS),
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+
+
+@pytest.fixture
+def channel_logs(provider, contract):
+    channel = dict(_sender_address=SENDER_ADDRESS, _receiver_address=RECEIVER_ADDRESS)
+    provider.add_log(contract, 'ChannelCreated', 10, _deposit=10, **channel)
+    provider.add_log(contract, 'ChannelCreated', 10, _deposit=7, _sender_address=SENDER_ADDRESS,
+                     _receiver_address=OTHER_RECEIVER_ADDRESS)
+    provider.add_log(contract, 'ChannelToppedUp', 10, _open_block_number=10, _added_deposit=5,
+                     **channel)
+    provider.add_log(contract, 'ChannelCloseRequested', 12, _open_block_number=10, _balance=3,
+                     **channel)
+    provider.add_log(contract, 'ChannelSettled', 11, _open_block_number=4, _balance=1,
+                     _receiver_tokens=1, **channel)
+
+
+def test_get_events(provider, contract, channel_logs):
+    logs = get_events(
+        contract,
+        EVENTS,
+        from_block=0,
+        to_block='latest',
+        argument_filters={'_receiver_address': RECEIVER_ADDRESS}
+    )
+    assert [log['event'] for log in logs] == [
+        'ChannelCreated', 'ChannelToppedUp', 'ChannelSettled', 'ChannelCloseRequested'
+    ]
+    assert all(is_same_address(log['args']['_receiver_address'], RECEIVER_ADDRESS)
+               for log in logs)
+    assert logs[0]['args']['_deposit'] == 10
+    assert logs[1]['args']['_added_deposit'] == 5
+    assert logs[3]['args']['_balance'] == 3
+    assert [log['blockNumber'] for log in logs] == [10, 10, 11, 12]
+
+    # a single stateless request
+    assert provider.calls['eth_getLogs'] == 1
+    assert provider.calls['eth_newFilter'] == 0
+
+    logs = get_logs(contract, 'ChannelCreated', from_block=11, to_block='latest')
+    assert logs == []
+    logs = get_logs(contract, 'ChannelCreated', from_block=0, to_block=10)
+    assert len(logs) == 2
+
+
+def test_log_query_topics(contract):
+    query = LogQuery(contract, EVENTS, {'_receiver_address': RECEIVER_ADDRESS})
+    assert len(query.topics[0]) == len(EVENTS)
+    assert query.topics[1] is None
+    assert query.topics[2] == '0x' + '00' * 12 + 'cc' * 20
+
+    with pytest.raises(AssertionError):
+        # _open_block_number isn't indexed in ChannelCreated
+        LogQuery(contract, EVENTS, {'_open_block_number': 10})
+
+
+def test_log_filter_fallback(provider, contract, channel_logs):
+    provider.supports_get_logs = False
+    for _ in range(2):
+        logs = get_events(contract, EVENTS, argument_filters={
+            '_receiver_address': RECEIVER_ADDRESS
+        })
+        assert len(logs) == 4
+    # eth_getLogs is only tried once
+    assert provider.calls['eth_getLogs'] == 1
+    assert provider.calls['eth_newFilter'] == 2
+    assert provider.calls['eth_uninstallFilter'] == 2
+    assert provider.filters == {}
+
+    # other nodes still use eth_getLogs
+    other_provider = FakeRPCProvider()
+    other_contract = Web3(other_provider).eth.contract(address=contract.address, abi=contract.abi)
+    get_events(other_contract, EVENTS)
+    assert other_provider.calls['eth_getLogs'] == 1
+    assert other_provider.calls['eth_newFilter'] == 0
+
+    # eth_getLogs is tried again after a while
+    provider.supports_get_logs = True
+    microraiden.utils.contract._log_filter_providers[provider] -= (
+        microraiden.utils.contract.LOG_FILTER_RETRY_INTERVAL + 1
+    )
+    assert len(get_events(contract, EVENTS)) == 5
+    assert provider.calls['eth_getLogs'] == 2
+    assert provider.calls['eth_newFilter'] == 2
+    assert provider not in microraiden.utils.contract._log_filter_providers
+
+
+def test_log_query_errors_are_not_fallbacks(provider, contract, channel_logs):
+    provider.max_results = 1
+    with pytest.raises(ValueError):
+        get_events(contract, EVENTS)
+    assert provider.calls['eth_newFilter'] == 0
+    assert not microraiden.utils.contract._is_method_not_found(ValueError('block not found'))
+    assert not microraiden.utils.contract._is_method_not_found(
+        ValueError({'code': -32000, 'message': 'filter not found'})
+    )
+    assert microraiden.utils.contract._is_method_not_found(
+        ValueError({'code': -32601, 'message': 'the method eth_getLogs does not exist'})
+    )
+
+
+def test_event_decoders(provider, contract, channel_logs):
+    decoders = get_event_decoders(contract)
+    assert get_event_decoders(contract) is decoders
+    assert {decoder.name for decoder in decoders.values()} >= set(EVENTS)
+
+    query = LogQuery(contract, EVENTS)
+    for raw_log in provider.logs:
+        raw_log = log_entry_formatter(raw_log)
+        decoded = query.decode(raw_log)
+        event_data = get_event_data(decoders[raw_log['topics'][0].hex()].abi, raw_log)
+        assert decoded['args'] == event_data['args']
+        assert decoded['event'] == event_data['event']
+        assert decoded['blockNumber'] == event_data['blockNumber']
+
+
+def test_decode_throughput(provider, contract, channel_logs):
+    n_logs = 100000
+    recorded = [log_entry_formatter(raw_log) for raw_log in provider.logs]
+    raw_logs = [recorded[i % len(recorded)] for i in range(n_logs)]
+    query = LogQuery(contract, EVENTS)
+
+    t_start = time.time()
+    decoded = [query.decode(raw_log) for raw_log in raw_logs]
+    rate = n_logs / (time.time() - t_start)
+
+    # get_event_data is measured on a sample, it's too slow for all the logs
+    n_sample = 2000
+    t_start = time.time()
+    sample = [
+        get_event_data(query.event_abis[raw_log['topics'][0].hex()], raw_log)
+        for raw_log in raw_logs[:n_sample]
+    ]
+    web3_rate = n_sample / (time.time() - t_start)
+    assert [d['args'] for d in decoded[:n_sample]] == [d['args'] for d in sample]
+    log.info('decoded %d logs/s, %d logs/s with get_event_data', rate, web3_rate)
+    assert rate > 5 * web3_rate
+
+
+def summarize(logs):
+    return [(log['event'], dict(log['args']), log['blockNumber'], log['logIndex'])
+            for log in logs]
+
+
+def test_event_cache(provider, contract, channel_logs, tmpdir):
+    filename = str(tmpdir.join('events.db'))
+    query = LogQuery(contract, EVENTS + ['ChannelWithdraw'])
+    provider.block_number = 100
+    cache = EventCache(filename, contract, n_confirmations=5, chunk_size=30)
+    assert cache.update() == 95
+    assert provider.calls['eth_getLogs'] == 4
+    assert cache.n_logs == 5
+    assert summarize(cache.get_logs()) == summarize(query.get_logs(0, 95))
+    logs = cache.get_logs(receiver=OTHER_RECEIVER_ADDRESS)
+    assert [log['args']['_deposit'] for log in logs] == [7]
+    logs = cache.get_logs(sender=SENDER_ADDRESS, event_names=['ChannelCloseRequested'])
+    assert [log['blockNumber'] for log in logs] == [12]
+    assert cache.get_logs(from_block=11, to_block=11)[0]['event'] == 'ChannelSettled'
+
+    # only new blocks are queried
+    channel = dict(_sender_address=SENDER_ADDRESS, _receiver_address=RECEIVER_ADDRESS)
+    provider.add_log(contract, 'ChannelCreated', 97, _deposit=3, **channel)
+    provider.block_number = 110
+    n_queries = provider.calls['eth_getLogs']
+    assert cache.update() == 105
+    assert provider.calls['eth_getLogs'] == n_queries + 1
+    assert cache.n_logs == 6
+
+    # the file can be shared
+    cache = EventCache(filename, contract, n_confirmations=5, chunk_size=30)
+    assert cache.update() == 105
+    assert provider.calls['eth_getLogs'] == n_queries + 1
+    assert cache.n_logs == 6
+    with pytest.raises(EventCacheMismatch):
+        EventCache(filename, provider_contract(provider, OTHER_RECEIVER_ADDRESS))
+
+    # events of reorganized blocks are dropped, blocks up to the fork point are kept
+    provider.reorg(96, 112)
+    provider.add_log(contract, 'ChannelCreated', 98, _deposit=4, **channel)
+    assert cache.update() == 107
+    assert provider.calls['eth_getLogs'] == n_queries + 2
+    assert [log['args']['_deposit'] for log in cache.get_logs(from_block=96)] == [4]
+    assert summarize(cache.get_logs()) == summarize(query.get_logs(0, 107))
+
+
+def provider_contract(provider, address):
+    return Web3(provider).eth.contract(
+        address=Web3.toChecksumAddress(address),
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
@@ -0,0 +1,164 @@
+import pytest
+from eth_utils import decode_hex, encode_hex
+from web3 import Web3
+
+from microraiden.channel_manager import ChannelManager
+from microraiden.constants import (
+    CONTRACT_METADATA,
+    CHANNEL_MANAGER_ABI_NAME,
+    CHANNEL_MANAGER_CONTRACT_VERSION,
+    TOKEN_ABI_NAME
+)
+from microraiden.exceptions import InsufficientConfirmations, NoOpenChannel
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.utils import privkey_to_addr, sign_balance_proof, to_checksum_address
+
+RECEIVER_PRIVKEY = '0x' + '12' * 32
+RECEIVER_ADDRESS = privkey_to_addr(RECEIVER_PRIVKEY)
+SENDER_PRIVKEY = '0x' + '34' * 32
+SENDER_ADDRESS = privkey_to_addr(SENDER_PRIVKEY)
+CONTRACT_ADDRESS = to_checksum_address('0x' + 'aa' * 20)
+TOKEN_ADDRESS = to_checksum_address('0x' + 'bb' * 20)
+
+
+@pytest.fixture
+def provider():
+    return FakeRPCProvider(block_number=1000)
+
+
+@pytest.fixture
+def channel_manager(provider):
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=CONTRACT_ADDRESS,
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+    token_contract = web3.eth.contract(
+        address=TOKEN_ADDRESS,
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+    return ChannelManager(web3, contract, token_contract, RECEIVER_PRIVKEY,
+                          state_filename=':memory:', pending_credit_limit=5)
+
+
+def sign(open_block_number: int, balance: int) -> str:
+    return encode_hex(sign_balance_proof(
+        SENDER_PRIVKEY, RECEIVER_ADDRESS, open_block_number, balance, CONTRACT_ADDRESS
+    ))
+
+
+def pay(cm: ChannelManager, open_block_number: int, balance: int):
+    return cm.register_payment(SENDER_ADDRESS, open_block_number, balance,
+                               sign(open_block_number, balance))
+
+
+def test_pending_channel(provider, channel_manager):
+    cm = channel_manager
+    watcher = cm.pending_watcher
+    erc223_data = decode_hex(SENDER_ADDRESS) + decode_hex(RECEIVER_ADDRESS)
+    txhash = provider.add_pending_transaction(
+        cm.token_contract, 'transfer', [CONTRACT_ADDRESS, 10, erc223_data], SENDER_ADDRESS)
+    # channels to other receivers are ignored
+    other_txhash = provider.add_pending_transaction(
+        cm.channel_manager_contract, 'createChannel', [SENDER_ADDRESS, 10], SENDER_ADDRESS)
+    watcher.poll()
+    assert list(watcher.transactions) == [txhash]
+
+    # not mined yet
+    with pytest.raises(NoOpenChannel):
+        cm.get_channel(SENDER_ADDRESS, 1001)
+
+    provider.mine_transaction(txhash, 1001)
+    provider.mine_transaction(other_txhash, 1001)
+    with pytest.raises(NoOpenChannel):
+        cm.get_channel(SENDER_ADDRESS, 1002)
+    channel = cm.get_channel(SENDER_ADDRESS, 1001)
+    assert channel.deposit == 10
+    assert pay(cm, 1001, 3) == (SENDER_ADDRESS, 3)
+    # the event is synced, but not confirmed yet
+    cm.unconfirmed_event_channel_opened(SENDER_ADDRESS, 1001, 10)
+    assert pay(cm, 1001, 5) == (SENDER_ADDRESS, 2)
+    with pytest.raises(InsufficientConfirmations):
+        pay(cm, 1001, 6)
+    assert watcher.metrics()['total_exposure'] == 5
+
+    cm.event_channel_opened(SENDER_ADDRESS, 1001, 10)
+    assert watcher.channels == {}
+    assert watcher.transactions == {}
+    assert cm.channels[SENDER_ADDRESS, 1001].balance == 5
+    assert pay(cm, 1001, 8) == (SENDER_ADDRESS, 3)
+    metrics = watcher.metrics()
+    assert metrics['total_exposure'] == 0
+    assert metrics['confirmed'] == 1
+    assert metrics['lost'] == 0
+
+
+def test_pending_channel_reverted(provider, channel_manager):
+    cm = channel_manager
+    watcher = cm.pending_watcher
+    txhash = provider.add_pending_transaction(
+        cm.channel_manager_contract, 'createChannel', [RECEIVER_ADDRESS, 10], SENDER_ADDRESS)
+    failed_txhash = provider.add_pending_transaction(
+        cm.channel_manager_contract, 'createChannel', [RECEIVER_ADDRESS, 20], SENDER_ADDRESS)
+    watcher.poll()
+    provider.mine_transaction(failed_txhash, 1001, status=0)
+    with pytest.raises(NoOpenChannel):
+        cm.get_channel(SENDER_ADDRESS, 1001)
+    assert list(watcher.transactions) == [txhash]
+
+    provider.mine_transaction(txhash, 1001)
+    pay(cm, 1001, 4)
+    cm.unconfirmed_event_channel_opened(SENDER_ADDRESS, 1001, 10)
+    cm.revert_unconfirmed_channel_opened(SENDER_ADDRESS, 1001)
+    with pytest.raises(NoOpenChannel):
+        cm.get_channel(SENDER_ADDRESS, 1001)
+    metrics = watcher.metrics()
+    assert metrics['total_exposure'] == 0
+    assert metrics['written_off'] == 4
+    assert metrics['lost'] == 1
+
+
+def test_receipt_lookups(provider, channel_manager):
+    cm = channel_manager
+    watcher = cm.pending_watcher
+    txhashes = [
+        provider.add_pending_transaction(cm.channel_manager_contract, 'createChannel',
+                                         [RECEIVER_ADDRESS, 10 + i], SENDER_ADDRESS)
+        for i in range(10)
+    ]
+    watcher.poll()
+    assert len(watcher.transactions) == 10
+    # a request for a channel that doesn't exist is cheap
+    n_lookups = provider.calls['eth_getTransactionReceipt']
+    with pytest.raises(NoOpenChannel):
+        cm.get_channel(SENDER_ADDRESS, 1001)
+    assert provider.calls['eth_getTransactionReceipt'] - n_lookups == watcher.max_receipt_lookups
+
+
+def test_expired_channel_confirmed_late(provider, channel_manager):
+    cm = channel_manager
+    watcher = cm.pending_watcher
+    txhash = provider.add_pending_transaction(
+        cm.channel_manager_contract, 'createChannel', [RECEIVER_ADDRESS, 10], SENDER_ADDRESS)
+    watcher.poll()
+    provider.mine_transaction(txhash, 1001)
+    pay(cm, 1001, 4)
+
+    watcher.expiry = 0
+    watcher.expire()
+    with pytest.raises(NoOpenChannel):
+        cm.get_channel(SENDER_ADDRESS, 1001)
+    metrics = watcher.metrics()
+    assert metrics['total_exposure'] == 0
+    assert metrics['written_off'] == 4
+    assert metrics['expired_channels'] == 1
+
+    # the payments aren't lost if the event is only late
+    cm.event_channel_opened(SENDER_ADDRESS, 1001, 10)
+    channel = cm.channels[SENDER_ADDRESS, 1001]
+    assert channel.balance == 4
+    assert channel.last_signature == sign(1001, 4)
+    metrics = watcher.metrics()
+    assert metrics['expired_channels'] == 0
+    assert metrics['recovered'] == 1
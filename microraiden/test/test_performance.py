@@ -2,10 +2,15 @@ import time
 import logging
 import datetime
 
+import eth_utils
 import gevent
 from eth_utils import encode_hex
+from werkzeug.datastructures import EnvironHeaders
 
 from microraiden import Session
+from microraiden.proxy.resources import request_data
+from microraiden.proxy.resources.request_data import RequestData
+from microraiden.utils import clear_address_cache
 
 log = logging.getLogger(__name__)
 
@@ -60,3 +65,37 @@ def test_receiver_validation(channel_manager, client, wait_for_blocks):
     t_diff = time.time() - t_start
     log.info("%d balance proofs verified in %s (%f / s)",
              n, datetime.timedelta(seconds=t_diff), n / t_diff)
+
+
+def test_request_data_parsing(monkeypatch):
+    n = 1000
+    addresses = ['0x' + 'aa' * 20, '0x' + 'bb' * 20, '0x' + 'cc' * 20]
+    headers = EnvironHeaders({
+        'HTTP_RDN_CONTRACT_ADDRESS': addresses[0],
+        'HTTP_RDN_RECEIVER_ADDRESS': addresses[1],
+        'HTTP_RDN_SENDER_ADDRESS': addresses[2],
+        'HTTP_RDN_OPEN_BLOCK': '315123',
+        'HTTP_RDN_BALANCE': '8'
+    })
+
+    def parse():
+        t_start = time.time()
+        for _ in range(n):
+            data = RequestData(headers)
+        assert data.sender_address == eth_utils.to_checksum_address(addresses[2])
+        return time.time() - t_start
+
+    # the same parsing, with the addresses normalized by eth_utils directly
+    with monkeypatch.context() as m:
+        m.setattr(request_data, 'is_address', eth_utils.is_address)
+        m.setattr(request_data, 'to_checksum_address', eth_utils.to_checksum_address)
+        t_uncached = parse()
+
+    clear_address_cache()
+    t_cached = parse()
+
+    log.info("%d requests: parsing without address cache %s (%f / s), "
+             "with address cache %s (%f / s)",
+             n, datetime.timedelta(seconds=t_uncached), n / t_uncached,
+             datetime.timedelta(seconds=t_cached), n / t_cached)
+    assert t_cached < t_uncached
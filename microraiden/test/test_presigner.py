@@ -0,0 +1,98 @@
+import time
+
+import pytest
+from web3 import Web3
+
+from microraiden.client.channel import Channel
+from microraiden.client.context import Context
+from microraiden.constants import CONTRACT_METADATA, CHANNEL_MANAGER_ABI_NAME
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.utils import privkey_to_addr, to_checksum_address
+
+SENDER_PRIVKEY = '0x' + '34' * 32
+RECEIVER_ADDRESS = to_checksum_address('0x' + 'cc' * 20)
+CONTRACT_ADDRESS = to_checksum_address('0x' + 'aa' * 20)
+TOKEN_ADDRESS = to_checksum_address('0x' + 'bb' * 20)
+
+
+@pytest.fixture
+def context():
+    provider = FakeRPCProvider(block_number=1000)
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=CONTRACT_ADDRESS,
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'token', [], [TOKEN_ADDRESS])
+    return Context(SENDER_PRIVKEY, web3, CONTRACT_ADDRESS)
+
+
+def make_channel(context, deposit: int) -> Channel:
+    return Channel(
+        context,
+        privkey_to_addr(SENDER_PRIVKEY),
+        RECEIVER_ADDRESS,
+        block=500,
+        deposit=deposit
+    )
+
+
+def wait_for(condition, timeout=5):
+    t_end = time.time() + timeout
+    while not condition():
+        assert time.time() < t_end
+        time.sleep(0.01)
+
+
+def test_presigned_transfers(context):
+    channel = make_channel(context, deposit=100)
+    channel.enable_presigning(price=3, depth=4)
+    presigner = channel.presigner
+    try:
+        wait_for(lambda: len(presigner._signatures) == 4)
+        assert sorted(presigner._signatures) == [3, 6, 9, 12]
+
+        for balance in (3, 6, 9):
+            sig = channel.create_transfer(3)
+            assert channel.balance == balance
+            assert sig == channel.sign(balance)
+        assert presigner.hits == 3
+        assert presigner.misses == 0
+        assert channel.is_valid()
+
+        wait_for(lambda: 21 in presigner._signatures)
+        assert sorted(presigner._signatures) == [12, 15, 18, 21]
+    finally:
+        channel.disable_presigning()
+
+
+def test_unexpected_balance_invalidates(context):
+    channel = make_channel(context, deposit=100)
+    channel.enable_presigning(price=5, depth=2)
+    presigner = channel.presigner
+    try:
+        wait_for(lambda: len(presigner._signatures) == 2)
+        channel.create_transfer(7)
+        assert presigner.misses == 1
+        assert channel.is_valid()
+        wait_for(lambda: sorted(presigner._signatures) == [12, 17])
+        channel.create_transfer(5)
+        assert presigner.hits == 1
+        assert channel.is_valid()
+    finally:
+        channel.disable_presigning()
+
+
+def test_deposit_limit(context):
+    channel = make_channel(context, deposit=10)
+    channel.enable_presigning(price=4, depth=10)
+    presigner = channel.presigner
+    try:
+        wait_for(lambda: len(presigner._signatures) == 2)
+        time.sleep(0.1)
+        assert sorted(presigner._signatures) == [4, 8]
+        channel.deposit = 20
+        wait_for(lambda: len(presigner._signatures) == 5)
+        assert max(presigner._signatures) == 20
+    finally:
+        channel.disable_presigning()
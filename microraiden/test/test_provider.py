@@ -0,0 +1,86 @@
+import pytest
+import requests
+from web3 import Web3
+
+from microraiden.test.utils.fake_rpc import FakeHTTPServer, FakeRPCProvider
+from microraiden.utils import MultiHTTPProvider, RPCBatch
+
+
+@pytest.fixture
+def servers():
+    servers = [
+        FakeHTTPServer(FakeRPCProvider(block_number=1000, latency=latency))
+        for latency in [0.05, 0]
+    ]
+    for server in servers:
+        server.start()
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def offline_url():
+    server = FakeHTTPServer(FakeRPCProvider())
+    server.server_close()
+    return server.url
+
+
+def test_routing(servers, offline_url):
+    slow, fast = servers
+    provider = MultiHTTPProvider([offline_url, slow.url, fast.url], retry_interval=60)
+    web3 = Web3(provider)
+
+    # every node is tried once, then reads go to the fastest one
+    for _ in range(10):
+        assert web3.eth.blockNumber == 1000
+    assert slow.n_requests == 1
+    assert fast.n_requests == 9
+    assert provider.endpoint_uri == fast.url
+    metrics = provider.metrics()
+    assert metrics['current'] == fast.url
+    offline, slow_metrics, fast_metrics = metrics['endpoints']
+    assert offline['up'] is False
+    assert offline['errors'] == 1
+    assert offline['error_rate'] > 0
+    assert slow_metrics['latency'] > fast_metrics['latency']
+    assert fast_metrics['requests'] == 9
+    assert fast_metrics['error_rate'] == 0
+
+    # batches are routed the same way
+    batch = RPCBatch(web3)
+    assert batch.is_batched
+    batch.block_number()
+    batch.get_block(100)
+    block_number, block = batch.send()
+    assert block_number == 1000
+    assert block.number == 100
+    assert fast.batch_sizes == [2]
+
+    # failover to the remaining node
+    fast.stop()
+    assert web3.eth.blockNumber == 1000
+    assert slow.n_requests == 2
+    assert provider.endpoint_uri == slow.url
+    assert provider.metrics()['endpoints'][2]['up'] is False
+
+    slow.stop()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        web3.eth.blockNumber
+
+
+def test_transactions(servers, offline_url):
+    slow, fast = servers
+    raw_transaction = '0x' + '12' * 100
+    provider = MultiHTTPProvider([slow.url, fast.url, offline_url])
+    web3 = Web3(provider)
+    tx_hash = web3.eth.sendRawTransaction(raw_transaction)
+    assert slow.provider.raw_transactions == [raw_transaction]
+    assert fast.provider.raw_transactions == [raw_transaction]
+    assert provider.metrics()['endpoints'][2]['errors'] == 1
+
+    provider = MultiHTTPProvider([slow.url, fast.url], primary=slow.url)
+    web3 = Web3(provider)
+    assert web3.eth.sendRawTransaction(raw_transaction) == tx_hash
+    assert len(slow.provider.raw_transactions) == 2
+    assert len(fast.provider.raw_transactions) == 1
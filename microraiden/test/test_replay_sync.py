@@ -0,0 +1,62 @@
+import json
+
+from click.testing import CliRunner
+
+from microraiden.replay_sync import (
+    address_topic,
+    channel_manager_abi,
+    generate_logs,
+    main,
+    main_receiver,
+    replay
+)
+from microraiden.utils.event_decoder import make_event_decoders
+
+N_CHANNELS = 40
+
+
+def count_events(logs, receiver):
+    decoders = make_event_decoders(channel_manager_abi())
+    events = [
+        decoders[raw_log['topics'][0]].name for raw_log in logs
+        if raw_log['topics'][2] == address_topic(receiver)
+    ]
+    return len(events), events.count('ChannelCreated') - events.count('ChannelSettled')
+
+
+def test_generate_logs():
+    logs = generate_logs(N_CHANNELS, seed=1)
+    assert generate_logs(N_CHANNELS, seed=1) == logs
+    assert generate_logs(N_CHANNELS, seed=2) != logs
+    blocks = [(int(raw_log['blockNumber'], 16), int(raw_log['logIndex'], 16))
+              for raw_log in logs]
+    assert blocks == sorted(blocks)
+
+
+def test_replay():
+    logs = generate_logs(N_CHANNELS, seed=1, n_receivers=2)
+    receiver = main_receiver(logs)
+    n_events, n_open_channels = count_events(logs, receiver)
+    assert 0 < n_events < len(logs)
+
+    report = replay(logs, state_file=':memory:', chunk_size=500)
+    assert report['n_events'] == n_events
+    assert report['n_channels'] == n_open_channels
+    assert report['n_updates'] > 1
+    assert report['events_per_second'] > 0
+    assert report['rpc_time'] > 0
+    assert report['state_time'] > 0
+    assert report['peak_traced_memory'] is None
+
+
+def test_replay_cli(tmpdir):
+    logs_file = str(tmpdir.join('events.jsonl'))
+    runner = CliRunner()
+    result = runner.invoke(main, ['generate', '--channels', str(N_CHANNELS), logs_file])
+    assert result.exit_code == 0
+    result = runner.invoke(main, ['run', '--concurrency', '2', '--trace-memory', logs_file])
+    assert result.exit_code == 0, result.output
+    report = json.loads(result.output)
+    with open(logs_file) as f:
+        assert report['n_events'] == len(f.readlines())
+    assert report['peak_traced_memory'] > 0
@@ -0,0 +1,146 @@
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+from eth_utils import decode_hex
+from web3 import Web3
+
+from microraiden.channel_manager import ChannelManager
+from microraiden.channel_manager.snapshot import export_snapshot, verify_snapshot
+from microraiden.constants import (
+    CONTRACT_METADATA,
+    CHANNEL_MANAGER_ABI_NAME,
+    CHANNEL_MANAGER_CONTRACT_VERSION,
+    TOKEN_ABI_NAME
+)
+from microraiden.exceptions import InvalidSnapshot, SnapshotNotCanonical
+from microraiden.state_snapshot import main
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.utils import privkey_to_addr, to_checksum_address
+
+RECEIVER_PRIVKEY = '0x' + '12' * 32
+RECEIVER_ADDRESS = privkey_to_addr(RECEIVER_PRIVKEY)
+CONTRACT_ADDRESS = to_checksum_address('0x' + 'aa' * 20)
+SENDER_ADDRESS = to_checksum_address('0x' + '01' * 20)
+
+
+@pytest.fixture
+def provider():
+    return FakeRPCProvider(block_number=1000)
+
+
+def make_channel_manager(provider, state_filename, state_snapshot, n_confirmations=1):
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=CONTRACT_ADDRESS,
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+    token_contract = web3.eth.contract(
+        address=to_checksum_address('0x' + 'bb' * 20),
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+    return ChannelManager(web3, contract, token_contract, RECEIVER_PRIVKEY,
+                          state_filename=state_filename, state_snapshot=state_snapshot,
+                          n_confirmations=n_confirmations)
+
+
+def make_state(provider, filename=':memory:'):
+    """State synced up to block 950, with the confirmed head at block 940."""
+    cm = make_channel_manager(provider, filename, None, n_confirmations=10)
+    contract = cm.channel_manager_contract
+    channel = dict(_sender_address=SENDER_ADDRESS, _receiver_address=RECEIVER_ADDRESS)
+    provider.add_log(contract, 'ChannelCreated', 500, _deposit=10, **channel)
+    provider.block_number = 900
+    cm.blockchain.sync_start_block = 0
+    while not cm.blockchain.wait_sync_event.is_set():
+        cm.blockchain._update()
+    # unconfirmed
+    provider.add_log(contract, 'ChannelToppedUp', 944, _open_block_number=500,
+                     _added_deposit=5, **channel)
+    provider.add_log(contract, 'ChannelCreated', 945, _deposit=7, **channel)
+    provider.block_number = 950
+    cm.blockchain._update()
+    # a payment
+    channel = cm.channels[SENDER_ADDRESS, 500]
+    channel.balance = 4
+    channel.last_signature = '0x' + '33' * 65
+    cm.state.set_channel(channel)
+    assert cm.state.confirmed_head_number == 940
+    assert cm.unconfirmed_channels
+    assert channel.unconfirmed_topups
+    if filename != ':memory:':
+        cm.lock_state.release()
+    return cm.state
+
+
+def test_snapshot(provider, tmpdir):
+    state = make_state(provider)
+    # block hashes are stored as bytes by the sync
+    assert isinstance(state.confirmed_head_hash, bytes)
+    snapshot = export_snapshot(state, RECEIVER_PRIVKEY)
+    snapshot = json.loads(json.dumps(snapshot))
+    assert snapshot['confirmed_head_number'] == 940
+    assert snapshot['confirmed_head_hash'] == provider.block_hash(940)
+    assert len(snapshot['channels']) == 1
+
+    state_filename = str(tmpdir.join('state.db'))
+    cm = make_channel_manager(provider, state_filename, snapshot)
+    # the sync resumes from the checkpoint
+    assert cm.state.confirmed_head_number == 940
+    assert cm.state.unconfirmed_head_number == 940
+    assert cm.state.unconfirmed_head_hash == decode_hex(provider.block_hash(940))
+    assert cm.state.confirmed_head_hash == decode_hex(provider.block_hash(940))
+    assert cm.unconfirmed_channels == {}
+    channel = cm.channels[SENDER_ADDRESS, 500]
+    assert channel.deposit == 10
+    assert channel.balance == 4
+    assert channel.last_signature == '0x' + '33' * 65
+    assert channel.unconfirmed_topups == {}
+    cm.lock_state.release()
+
+    # an existing state file is used as is
+    cm.state.update_sync_state(confirmed_head_number=960)
+    cm = make_channel_manager(provider, state_filename, snapshot)
+    assert cm.state.confirmed_head_number == 960
+
+
+def test_invalid_snapshot(provider):
+    snapshot = export_snapshot(make_state(provider), RECEIVER_PRIVKEY)
+    verify_snapshot(snapshot, RECEIVER_ADDRESS, CONTRACT_ADDRESS)
+
+    tampered = json.loads(json.dumps(snapshot))
+    tampered['channels'][0]['balance'] = '1'
+    with pytest.raises(InvalidSnapshot):
+        make_channel_manager(provider, ':memory:', tampered)
+    with pytest.raises(InvalidSnapshot):
+        verify_snapshot(snapshot, to_checksum_address('0x' + '02' * 20), CONTRACT_ADDRESS)
+    with pytest.raises(InvalidSnapshot):
+        verify_snapshot(dict(snapshot, signature='0x12'), RECEIVER_ADDRESS, CONTRACT_ADDRESS)
+
+    # the checkpoint has been reorganized away
+    provider.reorg(900, 1000)
+    with pytest.raises(SnapshotNotCanonical):
+        make_channel_manager(provider, ':memory:', snapshot)
+
+
+def test_snapshot_cli(provider, tmpdir):
+    state_filename = str(tmpdir.join('state.db'))
+    make_state(provider, state_filename).conn.close()
+    key_path = str(tmpdir.join('key'))
+    with open(key_path, 'w') as f:
+        f.write(RECEIVER_PRIVKEY)
+    os.chmod(key_path, 0o600)
+    snapshot_path = str(tmpdir.join('snapshot.json'))
+
+    result = CliRunner().invoke(main, [
+        '--private-key', key_path,
+        '--state-file', state_filename,
+        snapshot_path
+    ])
+    assert result.exit_code == 0, result.output
+    with open(snapshot_path) as f:
+        snapshot = json.load(f)
+    verify_snapshot(snapshot, RECEIVER_ADDRESS, CONTRACT_ADDRESS)
+    assert snapshot['confirmed_head_hash'] == provider.block_hash(940)
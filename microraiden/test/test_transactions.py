@@ -0,0 +1,186 @@
+import gevent
+import pytest
+import rlp
+from eth_utils import decode_hex, encode_hex, keccak
+from ethereum.transactions import Transaction
+from web3 import Web3
+
+from microraiden.channel_manager import Channel, ChannelManager, ChannelState
+from microraiden.channel_manager.transactions import TransactionWorker
+from microraiden.constants import (
+    CONTRACT_METADATA,
+    CHANNEL_MANAGER_ABI_NAME,
+    CHANNEL_MANAGER_CONTRACT_VERSION,
+    TOKEN_ABI_NAME
+)
+from microraiden.test.utils.fake_rpc import FakeRPCProvider
+from microraiden.utils import (
+    privkey_to_addr,
+    sign_balance_proof,
+    to_checksum_address
+)
+
+RECEIVER_PRIVKEY = '0x' + '12' * 32
+RECEIVER_ADDRESS = privkey_to_addr(RECEIVER_PRIVKEY)
+CONTRACT_ADDRESS = to_checksum_address('0x' + 'aa' * 20)
+SENDERS = [to_checksum_address('0x' + '%02x' % i * 20) for i in range(1, 4)]
+
+
+@pytest.fixture
+def provider():
+    provider = FakeRPCProvider(block_number=1000)
+    # EIP155 signatures of the crypto utils support one byte chain ids only
+    provider.network_id = '3'
+    provider.transaction_counts[RECEIVER_ADDRESS.lower()] = 7
+    return provider
+
+
+@pytest.fixture
+def channel_manager(provider):
+    return make_channel_manager(provider)
+
+
+def make_channel_manager(provider, **kwargs):
+    web3 = Web3(provider)
+    contract = web3.eth.contract(
+        address=CONTRACT_ADDRESS,
+        abi=CONTRACT_METADATA[CHANNEL_MANAGER_ABI_NAME]['abi']
+    )
+    token_contract = web3.eth.contract(
+        address=to_checksum_address('0x' + 'bb' * 20),
+        abi=CONTRACT_METADATA[TOKEN_ABI_NAME]['abi']
+    )
+    provider.set_call_result(contract, 'version', [], [CHANNEL_MANAGER_CONTRACT_VERSION.encode()])
+    cm = ChannelManager(web3, contract, token_contract, RECEIVER_PRIVKEY,
+                        state_filename=':memory:', **kwargs)
+    for sender in SENDERS:
+        channel = Channel(RECEIVER_ADDRESS, sender, 10, 500)
+        channel.confirmed = True
+        channel.state = ChannelState.OPEN
+        channel.balance = 5
+        channel.last_signature = '0x' + '33' * 65
+        cm.state.set_channel(channel)
+    return cm
+
+
+def sent_transactions(provider):
+    return [
+        (encode_hex(keccak(decode_hex(raw_tx))), rlp.decode(decode_hex(raw_tx), Transaction))
+        for raw_tx in provider.raw_transactions
+    ]
+
+
+def test_close_channels(provider, channel_manager):
+    cm = channel_manager
+    for sender in SENDERS:
+        cm.close_channel(sender, 500)
+        assert cm.channels[sender, 500].is_closed
+    # closing twice doesn't send another transaction
+    cm.close_channel(SENDERS[0], 500)
+    assert provider.raw_transactions == []
+    assert cm.transactions.metrics()['queued'] == 3
+
+    cm.transactions.process()
+    sent = sent_transactions(provider)
+    assert [tx.nonce for _, tx in sent] == [7, 8, 9]
+    assert provider.calls['eth_getTransactionCount'] == 1
+    # challenges get the next nonce
+    cm.event_channel_close_requested(SENDERS[0], 500, 3, 1010)
+    cm.disputes.process()
+    assert sent_transactions(provider)[-1][1].nonce == 10
+
+    provider.mine_transaction(sent[0][0], 1001)
+    provider.mine_transaction(sent[1][0], 1001, status=0)
+    cm.transactions.process()
+    assert cm.transactions.metrics() == {
+        'queued': 0,
+        'unmined': 1,
+        'retrying': 1,
+        'sent': 3,
+        'mined': 1,
+        'failed': 1
+    }
+    assert cm.state.get_channel(SENDERS[0], 500).state == ChannelState.CLOSED
+    assert cm.state.get_channel(SENDERS[1], 500).state == ChannelState.CLOSE_PENDING
+    assert cm.state.get_channel(SENDERS[2], 500).state == ChannelState.CLOSE_PENDING
+
+
+def test_close_channel_send_error(provider, channel_manager):
+    cm = channel_manager
+    provider.send_error = {'code': -32000, 'message': 'nonce too low'}
+    cm.close_channel(SENDERS[0], 500)
+    cm.transactions.process()
+    assert cm.state.get_channel(SENDERS[0], 500).state == ChannelState.CLOSE_PENDING
+    assert cm.transactions.metrics()['failed'] == 1
+
+    # the nonce is read again
+    provider.send_error = None
+    provider.transaction_counts[RECEIVER_ADDRESS.lower()] = 9
+    cm.close_pending_channels()
+    cm.transactions.process()
+    assert [tx.nonce for _, tx in sent_transactions(provider)] == [9]
+
+
+def test_retry_failed_close(provider, channel_manager):
+    cm = channel_manager
+    cm.transactions.retry_interval = 0
+    cm.close_channel(SENDERS[0], 500)
+    for attempt in range(cm.transactions.max_attempts):
+        cm.transactions.process()
+        txhash, tx = sent_transactions(provider)[-1]
+        assert tx.nonce == 7 + attempt
+        provider.mine_transaction(txhash, 1001 + attempt, status=0)
+    cm.transactions.process()
+    # given up, closed again on restart
+    assert len(provider.raw_transactions) == cm.transactions.max_attempts
+    assert cm.transactions.metrics()['retrying'] == 0
+    assert cm.state.get_channel(SENDERS[0], 500).state == ChannelState.CLOSE_PENDING
+
+
+def test_restore_close_pending(provider, channel_manager):
+    cm = channel_manager
+    cm.close_channel(SENDERS[0], 500)
+    cm.close_channel(SENDERS[1], 500)
+    assert cm.channels[SENDERS[0], 500].state == ChannelState.CLOSE_PENDING
+    cm.transactions.process()
+    provider.mine_transaction(sent_transactions(provider)[0][0], 1001)
+    cm.transactions.process()
+    assert cm.state.get_channel(SENDERS[0], 500).state == ChannelState.CLOSED
+    # restarted before the second transaction has been mined
+    provider.transaction_counts[RECEIVER_ADDRESS.lower()] = 9
+    cm.transactions = TransactionWorker(cm, cm.transactions.web3)
+    cm.transactions.restore()
+    cm.transactions.process()
+    # a pending close isn't sent twice
+    cm.close_pending_channels()
+    cm.transactions.process()
+    txhash, tx = sent_transactions(provider)[-1]
+    assert len(provider.raw_transactions) == 3
+    assert tx.nonce == 9
+    provider.mine_transaction(txhash, 1002)
+    cm.transactions.process()
+    assert cm.state.pending_channels == {}
+
+
+def test_stop_sends_closes_of_producers(provider):
+    cm = make_channel_manager(provider, deferred_credit_limit=10)
+    signer_privkey = '0x' + '34' * 32
+    signer = privkey_to_addr(signer_privkey)
+    channel = Channel(RECEIVER_ADDRESS, signer, 10, 500)
+    channel.confirmed = True
+    channel.state = ChannelState.OPEN
+    channel.last_signature = '0x' + '33' * 65
+    cm.state.set_channel(channel)
+    # a proof of the signer's channel paid through another sender's channel
+    signature = encode_hex(sign_balance_proof(
+        signer_privkey, RECEIVER_ADDRESS, 500, 6, CONTRACT_ADDRESS
+    ))
+    assert cm.deferred_verifier.defer(cm.channels[SENDERS[0], 500], 6, signature)
+    cm.transactions.start()
+    cm.deferred_verifier.start()
+    gevent.sleep(0)
+    # the proof is rejected and the signer's channel closed while stopping
+    cm.stop()
+    assert cm.deferred_verifier.is_blacklisted(signer)
+    assert cm.transactions.metrics()['queued'] == 0
+    assert len(provider.raw_transactions) == 1
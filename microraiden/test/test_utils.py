@@ -1,6 +1,17 @@
 from typing import Any
 
+import eth_utils
+import pytest
+
 from microraiden.utils.misc import get_function_kwargs, pop_function_kwargs
+from microraiden.utils.address import (
+    to_checksum_address,
+    is_address,
+    is_checksum_address,
+    is_same_address,
+    address_cache_info,
+    clear_address_cache
+)
 
 
 def test_get_function_kwargs():
@@ -20,3 +31,24 @@ def test_pop_function_kwargs():
     function_kwargs = pop_function_kwargs(kwargs, function)
     assert function_kwargs == dict(b=5, something=3.14)
     assert kwargs == dict(c='string')
+
+
+def test_address_cache():
+    clear_address_cache()
+    address = '0x' + 'ab' * 20
+    checksummed = eth_utils.to_checksum_address(address)
+    for _ in range(3):
+        assert to_checksum_address(address) == checksummed
+        assert is_address(address)
+        assert is_checksum_address(checksummed)
+        assert not is_checksum_address(address)
+    assert is_same_address(address, checksummed)
+    assert not is_address('0x1234')
+    assert not is_address(['unhashable'])
+    with pytest.raises(ValueError):
+        is_same_address(address, '0x1234')
+
+    info = address_cache_info()
+    assert info['to_checksum_address']['misses'] == 2
+    assert info['to_checksum_address']['hits'] == 3
+    assert info['is_address']['misses'] == 3
@@ -0,0 +1,46 @@
+import gevent
+import pytest
+
+from eth_utils import is_same_address
+
+from microraiden.channel_manager import BalanceProofVerifier
+from microraiden.utils import privkey_to_addr, sign_balance_proof
+
+SENDER_PRIVATE_KEY = '0xa0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0a0'
+SENDER_ADDR = privkey_to_addr(SENDER_PRIVATE_KEY)
+RECEIVER_ADDR = privkey_to_addr(
+    '0xb1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1b1'
+)
+CONTRACT_ADDR = '0x' + 'aa' * 20
+
+
+@pytest.mark.parametrize('pool_size', [0, 1, 4])
+def test_recover_sender(pool_size):
+    verifier = BalanceProofVerifier(RECEIVER_ADDR, CONTRACT_ADDR, pool_size=pool_size)
+    sig = sign_balance_proof(SENDER_PRIVATE_KEY, RECEIVER_ADDR, 315123, 8, CONTRACT_ADDR)
+    assert is_same_address(verifier.recover_sender(315123, 8, sig), SENDER_ADDR)
+    assert not is_same_address(verifier.recover_sender(315123, 9, sig), SENDER_ADDR)
+
+    metrics = verifier.metrics()
+    assert metrics['pool_size'] == pool_size
+    assert metrics['verified'] == 2
+    assert metrics['queue_depth'] == 0
+
+
+def test_concurrent_recovery():
+    n = 20
+    verifier = BalanceProofVerifier(RECEIVER_ADDR, CONTRACT_ADDR, pool_size=2)
+    sigs = [
+        sign_balance_proof(SENDER_PRIVATE_KEY, RECEIVER_ADDR, 315123, i, CONTRACT_ADDR)
+        for i in range(n)
+    ]
+    greenlets = [
+        gevent.spawn(verifier.recover_sender, 315123, i, sig)
+        for i, sig in enumerate(sigs)
+    ]
+    gevent.joinall(greenlets, raise_error=True)
+
+    assert all(is_same_address(g.value, SENDER_ADDR) for g in greenlets)
+    assert verifier.n_verified == n
+    assert 1 <= verifier.max_queue_depth <= n
+    assert verifier.queue_depth == 0
@@ -0,0 +1,500 @@
+"""In-memory JSON-RPC provider with synthetic blocks and contract logs."""
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, List
+
+from gevent import socket
+from gevent.server import StreamServer
+from eth_abi import encode_abi, encode_single
+from eth_utils import decode_hex, encode_hex, int_to_big_endian, keccak
+from web3.contract import Contract
+from web3.providers.base import BaseProvider
+from web3.utils.events import event_abi_to_log_topic
+
+
+class RPCError(Exception):
+    pass
+
+
+def block_hash(number: int, fork: int = 0) -> str:
+    return encode_hex(keccak(int_to_big_endian(number) + int_to_big_endian(fork)))
+
+
+class FakeRPCProvider(BaseProvider):
+    """Serves `eth_getLogs`, log filters and blocks from memory.
+
+    Args:
+        block_number (int): number of the latest block
+        supports_get_logs (bool): if False, `eth_getLogs` fails with 'method not found'
+        max_results (int): if set, log queries that match more logs fail like on Infura
+        max_range (int): if set, log queries over a wider block range time out
+        latency (float): seconds every request takes. Like requests of the HTTP provider,
+            they block the event loop.
+    """
+
+    def __init__(
+            self,
+            block_number: int = 0,
+            supports_get_logs: bool = True,
+            max_results: int = None,
+            max_range: int = None,
+            latency: float = 0
+    ):
+        self.block_number = block_number
+        self.supports_get_logs = supports_get_logs
+        self.max_results = max_results
+        self.max_range = max_range
+        self.latency = latency
+        self.logs = []  # type: List[Dict[str, Any]]
+        # block number => number of logs
+        self.block_log_counts = Counter()
+        # fork points of past reorgs
+        self.reorgs = []  # type: List[int]
+        self.filters = {}  # type: Dict[str, Dict[str, Any]]
+        self.n_filters = 0
+        self.calls = Counter()
+        self.network_id = '1337'
+        # eth_call data => encoded result
+        self.call_results = {}  # type: Dict[str, str]
+        self.balances = Counter()
+        self.raw_transactions = []  # type: List[str]
+        self.transaction_counts = Counter()
+        # if set, `eth_call` fails with this error
+        self.call_error = None  # type: Dict[str, Any]
+        # if set, `eth_sendRawTransaction` fails with this error
+        self.send_error = None  # type: Dict[str, Any]
+        # transactions of the pending block
+        self.pending_transactions = []  # type: List[Dict[str, Any]]
+        # txhash => receipt of a mined transaction
+        self.receipts = {}  # type: Dict[str, Dict[str, Any]]
+
+    def isConnected(self):
+        return True
+
+    def add_log(
+            self,
+            contract: Contract,
+            event_name: str,
+            block_number: int,
+            **args
+    ) -> Dict[str, Any]:
+        """Add a log of a contract event, as it would be returned by a node."""
+        event_abi = [
+            abi_element for abi_element in contract.abi
+            if abi_element['type'] == 'event' and abi_element['name'] == event_name
+        ][0]
+        indexed = [arg for arg in event_abi['inputs'] if arg['indexed']]
+        not_indexed = [arg for arg in event_abi['inputs'] if not arg['indexed']]
+        topics = [encode_hex(event_abi_to_log_topic(event_abi))] + [
+            encode_hex(encode_single(arg['type'], args[arg['name']])) for arg in indexed
+        ]
+        data = encode_abi(
+            [arg['type'] for arg in not_indexed],
+            [args[arg['name']] for arg in not_indexed]
+        )
+        log_index = self.block_log_counts[block_number]
+        self.block_log_counts[block_number] += 1
+        tx_hash = keccak(('%d-%d' % (block_number, log_index)).encode())
+        log = {
+            'address': contract.address,
+            'topics': topics,
+            'data': encode_hex(data),
+            'blockNumber': hex(block_number),
+            'blockHash': self.block_hash(block_number),
+            'transactionHash': encode_hex(tx_hash),
+            'transactionIndex': hex(log_index),
+            'logIndex': hex(log_index),
+            'removed': False
+        }
+        self.logs.append(log)
+        self.block_number = max(self.block_number, block_number)
+        return log
+
+    def set_call_result(
+            self,
+            contract: Contract,
+            function_name: str,
+            args: List[Any],
+            result: List[Any]
+    ):
+        """Set the result of a constant function call. Other calls fail like a failed
+        `require`."""
+        function_abi = [
+            abi_element for abi_element in contract.abi
+            if abi_element['type'] == 'function' and abi_element['name'] == function_name
+        ][0]
+        data = contract.encodeABI(function_name, args=args)
+        self.call_results[data] = encode_hex(encode_abi(
+            [output['type'] for output in function_abi['outputs']],
+            result
+        ))
+
+    def add_pending_transaction(
+            self,
+            contract: Contract,
+            function_name: str,
+            args: List[Any],
+            sender: str
+    ) -> str:
+        """Add a transaction calling a contract function to the pending block.
+
+        Returns:
+            str: transaction hash
+        """
+        data = contract.encodeABI(function_name, args=args)
+        txhash = encode_hex(keccak(('%s-%d' % (data, len(self.pending_transactions))).encode()))
+        self.pending_transactions.append({
+            'hash': txhash,
+            'from': sender,
+            'to': contract.address,
+            'input': data,
+            'value': '0x0',
+            'nonce': hex(len(self.pending_transactions)),
+            'gas': hex(100000),
+            'gasPrice': hex(1),
+            'blockHash': None,
+            'blockNumber': None,
+            'transactionIndex': None
+        })
+        return txhash
+
+    def mine_transaction(self, txhash: str, block_number: int, status: int = 1):
+        """Remove a transaction from the pending block and add its receipt."""
+        self.pending_transactions = [
+            tx for tx in self.pending_transactions if tx['hash'] != txhash
+        ]
+        self.receipts[txhash] = {
+            'transactionHash': txhash,
+            'blockNumber': hex(block_number),
+            'blockHash': self.block_hash(block_number),
+            'transactionIndex': '0x0',
+            'cumulativeGasUsed': hex(100000),
+            'gasUsed': hex(100000),
+            'contractAddress': None,
+            'logs': [],
+            'status': hex(status)
+        }
+        self.block_number = max(self.block_number, block_number)
+
+    def block_hash(self, number: int) -> str:
+        return block_hash(number, len([fork for fork in self.reorgs if fork < number]))
+
+    def reorg(self, fork_number: int, block_number: int):
+        """Replace the blocks after `fork_number` and their logs with a new chain
+        up to `block_number`."""
+        self.reorgs.append(fork_number)
+        self.logs = [log for log in self.logs if int(log['blockNumber'], 16) <= fork_number]
+        self.block_log_counts = Counter(int(log['blockNumber'], 16) for log in self.logs)
+        self.block_number = block_number
+
+    def make_request(self, method, params):
+        self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            if not hasattr(self, method):
+                raise RPCError({'code': -32601, 'message': 'Method not found'})
+            result = getattr(self, method)(*params)
+        except RPCError as e:
+            return {'jsonrpc': '2.0', 'id': 1, 'error': e.args[0]}
+        return {'jsonrpc': '2.0', 'id': 1, 'result': result}
+
+    def _block_number(self, block_id) -> int:
+        if block_id in ('latest', 'pending', None):
+            return self.block_number
+        if block_id == 'earliest':
+            return 0
+        if isinstance(block_id, int):
+            return block_id
+        return int(block_id, 16)
+
+    def _match(self, log, filter_params) -> bool:
+        address = filter_params.get('address')
+        if address is not None and log['address'].lower() != address.lower():
+            return False
+        from_block = self._block_number(filter_params.get('fromBlock', 'latest'))
+        to_block = self._block_number(filter_params.get('toBlock', 'latest'))
+        if not from_block <= int(log['blockNumber'], 16) <= to_block:
+            return False
+        for position, topic in enumerate(filter_params.get('topics', [])):
+            if topic is None:
+                continue
+            if position >= len(log['topics']):
+                return False
+            options = topic if isinstance(topic, list) else [topic]
+            if log['topics'][position].lower() not in [o.lower() for o in options]:
+                return False
+        return True
+
+    def _logs_in_range(self, from_block: int, to_block: int) -> List[Dict[str, Any]]:
+        """Logs that may be in a block range, the filter is applied to them."""
+        return self.logs
+
+    def _query(self, filter_params) -> List[Dict[str, Any]]:
+        from_block = self._block_number(filter_params.get('fromBlock', 'latest'))
+        to_block = self._block_number(filter_params.get('toBlock', 'latest'))
+        if self.max_range is not None and to_block - from_block + 1 > self.max_range:
+            raise RPCError({'code': -32000, 'message': 'request timed out'})
+        logs = [
+            dict(log) for log in self._logs_in_range(from_block, to_block)
+            if self._match(log, filter_params)
+        ]
+        if self.max_results is not None and len(logs) > self.max_results:
+            raise RPCError({
+                'code': -32005,
+                'message': 'query returned more than %d results' % self.max_results
+            })
+        return logs
+
+    # JSON-RPC methods
+
+    def net_version(self):
+        return self.network_id
+
+    def eth_blockNumber(self):
+        return hex(self.block_number)
+
+    def eth_getBlockByNumber(self, block_id, full_transactions=False):
+        if block_id == 'pending':
+            return {
+                'number': hex(self.block_number + 1),
+                'hash': None,
+                'parentHash': self.block_hash(self.block_number),
+                'transactions': [
+                    tx if full_transactions else tx['hash'] for tx in self.pending_transactions
+                ]
+            }
+        number = self._block_number(block_id)
+        if number > self.block_number:
+            return None
+        return {
+            'number': hex(number),
+            'hash': self.block_hash(number),
+            'parentHash': self.block_hash(number - 1) if number > 0 else '0x' + '00' * 32
+        }
+
+    def eth_getBlockByHash(self, hash_, full_transactions=False):
+        for number in range(self.block_number, -1, -1):
+            if self.block_hash(number) == hash_:
+                return self.eth_getBlockByNumber(number)
+        return None
+
+    def eth_getBalance(self, address, block_id='latest'):
+        return hex(self.balances[address.lower()])
+
+    def eth_call(self, transaction, block_id='latest'):
+        if self.call_error is not None:
+            raise RPCError(self.call_error)
+        return self.call_results.get(transaction['data'], '0x')
+
+    def eth_getTransactionCount(self, address, block_id='latest'):
+        return hex(self.transaction_counts[address.lower()])
+
+    def eth_sendRawTransaction(self, raw_transaction):
+        if self.send_error is not None:
+            raise RPCError(self.send_error)
+        self.raw_transactions.append(raw_transaction)
+        return encode_hex(keccak(decode_hex(raw_transaction)))
+
+    def eth_getTransactionReceipt(self, txhash):
+        return self.receipts.get(txhash)
+
+    def eth_getLogs(self, filter_params):
+        if not self.supports_get_logs:
+            raise RPCError({'code': -32601, 'message': 'Method not found'})
+        return self._query(filter_params)
+
+    def eth_newFilter(self, filter_params):
+        self.n_filters += 1
+        filter_id = hex(self.n_filters)
+        self.filters[filter_id] = filter_params
+        return filter_id
+
+    def eth_getFilterLogs(self, filter_id):
+        return self._query(self.filters[filter_id])
+
+    def eth_uninstallFilter(self, filter_id):
+        return self.filters.pop(filter_id, None) is not None
+
+
+class FakeNewHeadsServer(StreamServer):
+    """Stand-in for the IPC endpoint of a node that announces new blocks."""
+
+    def __init__(self, path: str):
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(5)
+        super().__init__(listener, self.handle_connection)
+        self.path = path
+        self.connections = []  # type: List[socket.socket]
+        self.n_subscriptions = 0
+
+    def handle_connection(self, connection, address):
+        request = json.loads(connection.recv(4096).decode())
+        assert request['method'] == 'eth_subscribe'
+        assert request['params'] == ['newHeads']
+        self.n_subscriptions += 1
+        connection.sendall(json.dumps({
+            'jsonrpc': '2.0',
+            'id': request['id'],
+            'result': hex(self.n_subscriptions)
+        }).encode())
+        self.connections.append(connection)
+        # keep the connection open until the client or the server closes it
+        try:
+            while connection.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def publish(self, block_number: int):
+        """Announce a new block to all subscribers."""
+        for connection in self.connections:
+            connection.sendall(json.dumps({
+                'jsonrpc': '2.0',
+                'method': 'eth_subscription',
+                'params': {
+                    'subscription': hex(self.n_subscriptions),
+                    'result': {
+                        'number': hex(block_number),
+                        'hash': block_hash(block_number),
+                        'parentHash': block_hash(block_number - 1)
+                    }
+                }
+            }).encode())
+
+    def drop(self):
+        """Close all subscriptions, like a restarting node."""
+        for connection in self.connections:
+            connection.shutdown(socket.SHUT_RDWR)
+            connection.close()
+        self.connections = []
+
+
+class FakeWebsocketConnection(object):
+    """Client side of a websocket, with the blocking `recv` of websocket-client."""
+
+    def __init__(self, node: 'FakeWebsocketNode'):
+        self.node = node
+        self.messages = queue.Queue()
+        self.closed = False
+
+    def send(self, message: str):
+        if self.closed:
+            raise ConnectionError('websocket closed')
+        request = json.loads(message)
+        assert request['method'] == 'eth_subscribe'
+        assert request['params'] == ['newHeads']
+        self.node.n_subscriptions += 1
+        self.messages.put(json.dumps({
+            'jsonrpc': '2.0',
+            'id': request['id'],
+            'result': hex(self.node.n_subscriptions)
+        }))
+
+    def recv(self) -> str:
+        message = self.messages.get()
+        if message is None:
+            raise ConnectionError('websocket closed')
+        return message
+
+    def abort(self):
+        self.closed = True
+        self.messages.put(None)
+
+    def close(self):
+        self.abort()
+        if self in self.node.connections:
+            self.node.connections.remove(self)
+
+
+class FakeWebsocketNode(object):
+    """Stand-in for the websocket-client module connected to a node that announces new
+    blocks. Replaces `microraiden.channel_manager.new_heads.websocket`."""
+
+    def __init__(self):
+        self.connections = []  # type: List[FakeWebsocketConnection]
+        self.urls = []  # type: List[str]
+        self.n_subscriptions = 0
+
+    def create_connection(self, url: str, timeout: float = None) -> FakeWebsocketConnection:
+        self.urls.append(url)
+        connection = FakeWebsocketConnection(self)
+        self.connections.append(connection)
+        return connection
+
+    def publish(self, block_number: int):
+        """Announce a new block to all subscribers."""
+        for connection in self.connections:
+            connection.messages.put(json.dumps({
+                'jsonrpc': '2.0',
+                'method': 'eth_subscription',
+                'params': {
+                    'subscription': hex(self.n_subscriptions),
+                    'result': {
+                        'number': hex(block_number),
+                        'hash': block_hash(block_number),
+                        'parentHash': block_hash(block_number - 1)
+                    }
+                }
+            }))
+
+    def drop(self):
+        """Close all subscriptions, like a restarting node."""
+        for connection in list(self.connections):
+            connection.close()
+
+
+class FakeHTTPServer(HTTPServer):
+    """Stand-in for the HTTP endpoint of a node, answering single and batch requests
+    with a `FakeRPCProvider`. Runs in a native thread."""
+
+    def __init__(self, provider: FakeRPCProvider):
+        super().__init__(('127.0.0.1', 0), FakeHTTPRequestHandler)
+        self.provider = provider
+        self.n_requests = 0
+        self.batch_sizes = []  # type: List[int]
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return 'http://%s:%d' % self.server_address
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_rpc(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        response = self.provider.make_request(request['method'], request.get('params', []))
+        response['id'] = request['id']
+        return response
+
+
+class FakeHTTPRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        self.server.n_requests += 1
+        if isinstance(request, list):
+            self.server.batch_sizes.append(len(request))
+            response = [self.server.handle_rpc(item) for item in request]
+        else:
+            response = self.server.handle_rpc(request)
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
@@ -28,11 +28,33 @@ from .contract import (
     create_signed_contract_transaction,
     create_contract_transaction,
     create_transaction_data,
+    LogQuery,
     get_logs,
+    get_events,
+    fetch_logs,
     get_event_blocking,
     wait_for_transaction
 )
 
+from .address import (
+    to_checksum_address,
+    is_address,
+    is_checksum_address,
+    is_same_address,
+    address_cache_info,
+    clear_address_cache
+)
+
+from .batch import (
+    RPCBatch,
+    get_channel_infos,
+    wait_for_transactions
+)
+
+from .event_cache import EventCache
+
+from .provider import MultiHTTPProvider
+
 from .private_key import (
     check_permission_safety,
     get_private_key
@@ -71,10 +93,28 @@ __all__ = [
     create_signed_contract_transaction,
     create_contract_transaction,
     create_transaction_data,
+    LogQuery,
     get_logs,
+    get_events,
+    fetch_logs,
     get_event_blocking,
     wait_for_transaction,
 
+    to_checksum_address,
+    is_address,
+    is_checksum_address,
+    is_same_address,
+    address_cache_info,
+    clear_address_cache,
+
+    RPCBatch,
+    get_channel_infos,
+    wait_for_transactions,
+
+    EventCache,
+
+    MultiHTTPProvider,
+
     check_permission_safety,
     get_private_key,
 
@@ -0,0 +1,63 @@
+"""Cached address validation and normalization.
+
+eth_utils computes a keccak hash for every checksum check or conversion. The same few
+addresses (receiver, contract, known senders) are normalized over and over again, so the
+results are interned in bounded LRU caches.
+"""
+from functools import lru_cache, wraps
+
+import eth_utils
+
+ADDRESS_CACHE_SIZE = 4096
+
+
+def _interned(function):
+    cached = lru_cache(maxsize=ADDRESS_CACHE_SIZE)(function)
+
+    @wraps(function)
+    def wrapper(value):
+        try:
+            return cached(value)
+        except TypeError:
+            # unhashable value, can't be an address either way
+            return function(value)
+    wrapper.cache_info = cached.cache_info
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+
+@_interned
+def to_checksum_address(address) -> str:
+    return eth_utils.to_checksum_address(address)
+
+
+@_interned
+def is_address(value) -> bool:
+    return eth_utils.is_address(value)
+
+
+@_interned
+def is_checksum_address(value) -> bool:
+    return eth_utils.is_checksum_address(value)
+
+
+def is_same_address(left, right) -> bool:
+    if not is_address(left) or not is_address(right):
+        raise ValueError("Both values must be valid addresses")
+    return to_checksum_address(left) == to_checksum_address(right)
+
+
+def address_cache_info() -> dict:
+    """
+    Returns:
+        dict: hit/miss statistics of the address caches
+    """
+    return {
+        function.__name__: function.cache_info()._asdict()
+        for function in (to_checksum_address, is_address, is_checksum_address)
+    }
+
+
+def clear_address_cache():
+    for function in (to_checksum_address, is_address, is_checksum_address):
+        function.cache_clear()
@@ -0,0 +1,341 @@
+"""JSON-RPC calls that are sent to the node together."""
+import json
+from itertools import count
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import gevent.threadpool
+from eth_abi import decode_abi
+from eth_utils import encode_hex, is_dict
+from ethereum.tester import TransactionFailed
+from web3 import Web3, HTTPProvider
+from web3.contract import Contract
+from web3.middleware.pythonic import (
+    block_formatter,
+    log_entry_formatter,
+    receipt_formatter,
+    to_integer_if_hex,
+    transaction_formatter,
+)
+from web3.utils.abi import filter_by_name, get_abi_output_types, map_abi_data
+from web3.utils.datastructures import AttributeDict, HexBytes
+from web3.utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3.utils.request import make_post_request
+
+from .contract import LogQuery, _is_method_not_found
+from .provider import MultiHTTPProvider
+
+_request_ids = count()
+
+
+def _attribute_dict_formatter(formatter: Callable) -> Callable:
+    """Format a result like web3 does: None is kept, dicts become AttributeDicts."""
+    def format_result(result):
+        if result is None:
+            return None
+        result = formatter(result)
+        if is_dict(result) and not isinstance(result, AttributeDict):
+            result = AttributeDict.recursive(result)
+        return result
+    return format_result
+
+
+_format_block = _attribute_dict_formatter(block_formatter)
+_format_transaction = _attribute_dict_formatter(transaction_formatter)
+_format_receipt = _attribute_dict_formatter(receipt_formatter)
+
+
+def _to_hex(value) -> str:
+    return value if isinstance(value, str) else encode_hex(value)
+
+
+class RPCBatch(object):
+    """Independent JSON-RPC calls that are sent to the node together.
+
+    Over HTTP the calls are sent as one JSON-RPC batch (a JSON array) on the connection
+    of the web3 provider. A `MultiHTTPProvider` sends the batch to its fastest node.
+    Other providers get the calls one after another. The results are formatted like
+    web3 formats them.
+
+    Example::
+
+        batch = RPCBatch(web3)
+        batch.block_number()
+        batch.get_block(100)
+        block_number, block = batch.send()
+    """
+
+    def __init__(self, web3: Web3):
+        self.web3 = web3
+        # (method, params, result formatter, fallback)
+        self.calls = []  # type: List[tuple]
+
+    def __len__(self):
+        return len(self.calls)
+
+    @property
+    def is_batched(self) -> bool:
+        """True if the calls are sent in a single request."""
+        providers = self.web3.providers
+        return len(providers) == 1 and isinstance(providers[0], HTTPProvider)
+
+    def add(
+            self,
+            method: str,
+            params: List[Any],
+            formatter: Callable = None,
+            fallback: Callable = None
+    ) -> int:
+        """Add a call to the batch.
+
+        Args:
+            method (str): JSON-RPC method
+            params (list): JSON-RPC params, as sent to the node
+            formatter (callable, optional): applied to the result of the call
+            fallback (callable, optional): returns the result if the provider can't batch,
+                or if the node doesn't support the method
+        Returns:
+            int: index of the result in the list returned by `send`
+        """
+        self.calls.append((method, params, formatter, fallback))
+        return len(self.calls) - 1
+
+    def block_number(self) -> int:
+        return self.add(
+            'eth_blockNumber',
+            [],
+            to_integer_if_hex,
+            lambda: self.web3.eth.blockNumber
+        )
+
+    def get_balance(self, address: str) -> int:
+        return self.add(
+            'eth_getBalance',
+            [address, 'latest'],
+            to_integer_if_hex,
+            lambda: self.web3.eth.getBalance(address)
+        )
+
+    def get_block(self, block_number: int) -> int:
+        """The result is None if the block doesn't exist."""
+        return self.add(
+            'eth_getBlockByNumber',
+            [hex(block_number), False],
+            _format_block,
+            lambda: self._get_block(block_number)
+        )
+
+    def get_transaction(self, tx_hash) -> int:
+        return self.add(
+            'eth_getTransactionByHash',
+            [_to_hex(tx_hash)],
+            _format_transaction,
+            lambda: self.web3.eth.getTransaction(tx_hash)
+        )
+
+    def get_transaction_receipt(self, tx_hash) -> int:
+        return self.add(
+            'eth_getTransactionReceipt',
+            [_to_hex(tx_hash)],
+            _format_receipt,
+            lambda: self.web3.eth.getTransactionReceipt(tx_hash)
+        )
+
+    def call(
+            self,
+            contract: Contract,
+            function_name: str,
+            args: List[Any],
+            block_identifier: Union[int, str] = None
+    ) -> int:
+        """Call a constant contract function.
+
+        The result is decoded like web3 does, or None if the call returned no data, e.g.
+        because a `require` of the function failed. Errors of the node raise a
+        `ValueError` on `send`.
+
+        Args:
+            block_identifier (int or str, optional): block whose state is used,
+                defaults to 'latest'
+        """
+        function_abi = filter_by_name(function_name, contract.abi)[0]
+        output_types = get_abi_output_types(function_abi)
+        transaction = {
+            'to': contract.address,
+            'data': contract.encodeABI(function_name, args=args)
+        }
+        if block_identifier is None:
+            block_identifier = 'latest'
+        elif isinstance(block_identifier, int):
+            block_identifier = hex(block_identifier)
+
+        def decode(result):
+            data = HexBytes(result)
+            if not data:
+                return None
+            return map_abi_data(
+                BASE_RETURN_NORMALIZERS,
+                output_types,
+                decode_abi(output_types, data)
+            )
+
+        def fallback():
+            try:
+                return decode(self.web3.eth.call(transaction, block_identifier))
+            except TransactionFailed:
+                return None
+
+        return self.add('eth_call', [transaction, block_identifier], decode, fallback)
+
+    def get_logs(self, log_query: LogQuery, from_block: int, to_block: int) -> int:
+        return self.add(
+            'eth_getLogs',
+            [log_query.filter_params(hex(from_block), hex(to_block))],
+            lambda logs: log_query.decode_logs([log_entry_formatter(log) for log in logs]),
+            lambda: log_query.get_logs(from_block, to_block)
+        )
+
+    def send(self) -> List[Any]:
+        """Send all calls and clear the batch.
+
+        Returns:
+            list: results in the order the calls were added
+        Raises:
+            ValueError: if a call failed, like web3 does
+        """
+        calls, self.calls = self.calls, []
+        if not calls:
+            return []
+        if not self.is_batched:
+            return [self._request(*call) for call in calls]
+
+        provider = self.web3.providers[0]
+        request_ids = [next(_request_ids) for _ in calls]
+        requests = [
+            {'jsonrpc': '2.0', 'method': method, 'params': params, 'id': request_id}
+            for (method, params, _, _), request_id in zip(calls, request_ids)
+        ]
+        request_data = json.dumps(requests).encode()
+        if isinstance(provider, MultiHTTPProvider):
+            raw_response = provider.make_batch_request(request_data)
+        else:
+            raw_response = make_post_request(
+                provider.endpoint_uri,
+                request_data,
+                **provider.get_request_kwargs()
+            )
+        response = json.loads(raw_response.decode())
+        if is_dict(response):
+            # nodes answer a batch they can't handle with a single error
+            raise ValueError(response.get('error', response))
+        responses = {item['id']: item for item in response}
+
+        results = []
+        for (method, params, formatter, fallback), request_id in zip(calls, request_ids):
+            item = responses[request_id]
+            if 'error' in item:
+                if fallback is not None and _is_method_not_found(ValueError(item['error'])):
+                    results.append(fallback())
+                    continue
+                raise ValueError(item['error'])
+            result = item['result']
+            results.append(formatter(result) if formatter is not None else result)
+        return results
+
+    def _get_block(self, block_number: int):
+        try:
+            return self.web3.eth.getBlock(block_number)
+        except ValueError:
+            # some providers raise if the block doesn't exist
+            return None
+
+    def _request(self, method, params, formatter, fallback):
+        if fallback is not None:
+            return fallback()
+        result = self.web3.manager.request_blocking(method, params)
+        return formatter(result) if formatter is not None else result
+
+
+def wait_for_transactions(
+        web3: Web3,
+        tx_hashes: List[str],
+        wait: Callable
+) -> List[tuple]:
+    """Wait until all transactions are mined, polling their receipts in one batch.
+
+    Args:
+        web3 (Web3): web3 provider
+        tx_hashes (list): hashes of the transactions
+        wait (callable): pause between checks
+    Returns:
+        list: (transaction, receipt) of each hash, in the order of `tx_hashes`
+    """
+    receipts = {}
+    while True:
+        batch = RPCBatch(web3)
+        pending = [tx_hash for tx_hash in tx_hashes if tx_hash not in receipts]
+        for tx_hash in pending:
+            batch.get_transaction_receipt(tx_hash)
+        for tx_hash, receipt in zip(pending, batch.send()):
+            if receipt and receipt.blockNumber:
+                receipts[tx_hash] = receipt
+        if len(receipts) == len(tx_hashes):
+            break
+        wait()
+
+    batch = RPCBatch(web3)
+    for tx_hash in tx_hashes:
+        batch.get_transaction(tx_hash)
+    return list(zip(batch.send(), (receipts[tx_hash] for tx_hash in tx_hashes)))
+
+
+def get_channel_infos(
+        channel_manager_contract: Contract,
+        channel_ids: List[Tuple[str, str, int]],
+        block_identifier: Union[int, str] = None,
+        batch_size: int = 100,
+        concurrency: int = 4
+) -> Dict[Tuple[str, str, int], Optional[Tuple[str, int, int, int, int]]]:
+    """Read the on-chain info of many channels with batched `getChannelInfo` calls.
+
+    Over HTTP up to `concurrency` batches of `batch_size` calls are sent at the same
+    time. The requests block, so they're sent from native threads.
+
+    Args:
+        channel_manager_contract (Contract): channel manager contract
+        channel_ids (list): (sender, receiver, open block number) of the channels
+        block_identifier (int or str, optional): block whose state is read. Pin it to a
+            block number to get a consistent snapshot. Defaults to 'latest'.
+        batch_size (int, optional): number of calls per JSON-RPC batch
+        concurrency (int, optional): number of batches sent at the same time
+    Returns:
+        dict: channel id => (channel key, deposit, settle block number, closing balance,
+            withdrawn balance), as returned by the contract, or None if the channel
+            doesn't exist (anymore)
+    """
+    assert batch_size > 0 and concurrency > 0
+    web3 = channel_manager_contract.web3
+    channel_ids = list(channel_ids)
+    chunks = [
+        channel_ids[i:i + batch_size] for i in range(0, len(channel_ids), batch_size)
+    ]
+
+    def read(chunk):
+        batch = RPCBatch(web3)
+        for channel_id in chunk:
+            batch.call(channel_manager_contract, 'getChannelInfo', channel_id, block_identifier)
+        return batch.send()
+
+    if concurrency > 1 and len(chunks) > 1 and RPCBatch(web3).is_batched:
+        pool = gevent.threadpool.ThreadPool(concurrency)
+        try:
+            results = pool.map(read, chunks)
+        finally:
+            pool.kill()
+    else:
+        results = [read(chunk) for chunk in chunks]
+
+    channel_infos = {}
+    for chunk, chunk_results in zip(chunks, results):
+        for channel_id, channel_info in zip(chunk, chunk_results):
+            channel_infos[channel_id] = tuple(channel_info) if channel_info else None
+    return channel_infos
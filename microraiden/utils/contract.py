@@ -1,3 +1,7 @@
+import logging
+import time
+import weakref
+from collections import OrderedDict
 from typing import List, Any, Union, Dict
 
 import gevent
@@ -6,13 +10,19 @@ from eth_utils import decode_hex, encode_hex
 from ethereum.transactions import Transaction
 from web3 import Web3
 from web3.contract import Contract
+from web3.utils.events import construct_event_topic_set
+from web3.middleware.pythonic import log_entry_formatter
 
 from microraiden.config import NETWORK_CFG
 from microraiden.utils import privkey_to_addr, sign_transaction
-from microraiden.utils.populus_compat import LogFilter
+from .event_decoder import decode_event, get_event_decoders
+
+log = logging.getLogger(__name__)
 
 DEFAULT_TIMEOUT = 60
 DEFAULT_RETRY_INTERVAL = 3
+# seconds after which `eth_getLogs` is tried again on a node that didn't support it
+LOG_FILTER_RETRY_INTERVAL = 600
 
 
 def create_signed_transaction(
@@ -23,10 +33,12 @@ def create_signed_transaction(
         data=b'',
         nonce_offset: int = 0,
         gas_price: Union[int, None] = None,
-        gas_limit: int = NETWORK_CFG.POT_GAS_LIMIT
+        gas_limit: int = NETWORK_CFG.POT_GAS_LIMIT,
+        nonce: int = None
 ) -> str:
     """
     Creates a signed on-chain transaction compliant with EIP155.
+    If `nonce` is None, the next nonce of the sender plus `nonce_offset` is used.
     """
     if gas_price is None:
         gas_price = NETWORK_CFG.GAS_PRICE
@@ -38,7 +50,8 @@ def create_signed_transaction(
         data=data,
         nonce_offset=nonce_offset,
         gas_price=gas_price,
-        gas_limit=gas_limit
+        gas_limit=gas_limit,
+        nonce=nonce
     )
     sign_transaction(tx, private_key, int(web3.version.network))
     return encode_hex(rlp.encode(tx))
@@ -52,11 +65,13 @@ def create_transaction(
         nonce_offset: int = 0,
         value: int = 0,
         gas_price: Union[int, None] = None,
-        gas_limit: int = NETWORK_CFG.POT_GAS_LIMIT
+        gas_limit: int = NETWORK_CFG.POT_GAS_LIMIT,
+        nonce: int = None
 ) -> Transaction:
     if gas_price is None:
         gas_price = NETWORK_CFG.GAS_PRICE
-    nonce = web3.eth.getTransactionCount(from_, 'pending') + nonce_offset
+    if nonce is None:
+        nonce = web3.eth.getTransactionCount(from_, 'pending') + nonce_offset
     tx = Transaction(nonce, gas_price, gas_limit, to, value, data)
     tx.sender = decode_hex(from_)
     return tx
@@ -70,10 +85,12 @@ def create_signed_contract_transaction(
         value: int=0,
         nonce_offset: int = 0,
         gas_price: Union[int, None] = None,
-        gas_limit: int = NETWORK_CFG.GAS_LIMIT
+        gas_limit: int = NETWORK_CFG.GAS_LIMIT,
+        nonce: int = None
 ) -> str:
     """
     Creates a signed on-chain contract transaction compliant with EIP155.
+    If `nonce` is None, the next nonce of the sender plus `nonce_offset` is used.
     """
     if gas_price is None:
         gas_price = NETWORK_CFG.GAS_PRICE
@@ -85,7 +102,8 @@ def create_signed_contract_transaction(
         value=value,
         nonce_offset=nonce_offset,
         gas_price=gas_price,
-        gas_limit=gas_limit
+        gas_limit=gas_limit,
+        nonce=nonce
     )
     sign_transaction(tx, private_key, int(contract.web3.version.network))
     return encode_hex(rlp.encode(tx))
@@ -99,7 +117,8 @@ def create_contract_transaction(
         value: int = 0,
         nonce_offset: int = 0,
         gas_price: Union[int, None] = None,
-        gas_limit: int = NETWORK_CFG.GAS_LIMIT
+        gas_limit: int = NETWORK_CFG.GAS_LIMIT,
+        nonce: int = None
 ) -> Transaction:
     if gas_price is None:
         gas_price = NETWORK_CFG.GAS_PRICE
@@ -112,7 +131,8 @@ def create_contract_transaction(
         data=data,
         nonce_offset=nonce_offset,
         gas_price=gas_price,
-        gas_limit=gas_limit
+        gas_limit=gas_limit,
+        nonce=nonce
     )
 
 
@@ -121,6 +141,90 @@ def create_transaction_data(contract: Contract, func_name: str, args: List[Any])
     return decode_hex(data)
 
 
+def _merge_topics(topics: List[Any]) -> Any:
+    """Topic filter matching any of the topics at the same position."""
+    unique_topics = list(OrderedDict.fromkeys(topics))
+    return unique_topics[0] if len(unique_topics) == 1 else unique_topics
+
+
+class LogQuery(object):
+    """Precomputed log filter for one or more events of a contract.
+
+    The events are matched by an OR list of their signatures in topic 0. The indexed
+    arguments in `argument_filters` must be at the same position in all the events.
+    A list of values matches any of them.
+    """
+
+    def __init__(
+            self,
+            contract: Contract,
+            event_names: List[str],
+            argument_filters: Dict[str, Any] = None
+    ):
+        self.contract = contract
+        self.decoders = {
+            topic: decoder
+            for topic, decoder in get_event_decoders(contract).items()
+            if decoder.name in event_names
+        }
+        assert len(self.decoders) == len(event_names), \
+            'Not all events found: {}.'.format(event_names)
+        self.event_abis = {topic: decoder.abi for topic, decoder in self.decoders.items()}
+
+        if argument_filters is None:
+            argument_filters = {}
+
+        argument_topics = None
+        for event_abi in self.event_abis.values():
+            # one topic list per combination of the filtered values
+            topic_set = construct_event_topic_set(event_abi, argument_filters)
+            topics = [
+                _merge_topics(position_topics) for position_topics in zip(*topic_set)
+            ][1:]
+            while topics and topics[-1] is None:
+                topics.pop()
+            assert argument_topics in (None, topics), \
+                'Filtered arguments are indexed differently in {}.'.format(event_names)
+            argument_topics = topics
+        self.topics = [list(self.event_abis.keys())] + argument_topics
+
+    def filter_params(
+            self,
+            from_block: Union[int, str] = 0,
+            to_block: Union[int, str] = 'pending'
+    ) -> Dict[str, Any]:
+        return {
+            'fromBlock': from_block,
+            'toBlock': to_block,
+            'address': self.contract.address,
+            'topics': self.topics
+        }
+
+    def decode(self, log: Dict[str, Any]) -> Dict[str, Any]:
+        return decode_event(self.decoders, log)
+
+    def get_logs(
+            self,
+            from_block: Union[int, str] = 0,
+            to_block: Union[int, str] = 'pending'
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            list: decoded logs, ordered by (blockNumber, logIndex)
+        """
+        raw_logs = fetch_logs(self.contract, self.filter_params(from_block, to_block))
+        return self.decode_logs(raw_logs)
+
+    def decode_logs(self, logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            list: decoded logs, ordered by (blockNumber, logIndex)
+        """
+        logs = [self.decode(log) for log in logs]
+        logs.sort(key=lambda log: (log['blockNumber'], log['logIndex']))
+        return logs
+
+
 def get_logs(
         contract: Contract,
         event_name: str,
@@ -128,33 +232,72 @@ def get_logs(
         to_block: Union[int, str] = 'pending',
         argument_filters: Dict[str, Any] = None
 ):
-    event_abi = [
-        abi_element for abi_element in contract.abi
-        if abi_element['type'] == 'event' and abi_element['name'] == event_name
-    ]
-    assert len(event_abi) == 1, 'No event found matching name {}.'.format(event_name)
-    event_abi = event_abi[0]
-
-    if argument_filters is None:
-        argument_filters = {}
-
-    tmp_filter = LogFilter(
-        contract.web3,
-        [event_abi],
-        contract.address,
-        event_name,
-        from_block,
-        to_block,
-        argument_filters
-    )
-    logs = tmp_filter.get_logs()
-    tmp_filter.uninstall()
-    return logs
+    return LogQuery(contract, [event_name], argument_filters).get_logs(from_block, to_block)
+
+
+def get_events(
+        contract: Contract,
+        event_names: List[str],
+        from_block: Union[int, str] = 0,
+        to_block: Union[int, str] = 'pending',
+        argument_filters: Dict[str, Any] = None
+) -> List[Dict[str, Any]]:
+    """Get the logs of several events of a contract with a single request.
+
+    Returns:
+        list: decoded logs, ordered by (blockNumber, logIndex)
+    """
+    return LogQuery(contract, event_names, argument_filters).get_logs(from_block, to_block)
+
+
+# provider => time at which the node turned out not to support eth_getLogs
+_log_filter_providers = weakref.WeakKeyDictionary()
+
+
+def fetch_logs(contract: Contract, filter_params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Query logs with a stateless `eth_getLogs` call.
+
+    Nodes that don't support `eth_getLogs` are queried through a temporary log filter
+    instead (`eth_newFilter`, `eth_getFilterLogs`, `eth_uninstallFilter`), until
+    `eth_getLogs` is tried again after `LOG_FILTER_RETRY_INTERVAL` seconds.
+    """
+    provider = contract.web3.providers[0]
+    raw_logs = None
+    unsupported_since = _log_filter_providers.get(provider)
+    if unsupported_since is None or time.time() - unsupported_since > LOG_FILTER_RETRY_INTERVAL:
+        try:
+            raw_logs = _get_logs_raw(contract, filter_params)
+            _log_filter_providers.pop(provider, None)
+        except ValueError as e:
+            if not _is_method_not_found(e):
+                raise
+            log.warning('eth_getLogs is not supported by the node, using log filters instead')
+            _log_filter_providers[provider] = time.time()
+    if raw_logs is None:
+        raw_logs = _get_filter_logs_raw(contract, filter_params)
+    return [log_entry_formatter(raw_log) for raw_log in raw_logs]
+
+
+def _is_method_not_found(error: ValueError) -> bool:
+    """Check for the JSON-RPC error of an unknown method, i.e. code -32601."""
+    details = error.args[0] if error.args else None
+    if isinstance(details, dict):
+        return (details.get('code') == -32601 or
+                str(details.get('message', '')).strip().lower() == 'method not found')
+    return str(details).strip().lower() == 'method not found'
 
 
 def _get_logs_raw(contract: Contract, filter_params: Dict[str, Any]):
     """For easy patching."""
-    return contract.web3._requestManager.request_blocking('eth_getLogs', [filter_params])
+    return contract.web3.manager.request_blocking('eth_getLogs', [filter_params])
+
+
+def _get_filter_logs_raw(contract: Contract, filter_params: Dict[str, Any]):
+    filter_ = contract.web3.eth.filter(filter_params)
+    try:
+        return contract.web3.eth.getFilterLogs(filter_.filter_id)
+    finally:
+        contract.web3.eth.uninstallFilter(filter_.filter_id)
 
 
 def get_event_blocking(
@@ -167,14 +310,9 @@ def get_event_blocking(
         wait=DEFAULT_RETRY_INTERVAL,
         timeout=DEFAULT_TIMEOUT
 ) -> Union[Dict[str, Any], None]:
+    query = LogQuery(contract, [event_name], argument_filters)
     for i in range(0, timeout + wait, wait):
-        logs = get_logs(
-            contract,
-            event_name,
-            from_block=from_block,
-            to_block=to_block,
-            argument_filters=argument_filters
-        )
+        logs = query.get_logs(from_block=from_block, to_block=to_block)
         matching_logs = [event for event in logs if not condition or condition(event)]
         if matching_logs:
             return matching_logs[0]
@@ -6,12 +6,13 @@ from eth_utils import (
     decode_hex,
     remove_0x_prefix,
     keccak,
-    is_0x_prefixed,
-    to_checksum_address
+    is_0x_prefixed
 )
 from ethereum.transactions import Transaction
 import rlp
 
+from .address import to_checksum_address
+
 
 Type = str
 Name = str
@@ -0,0 +1,263 @@
+"""Local cache of the channel manager events, shared by the proxy, the client and the tools."""
+import json
+import logging
+import sqlite3
+from typing import Any, Dict, List, Union
+
+from web3.contract import Contract
+from web3.utils.datastructures import AttributeDict, HexBytes
+
+from microraiden.exceptions import EventCacheMismatch
+from .address import to_checksum_address
+from .batch import RPCBatch
+from .contract import LogQuery
+
+log = logging.getLogger(__name__)
+
+CHANNEL_EVENTS = [
+    'ChannelCreated',
+    'ChannelToppedUp',
+    'ChannelCloseRequested',
+    'ChannelSettled',
+    'ChannelWithdraw'
+]
+
+EVENT_CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS `metadata` (
+    `contract_address` CHAR(42)
+);
+-- cached heads, to detect reorgs
+CREATE TABLE IF NOT EXISTS `blocks` (
+    `number`            INTEGER         PRIMARY KEY,
+    `hash`              CHAR(66)        NOT NULL
+);
+CREATE TABLE IF NOT EXISTS `logs` (
+    `block_number`      INTEGER         NOT NULL,
+    `log_index`         INTEGER         NOT NULL,
+    `block_hash`        CHAR(66)        NOT NULL,
+    `transaction_hash`  CHAR(66)        NOT NULL,
+    `transaction_index` INTEGER         NOT NULL,
+    `event`             VARCHAR(32)     NOT NULL,
+    `sender`            CHAR(42)        NOT NULL,
+    `receiver`          CHAR(42)        NOT NULL,
+    `open_block_number` INTEGER         NOT NULL,
+    `args`              TEXT            NOT NULL,
+    PRIMARY KEY (`block_number`, `log_index`)
+);
+CREATE INDEX IF NOT EXISTS `logs_sender` ON `logs` (`sender`, `block_number`);
+CREATE INDEX IF NOT EXISTS `logs_receiver` ON `logs` (`receiver`, `block_number`);
+"""
+
+ADD_LOG_SQL = """
+INSERT OR IGNORE INTO `logs` VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+ADD_BLOCK_SQL = """
+INSERT OR REPLACE INTO `blocks` VALUES (?, ?)
+"""
+
+PRUNE_BLOCKS_SQL = """
+DELETE FROM `blocks` WHERE `number` NOT IN (
+    SELECT `number` FROM `blocks` ORDER BY `number` DESC LIMIT ?
+)
+"""
+
+
+def _to_hex(value) -> str:
+    return HexBytes(value).hex()
+
+
+class EventCache(object):
+    """Append-only cache of the decoded events of a channel manager contract.
+
+    Events are stored in a sqlite file, indexed by sender and receiver, so that the proxy,
+    the client and the tools can share it and extend it incrementally instead of scanning
+    the chain from the beginning. Only blocks with `n_confirmations` are cached by default.
+    The hashes of recent heads are kept, so that events of reorganized blocks are dropped
+    and fetched again.
+    """
+
+    def __init__(
+            self,
+            filename: str,
+            contract: Contract,
+            start_block: int = 0,
+            n_confirmations: int = 5,
+            chunk_size: int = 100 * 1000,
+            n_block_hashes: int = 256
+    ):
+        """
+        Args:
+            filename (str): path to the cache file. It's created if it doesn't exist.
+            contract (Contract): channel manager contract
+            start_block (int, optional): first block that may contain events
+            n_confirmations (int, optional): confirmations a block needs to be cached
+            chunk_size (int, optional): number of blocks queried at once
+            n_block_hashes (int, optional): number of cached heads whose hashes are kept.
+                A reorg deeper than that invalidates the whole cache.
+        """
+        assert chunk_size > 0 and n_block_hashes > 0
+        self.filename = filename
+        self.contract = contract
+        self.start_block = start_block
+        self.n_confirmations = n_confirmations
+        self.chunk_size = chunk_size
+        self.n_block_hashes = n_block_hashes
+        self.query = LogQuery(contract, CHANNEL_EVENTS)
+        self.conn = sqlite3.connect(filename)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(EVENT_CACHE_SQL)
+        row = self.conn.execute('SELECT `contract_address` FROM `metadata`;').fetchone()
+        if row is None:
+            self.conn.execute('INSERT INTO `metadata` VALUES (?);', [contract.address])
+            self.conn.commit()
+        elif row['contract_address'] != contract.address:
+            raise EventCacheMismatch(
+                'event cache %s belongs to contract %s' % (filename, row['contract_address'])
+            )
+
+    @property
+    def head_number(self) -> int:
+        """The number of the highest cached block."""
+        row = self.conn.execute('SELECT MAX(`number`) AS `number` FROM `blocks`;').fetchone()
+        if row['number'] is None:
+            return self.start_block - 1
+        return row['number']
+
+    @property
+    def n_logs(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM `logs`;').fetchone()[0]
+
+    def update(self, to_block: int = None) -> int:
+        """Fetch the events of the blocks after the cached head.
+
+        Args:
+            to_block (int, optional): last block to cache, defaults to the latest block
+                with `n_confirmations`
+        Returns:
+            int: number of the highest cached block
+        """
+        web3 = self.contract.web3
+        if to_block is None:
+            to_block = web3.eth.blockNumber - self.n_confirmations
+        self._handle_reorg()
+        from_block = self.head_number + 1
+        if from_block <= to_block:
+            log.debug('caching events of blocks %d-%d', from_block, to_block)
+        while from_block <= to_block:
+            range_end = min(from_block + self.chunk_size - 1, to_block)
+            batch = RPCBatch(web3)
+            batch.get_logs(self.query, from_block, range_end)
+            batch.get_block(range_end)
+            logs, block = batch.send()
+            self._append(logs, range_end, block.hash)
+            from_block = range_end + 1
+        return self.head_number
+
+    def _append(self, logs: List[Dict[str, Any]], head_number: int, head_hash: bytes):
+        self.conn.executemany(ADD_LOG_SQL, [
+            (
+                log['blockNumber'],
+                log['logIndex'],
+                _to_hex(log['blockHash']),
+                _to_hex(log['transactionHash']),
+                log['transactionIndex'],
+                log['event'],
+                to_checksum_address(log['args']['_sender_address']),
+                to_checksum_address(log['args']['_receiver_address']),
+                log['args'].get('_open_block_number', log['blockNumber']),
+                json.dumps(dict(log['args']))
+            )
+            for log in logs
+        ])
+        self.conn.execute(ADD_BLOCK_SQL, [head_number, _to_hex(head_hash)])
+        self.conn.execute(PRUNE_BLOCKS_SQL, [self.n_block_hashes])
+        self.conn.commit()
+
+    def _handle_reorg(self):
+        """Drop the events above the fork point if cached blocks have been reorganized."""
+        blocks = self.conn.execute(
+            'SELECT `number`, `hash` FROM `blocks` ORDER BY `number` DESC;'
+        ).fetchall()
+        if not blocks:
+            return
+        batch = RPCBatch(self.contract.web3)
+        batch.get_block(blocks[0]['number'])
+        head = batch.send()[0]
+        if head is not None and _to_hex(head.hash) == blocks[0]['hash']:
+            return
+
+        for block in blocks[1:]:
+            batch.get_block(block['number'])
+        current_blocks = batch.send()
+        for block, current_block in zip(blocks[1:], current_blocks):
+            if current_block is not None and _to_hex(current_block.hash) == block['hash']:
+                log.info('cached blocks after %d have been reorganized', block['number'])
+                self.rollback(block['number'])
+                return
+        log.warning('all cached blocks have been reorganized, clearing the event cache')
+        self.rollback(self.start_block - 1)
+
+    def rollback(self, block_number: int):
+        """Forget the events of all blocks after `block_number`."""
+        self.conn.execute('DELETE FROM `logs` WHERE `block_number` > ?;', [block_number])
+        self.conn.execute('DELETE FROM `blocks` WHERE `number` > ?;', [block_number])
+        self.conn.commit()
+
+    def get_logs(
+            self,
+            sender: str = None,
+            receiver: Union[str, List[str]] = None,
+            event_names: List[str] = None,
+            from_block: int = 0,
+            to_block: int = None
+    ) -> List[Dict[str, Any]]:
+        """Get cached events.
+
+        Args:
+            sender (str, optional): only events of channels of this sender
+            receiver (str or list, optional): only events of channels of this receiver,
+                or of these receivers
+            event_names (list, optional): only these events
+            from_block (int, optional): first block
+            to_block (int, optional): last block, defaults to the cached head
+        Returns:
+            list: decoded logs like `LogQuery.get_logs` returns them, ordered by
+                (blockNumber, logIndex)
+        """
+        conditions = ['`block_number` >= ?']
+        params = [from_block]  # type: List[Any]
+        if to_block is not None:
+            conditions.append('`block_number` <= ?')
+            params.append(to_block)
+        if sender is not None:
+            conditions.append('`sender` = ?')
+            params.append(to_checksum_address(sender))
+        if receiver is not None:
+            receivers = [receiver] if isinstance(receiver, str) else receiver
+            conditions.append('`receiver` IN (%s)' % ', '.join('?' * len(receivers)))
+            params.extend(to_checksum_address(receiver) for receiver in receivers)
+        if event_names is not None:
+            conditions.append('`event` IN (%s)' % ', '.join('?' * len(event_names)))
+            params.extend(event_names)
+        rows = self.conn.execute(
+            'SELECT * FROM `logs` WHERE %s ORDER BY `block_number`, `log_index`;' %
+            ' AND '.join(conditions),
+            params
+        )
+        return [
+            {
+                'address': self.contract.address,
+                'blockNumber': row['block_number'],
+                'blockHash': HexBytes(row['block_hash']),
+                'logIndex': row['log_index'],
+                'transactionHash': HexBytes(row['transaction_hash']),
+                'transactionIndex': row['transaction_index'],
+                'event': row['event'],
+                'args': AttributeDict(json.loads(row['args']))
+            }
+            for row in rows
+        ]
+
+    def close(self):
+        self.conn.close()
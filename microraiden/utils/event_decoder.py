@@ -0,0 +1,181 @@
+"""Precompiled decoders for the events of a contract.
+
+`web3.utils.events.get_event_data` derives the argument types and names from the event
+ABI for every log it decodes. The decoders here derive them once per event and decode
+the 32 byte words of static arguments directly, so that syncing long block ranges isn't
+dominated by ABI parsing.
+"""
+import re
+import weakref
+from typing import Any, Callable, Dict, List
+
+from eth_abi import decode_abi, decode_single
+from eth_utils import decode_hex, encode_hex
+from web3.contract import Contract
+from web3.utils.abi import (
+    exclude_indexed_event_inputs,
+    get_indexed_event_inputs,
+    map_abi_data,
+    normalize_event_input_types
+)
+from web3.utils.events import event_abi_to_log_topic, get_event_abi_types_for_decoding
+from web3.utils.normalizers import BASE_RETURN_NORMALIZERS
+
+from .address import to_checksum_address
+
+WORD_SIZE = 32
+
+_INT_TYPE = re.compile(r'^(u?)int(\d*)$')
+_BYTES_TYPE = re.compile(r'^bytes(\d+)$')
+
+
+def _decode_address(word: bytes) -> str:
+    return to_checksum_address(encode_hex(word[-20:]))
+
+
+def _decode_uint(word: bytes) -> int:
+    return int.from_bytes(word, 'big')
+
+
+def _decode_int(word: bytes) -> int:
+    return int.from_bytes(word, 'big', signed=True)
+
+
+def _decode_bool(word: bytes) -> bool:
+    return word[-1] == 1
+
+
+def _word_decoder(abi_type: str) -> Callable[[bytes], Any]:
+    """Decoder of a value encoded in a single word, `None` for other types."""
+    if abi_type == 'address':
+        return _decode_address
+    if abi_type == 'bool':
+        return _decode_bool
+    match = _INT_TYPE.match(abi_type)
+    if match:
+        return _decode_uint if match.group(1) else _decode_int
+    match = _BYTES_TYPE.match(abi_type)
+    if match:
+        size = int(match.group(1))
+        return lambda word: bytes(word[:size])
+    return None
+
+
+def _to_bytes(value) -> bytes:
+    return value if isinstance(value, bytes) else decode_hex(value)
+
+
+class EventDecoder(object):
+    """Decodes the logs of an event like `get_event_data`, from a precompiled layout."""
+
+    def __init__(self, event_abi: Dict[str, Any]):
+        self.abi = event_abi
+        self.name = event_abi['name']
+        self.topic = encode_hex(event_abi_to_log_topic(event_abi))
+        self.anonymous = event_abi.get('anonymous', False)
+
+        indexed_inputs = get_indexed_event_inputs(event_abi)
+        data_inputs = exclude_indexed_event_inputs(event_abi)
+        self.topic_names = [i['name'] for i in indexed_inputs]
+        self.topic_types = get_event_abi_types_for_decoding(
+            normalize_event_input_types(indexed_inputs)
+        )
+        self.data_names = [i['name'] for i in data_inputs]
+        self.data_types = get_event_abi_types_for_decoding(
+            normalize_event_input_types(data_inputs)
+        )
+        duplicate_names = set(self.topic_names).intersection(self.data_names)
+        if duplicate_names:
+            raise ValueError(
+                "Invalid Event ABI:  The following argument names are duplicated "
+                "between event inputs: '{0}'".format(', '.join(duplicate_names))
+            )
+
+        # indexed arguments always fit in a topic word, data arguments only if all of
+        # them are static
+        self.topic_decoders = [_word_decoder(t) for t in self.topic_types]
+        self.data_decoders = [_word_decoder(t) for t in self.data_types]
+        if None in self.data_decoders:
+            self.data_decoders = None
+
+    def decode_args(self, log: Dict[str, Any]) -> Dict[str, Any]:
+        topics = log['topics'] if self.anonymous else log['topics'][1:]
+        if len(topics) != len(self.topic_types):
+            raise ValueError("Expected {0} log topics.  Got {1}".format(
+                len(self.topic_types),
+                len(topics),
+            ))
+
+        args = {}
+        for name, abi_type, decoder, topic in zip(
+                self.topic_names, self.topic_types, self.topic_decoders, topics
+        ):
+            topic = _to_bytes(topic)
+            if decoder is None:
+                args[name] = self._decode_slow([abi_type], [decode_single(abi_type, topic)])[0]
+            else:
+                args[name] = decoder(topic)
+
+        data = _to_bytes(log['data'])
+        if self.data_decoders is None:
+            values = self._decode_slow(self.data_types, decode_abi(self.data_types, data))
+        else:
+            values = [
+                decoder(data[i * WORD_SIZE:(i + 1) * WORD_SIZE])
+                for i, decoder in enumerate(self.data_decoders)
+            ]
+        args.update(zip(self.data_names, values))
+        return args
+
+    @staticmethod
+    def _decode_slow(types: List[str], values: List[Any]) -> List[Any]:
+        return map_abi_data(BASE_RETURN_NORMALIZERS, types, values)
+
+    def decode(self, log: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: copy of the log with the decoded `args` and the `event` name
+        """
+        log = dict(log)
+        log['args'] = self.decode_args(log)
+        log['event'] = self.name
+        return log
+
+
+def make_event_decoders(abi: List[Dict[str, Any]]) -> Dict[str, EventDecoder]:
+    """
+    Returns:
+        dict: the decoders of the events of a contract ABI by their topic (lower case hex)
+    """
+    decoders = {}
+    for abi_element in abi:
+        if abi_element['type'] == 'event':
+            decoder = EventDecoder(abi_element)
+            decoders[decoder.topic] = decoder
+    return decoders
+
+
+# contract => {topic: decoder}
+_decoders = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+
+
+def get_event_decoders(contract: Contract) -> Dict[str, EventDecoder]:
+    """
+    Returns:
+        dict: the decoders of the events of a contract by their topic (lower case hex),
+            compiled on the first call for the contract
+    """
+    try:
+        return _decoders[contract]
+    except KeyError:
+        pass
+    decoders = make_event_decoders(contract.abi)
+    _decoders[contract] = decoders
+    return decoders
+
+
+def decode_event(decoders: Dict[str, EventDecoder], log: Dict[str, Any]) -> Dict[str, Any]:
+    """Decode a log with the decoder of the event in its topic 0."""
+    topic = log['topics'][0]
+    topic = encode_hex(topic) if isinstance(topic, bytes) else topic.lower()
+    return decoders[topic].decode(log)
@@ -1,6 +1,6 @@
 from web3.utils.filters import construct_event_filter_params
-import functools
-from web3.utils.events import get_event_data
+
+from .event_decoder import EventDecoder
 
 
 class LogFilter:
@@ -41,11 +41,11 @@ class LogFilter:
             argument_filters=filters,
             **filter_kwargs
         )
-        log_data_extract_fn = functools.partial(get_event_data, event_abi)
+        self.decoder = EventDecoder(self.event_abi)
 
         self.filter = web3.eth.filter(filter_params)
         self.filter.set_data_filters(data_filter_set)
-        self.filter.log_entry_formatter = log_data_extract_fn
+        self.filter.log_entry_formatter = self.decoder.decode
         self.filter.filter_params = filter_params
 
     def init(self, post_callback=None):
@@ -63,7 +63,7 @@ class LogFilter:
         return formatted_logs
 
     def set_log_data(self, log):
-        log['args'] = get_event_data(self.event_abi, log)['args']
+        log['args'] = self.decoder.decode_args(log)
         log['event'] = self.event_name
         return log
 
@@ -0,0 +1,191 @@
+"""HTTP provider that spreads requests over several Ethereum nodes."""
+import logging
+import time
+from typing import Any, Dict, List
+
+import requests
+from web3 import HTTPProvider
+from web3.providers.base import JSONBaseProvider
+from web3.utils.request import make_post_request
+
+log = logging.getLogger(__name__)
+
+# methods that change the state of the chain, sent to all nodes or to the primary
+WRITE_METHODS = {'eth_sendRawTransaction', 'eth_sendTransaction'}
+
+
+class Endpoint(object):
+    """Request statistics of a node."""
+
+    def __init__(self, uri: str, smoothing: float):
+        self.uri = uri
+        self.smoothing = smoothing
+        # moving averages of the response time of successful requests and of failures
+        self.latency = None  # type: float
+        self.error_rate = 0.0
+        self.n_requests = 0
+        self.n_errors = 0
+        # the node isn't used until then, unless all nodes are down
+        self.down_until = 0.0
+
+    def is_up(self, now: float) -> bool:
+        return self.down_until <= now
+
+    def record_success(self, latency: float):
+        self.n_requests += 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+        self.error_rate -= self.smoothing * self.error_rate
+
+    def record_failure(self, retry_at: float):
+        self.n_requests += 1
+        self.n_errors += 1
+        self.error_rate += self.smoothing * (1 - self.error_rate)
+        self.down_until = retry_at
+
+    def metrics(self, now: float) -> dict:
+        return {
+            'uri': self.uri,
+            'up': self.is_up(now),
+            'latency': self.latency,
+            'error_rate': self.error_rate,
+            'requests': self.n_requests,
+            'errors': self.n_errors
+        }
+
+
+class MultiHTTPProvider(HTTPProvider):
+    """HTTP provider with several Ethereum nodes.
+
+    Reads go to the node with the lowest response time. A node that fails a request
+    (connection error, timeout, HTTP error) is skipped for `retry_interval` seconds and
+    the request is retried on the next node. Nodes that haven't answered yet are tried
+    first, so that their response time is known. Transactions are sent to all nodes, or
+    only to `primary` if it's set.
+
+    JSON-RPC errors are answers of the node and are returned like by `HTTPProvider`.
+    """
+
+    def __init__(
+            self,
+            endpoint_uris: List[str],
+            request_kwargs: Dict[str, Any] = None,
+            primary: str = None,
+            retry_interval: float = 10,
+            smoothing: float = 0.2
+    ):
+        """
+        Args:
+            endpoint_uris (list): URLs of the nodes
+            request_kwargs (dict, optional): passed to `requests`, like for `HTTPProvider`
+            primary (str, optional): URL of the node transactions are sent to. If not set,
+                they're sent to all nodes.
+            retry_interval (float, optional): seconds a failed node is skipped
+            smoothing (float, optional): weight of a new sample in the moving averages
+                of the response time and the error rate
+        """
+        assert endpoint_uris
+        assert primary is None or primary in endpoint_uris
+        assert 0 < smoothing <= 1
+        # HTTPProvider.__init__ would set the endpoint_uri property
+        JSONBaseProvider.__init__(self)
+        self._request_kwargs = request_kwargs or {}
+        self.endpoints = [Endpoint(uri, smoothing) for uri in endpoint_uris]
+        self.primary = primary
+        self.retry_interval = retry_interval
+
+    def __str__(self):
+        return 'RPC connection {0}'.format(', '.join(self.endpoint_uris))
+
+    @property
+    def endpoint_uris(self) -> List[str]:
+        return [endpoint.uri for endpoint in self.endpoints]
+
+    @property
+    def endpoint_uri(self) -> str:
+        """URL of the node reads are sent to next."""
+        return self._ranked_endpoints()[0].uri
+
+    def _ranked_endpoints(self) -> List[Endpoint]:
+        """Nodes ordered by preference: nodes that are up by response time, then nodes
+        that are down by the time they're due to be retried."""
+        now = time.time()
+        return sorted(
+            self.endpoints,
+            key=lambda endpoint: (
+                not endpoint.is_up(now),
+                endpoint.down_until if not endpoint.is_up(now) else 0,
+                endpoint.latency or 0
+            )
+        )
+
+    def _post(self, endpoint: Endpoint, request_data: bytes) -> bytes:
+        t_start = time.time()
+        try:
+            response = make_post_request(endpoint.uri, request_data, **self.get_request_kwargs())
+        except requests.exceptions.RequestException:
+            endpoint.record_failure(time.time() + self.retry_interval)
+            raise
+        endpoint.record_success(time.time() - t_start)
+        return response
+
+    def make_batch_request(self, request_data: bytes) -> bytes:
+        """Send an encoded read request (or batch of requests) to the fastest node,
+        failing over to the other nodes.
+
+        Raises:
+            requests.exceptions.ConnectionError: if all nodes failed
+        """
+        errors = []
+        for endpoint in self._ranked_endpoints():
+            try:
+                return self._post(endpoint, request_data)
+            except requests.exceptions.RequestException as e:
+                log.warning('request to %s failed: %s', endpoint.uri, e)
+                errors.append(e)
+        raise requests.exceptions.ConnectionError('all nodes failed: %s' % errors)
+
+    def send_transaction_request(self, request_data: bytes) -> bytes:
+        """Send an encoded transaction to the primary node, or to all nodes.
+
+        If it's sent to all nodes, the first answer is returned.
+
+        Raises:
+            requests.exceptions.ConnectionError: if no node accepted the request
+        """
+        if self.primary is not None:
+            endpoints = [e for e in self.endpoints if e.uri == self.primary]
+        else:
+            endpoints = self._ranked_endpoints()
+        response = None
+        errors = []
+        for endpoint in endpoints:
+            try:
+                endpoint_response = self._post(endpoint, request_data)
+            except requests.exceptions.RequestException as e:
+                log.warning('sending a transaction to %s failed: %s', endpoint.uri, e)
+                errors.append(e)
+                continue
+            if response is None:
+                response = endpoint_response
+        if response is None:
+            raise requests.exceptions.ConnectionError('all nodes failed: %s' % errors)
+        return response
+
+    def make_request(self, method, params):
+        request_data = self.encode_rpc_request(method, params)
+        if method in WRITE_METHODS:
+            raw_response = self.send_transaction_request(request_data)
+        else:
+            raw_response = self.make_batch_request(request_data)
+        return self.decode_rpc_response(raw_response)
+
+    def metrics(self) -> dict:
+        now = time.time()
+        return {
+            'current': self.endpoint_uri,
+            'primary': self.primary,
+            'endpoints': [endpoint.metrics(now) for endpoint in self.endpoints]
+        }
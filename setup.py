@@ -115,7 +115,11 @@ config = {
     'license': 'MIT',
     'keywords': 'raiden ethereum microraiden blockchain',
     'install_requires': read_requirements('requirements.txt'),
-    'extras_require': {'dev': read_requirements('requirements-dev.txt')},
+    'extras_require': {
+        'dev': read_requirements('requirements-dev.txt'),
+        # subscriptions to new blocks over a websocket
+        'websocket': ['websocket-client>=0.44.0']
+    },
     'packages': find_packages(exclude=['test']),
     'package_data': {'microraiden': ['data/contracts.json',
                                      'webui/js/*',